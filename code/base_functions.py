@@ -1,71 +1,87 @@
-from utils import probabilities_from_weights
+from functools import lru_cache
+import numpy as np
+from utils import probabilities_from_weights, vectorized
 from constants import *
 
 def base_fire_func(state):
     """
-    Provides probabilities of employees being fired based on their performance levels.
+    Provides the rate of firing and a SumTree over employees weighted by their performance levels.
     """
-    employees = state.employees
-    num_employees = len(employees)
-    fire_weights = [0] * num_employees
-
-    for i, employee in enumerate(employees):
-        fire_weights[i] = employee.performance_level
-    fire_rate = sum(fire_weights)
-    return fire_rate * FIRE_RATE_COEFFICIENT, probabilities_from_weights(fire_weights)
+    fire_weights = state.weight_tree("performance")
+    return fire_weights.total * FIRE_RATE_COEFFICIENT, fire_weights
 
 def base_quit_func(state):
     """
-    Provides probabilities of employees quitting based on their bias scores.
+    Provides the rate of quitting and a SumTree over employees weighted by their bias scores.
     """
-    employees = state.employees
-    num_employees = len(employees)
-    bias_weights = [0] * num_employees
-
-    for i, employee in enumerate(employees):
-        bias_weights[i] = employee.bias_score
-    quit_rate = sum(bias_weights)
-    return quit_rate, probabilities_from_weights(bias_weights)
+    bias_weights = state.weight_tree("bias")
+    return bias_weights.total, bias_weights
 
-def base_promotion_func(state, employees, level, identities):
+@vectorized
+def base_promotion_func(state, candidates, level, identities):
     """
-    Provides probabilities of employees being promoted based on their performance levels, seniority, and identity similarity.
+    Provides probabilities of candidates being promoted based on their performance levels, seniority, and identity similarity.
     """
-    num_employees = len(employees)
-    promotion_weights = [0] * num_employees
-
-    # Calculate identity weights
-    identity_weights = {identity: 0 for identity in identities}
-    for employee in state.employees:
-        if employee.position_level == level:
-            identity_weights[employee.identity] += 1
-    
-    max_identity_weight = max(identity_weights.values()) if identity_weights else 1
-    max_experience = max(e.position_experience for e in employees) if employees else 1
-
-    for i, employee in enumerate(employees):
-        normalized_experience = employee.position_experience / max_experience
-        normalized_identity = identity_weights[employee.identity] / max_identity_weight
-        promotion_weights[i] = (
-            PERFORMACE_LEVEL_WEIGHT * employee.performance_level +
-            POSITION_EXPERIENCE_WEIGHT * normalized_experience +
-            IDENTITY_SIMILARITY_WEIGHT * normalized_identity
-        )
+    # Identity weights by state identity code, from the headcounts at the level being filled
+    identity_weights = np.zeros(len(state.identities), dtype=np.float64)
+    for identity in identities:
+        code = state.identity_index.get(identity)
+        if code is not None:
+            identity_weights[code] = state.get_count(level, identity)
+
+    max_identity_weight = identity_weights.max(initial=0)
+    max_experience = candidates.max_position_experience
+
+    normalized_experience = _normalize(candidates.position_experience, max_experience)
+    normalized_identity = _normalize(identity_weights[candidates.identity_codes], max_identity_weight)
+    promotion_weights = (
+        PERFORMACE_LEVEL_WEIGHT * candidates.performance +
+        POSITION_EXPERIENCE_WEIGHT * normalized_experience +
+        IDENTITY_SIMILARITY_WEIGHT * normalized_identity
+    )
 
     return probabilities_from_weights(promotion_weights)
 
-def base_bias_func(employee):
-    identity_bias = {
-        "M": MAN_BIAS,  
-        "F": WOMAN_BIAS,  
-    }
-    identity_bias_score = identity_bias.get(employee.identity, 0)
-    
+def _normalize(values, maximum):
+    # Everyone at 0 (e.g. all just promoted) normalizes to 0 instead of dividing by zero
+    return values / maximum if maximum > 0 else np.zeros_like(values)
+
+def identity_bias(identity, identity_biases=None):
+    """
+    Bias score of an identity: its entry in IDENTITY_BIASES or, for a compound identity without one, the
+    product of its attributes' entries. Identities with no known attribute have no bias.
+    """
+    identity_biases = IDENTITY_BIASES if identity_biases is None else identity_biases
+    if identity in identity_biases:
+        return identity_biases[identity]
+    known = [identity_biases[attribute] for attribute in identity.split(IDENTITY_SEPARATOR) if attribute in identity_biases]
+    return float(np.prod(known)) if known else 0
+
+# Cached per identities and per the items of IDENTITY_BIASES, so a changed IDENTITY_BIASES is picked up on the next call
+@lru_cache
+def _identity_bias_table(identities, identity_biases):
+    return np.array([identity_bias(identity, dict(identity_biases)) for identity in identities], dtype=np.float64)
+
+@vectorized
+def base_bias_func(identity_codes, levels, identities):
+    """
+    Provides the bias experienced by each employee based on their identity and position level.
+    """
+    identity_bias_score = _identity_bias_table(tuple(identities), tuple(IDENTITY_BIASES.items()))[identity_codes]
+
     # Add bias based on position level (e.g., more bias at higher levels)
-    level_bias = LEVEL_BIAS_COEFFICIENT * (employee.position_level + 1)
-    total_bias = identity_bias_score * level_bias 
+    level_bias = LEVEL_BIAS_COEFFICIENT * (levels + 1)
+    total_bias = identity_bias_score * level_bias
     return total_bias
 
+def scalar_bias_func(employee):
+    """
+    Per-employee version of `base_bias_func`, for use inside scalar bias functions.
+    """
+    identity_bias_score = identity_bias(employee.identity)
+    level_bias = LEVEL_BIAS_COEFFICIENT * (employee.position_level + 1)
+    return identity_bias_score * level_bias
+
 # def base_hire_func(state, identities):
 #     identity_weights = {identity: 0 for identity in identities}
 #     for employee in state.employees:
@@ -77,31 +93,21 @@ def base_bias_func(employee):
 #     return identity_probabilities
 
 def base_hire_func(state, identities, population_percentages):
-    identity_counts = {identity: 0 for identity in identities}
-    for employee in state.employees:
-        identity_counts[employee.identity] += 1
-    total_employees = sum(identity_counts.values())
+    company_counts = state.get_identity_counts()
+    identity_counts = np.array([company_counts.get(identity, 0) for identity in identities], dtype=np.float64)
+    total_employees = identity_counts.sum()
 
     if total_employees == 0:
         # If no employees at level 0, fallback to uniform percentages
-        company_probabilities = {identity : 1 / len(identities) for identity in identities}
+        company_probabilities = np.full(len(identities), 1 / len(identities))
     else:
-        company_probabilities = {
-            identity : identity_counts[identity] / total_employees for identity in identities
-        }
+        company_probabilities = identity_counts / total_employees
 
-    hiring_probabilities = []
-    for identity in identities:
-        global_percentage = population_percentages.get(identity, 0)
-        company_percentage = company_probabilities.get(identity, 0)
-        blended_probability = (
-            (1 - HIRING_HOMOPHILY_WEIGHT) * global_percentage + HIRING_HOMOPHILY_WEIGHT * company_percentage
-        )
-        hiring_probabilities.append(blended_probability)
-
-    total_probability = sum(hiring_probabilities)
+    global_percentages = np.array([population_percentages.get(identity, 0) for identity in identities], dtype=np.float64)
+    hiring_probabilities = (1 - HIRING_HOMOPHILY_WEIGHT) * global_percentages + HIRING_HOMOPHILY_WEIGHT * company_probabilities
+
+    total_probability = hiring_probabilities.sum()
     if total_probability > 0:
-        hiring_probabilities = [p / total_probability for p in hiring_probabilities]
+        hiring_probabilities = hiring_probabilities / total_probability
 
     return hiring_probabilities
-
@@ -1,8 +1,15 @@
-from model import Model
+import numpy as np
+from model import DEPARTURE_EVENTS, Model
+from event_log import EventLog
+from channels import maternity_channel
+from state import HISTORY_LENGTH
 from constants import *
 from base_functions import *
+from utils import SumTree, choose, is_vectorized, sample_without_replacement, selection_probabilities
 
 class BaseModel(Model):
+    checkpoint_attributes = ("time", "next_id", "log", "streams")
+
     def __init__(
             self, 
             leave_rate=LEAVE_RATE,
@@ -16,10 +23,21 @@ class BaseModel(Model):
             num_levels=NUM_LEVELS, 
             level_populations=LEVEL_POPULATIONS,
             population_percentages=IDENTITY_POPULATION_PERCENTAGES,
-            quotas=None
+            quotas=None,
+            tau_leap_epsilon=TAU_LEAP_EPSILON,
+            history=None,
+            history_length=HISTORY_LENGTH,
+            identity_channels=None,
+            rng=None,
+            streams=None
             ):
         self.leave_rate = leave_rate
         self.maternity_leave_rate = maternity_leave_rate
+        # Identity-specific events, by default maternity leave for "F" at `maternity_leave_rate`
+        self.identity_channels = [maternity_channel(maternity_leave_rate)] if identity_channels is None else list(identity_channels)
+        self.event_types = DEPARTURE_EVENTS + [channel.name for channel in self.identity_channels]
+        if len(set(self.event_types)) < len(self.event_types):
+            raise ValueError(f"Event types must be unique ({self.event_types}).")
 
         self.quit_func = quit_func
         self.fire_func = fire_func
@@ -32,117 +50,377 @@ class BaseModel(Model):
         self.level_populations = level_populations
         self.population_percentages = population_percentages
         self.quotas = quotas
+        self.tau_leap_epsilon = tau_leap_epsilon
+        self.history = history
+        self.history_length = history_length
+        self.rng = RNG if rng is None else rng
+        self.streams = streams
 
         self.next_id = sum(level_populations)
         self.all_employees = []
         self.time = 0
-        self.log = []
+        self.log = EventLog(identities)
+        self.stats = None
+
+    def initial_state(self, state_init):
+        """
+        Copies `state_init` and, when the model sets a history policy, switches the copy to it.
+        """
+        state = state_init.copy()
+        if self.history is not None:
+            state.set_history(self.history, self.history_length)
+        return state
 
     def transition_rate(self, state):
         return sum(self.get_rates(state))
     
     def get_rates(self, state):
+        """
+        Rates of the fire, quit and leave events followed by those of the identity channels, in `event_types` order.
+        """
         fire_rate, _ = self.fire_func(state)
         quit_rate, _ = self.quit_func(state)
-        leave_rate = self.leave_rate * len(state.employees)
-        maternity_leave_rate = self.maternity_leave_rate * sum(state.get_count(level, "F") for level in range(self.num_levels))
-        return fire_rate, quit_rate, leave_rate, maternity_leave_rate
+        leave_rate = self.leave_rate * len(state)
+        return (fire_rate, quit_rate, leave_rate, *(channel.total_rate(state) for channel in self.identity_channels))
+
+    def rate_details(self, rates):
+        """
+        Rates as logged: fire, quit, leave and the total of the identity channels.
+        """
+        return (*rates[:len(DEPARTURE_EVENTS)], sum(rates[len(DEPARTURE_EVENTS):]))
 
     def sample_next(self, state, time_delta):
+        stats = self.stats
         # Update the state
         state.update(time_delta, self.bias_func)
         if self.time != state.time:
             raise ValueError("Model time does not match state time.")
+        if stats is not None:
+            stats.lap("update")
         
-        fire_rate, quit_rate, leave_rate, maternity_leave_rate = self.get_rates(state)
-        rate = fire_rate + quit_rate + leave_rate + maternity_leave_rate
-        rate_details = (fire_rate, quit_rate, leave_rate, maternity_leave_rate)
-
-        # Determine the event type
-        event_prob = RNG.random()
-        if event_prob < fire_rate / rate:
-            event_type = "fire"
-            event_details = self.fire(state)
-        elif event_prob < (fire_rate + quit_rate) / rate:
-            event_type = "quit"
-            event_details = self.quit(state)
-        elif event_prob < (fire_rate + quit_rate + leave_rate) / rate:
-            event_type = "leave"
-            event_details = self.leave(state)
+        rates = self.get_rates(state)
+        rate_details = self.rate_details(rates)
+        if stats is not None:
+            stats.lap("rates")
+
+        # Determine the event type. Departure events are simulated by the method of the same name.
+        event_index = self.select_event(rates)
+        event_type = self.event_types[event_index]
+        if event_index < len(DEPARTURE_EVENTS):
+            event_details = getattr(self, event_type)(state)
         else:
-            event_type = "maternity_leave"
-            event_details = self.maternity_leave(state)
+            event_details = self.identity_event(state, self.identity_channels[event_index - len(DEPARTURE_EVENTS)])
+        if stats is not None:
+            stats.count_events(event_type)
+            stats.lap("selection")
 
         self.log_event(event_type, state.time, event_details, rate_details)
+        if stats is not None:
+            stats.lap("log")
         return state
 
     def hire(self, state):
         new_id = self.next_id
         self.next_id += 1
-        identity_probabilities = self.identity_probabilities_func(state, self.identities, self.population_percentages)
-        new_employee = state.hire_employee(new_id, self.identities, identity_probabilities) # Consider coming up with different ways to assign performance levels
-        return [(new_employee, 0)]
+        identity_probabilities = selection_probabilities(
+            self.identity_probabilities_func(state, self.identities, self.population_percentages), len(self.identities))
+        new_employee = state.hire_employee(new_id, self.identities, identity_probabilities, rng=self.stream("hiring")) # Consider coming up with different ways to assign performance levels
+        return [(new_employee.id, new_employee.identity, -1, 0)]
 
-    def promote(self, state, level, event_details=[]):
+    def promote(self, state, level):
+        """
+        Fills a vacancy at `level` and the chain of vacancies it leaves below, from `level` down to a hire.
+        When no one can be promoted into a level, the chain stops there and leaves that vacancy open.
+        Returns the (employee_id, identity, from_level, to_level) moves.
+        """
         if level < 1:
             raise ValueError("Cannot promote to lowest level.")
-        
-        must_promote_identity = None
+        moves = []
+        for level in range(level, 0, -1):
+            slot = self.select_promotion(state, level)
+            if slot is None:
+                return moves
+            moves.append(self.promote_slot(state, slot))
+        return moves + self.hire(state)
+
+    def promote_slot(self, state, slot):
+        """
+        Promotes the employee in row `slot` and returns their move.
+        """
+        level = int(state.levels[slot])
+        move = (int(state.ids[slot]), state.identities[state.identity_codes[slot]], level, level + 1)
+        state.promote_slot(slot)
+        return move
+
+    def promotion_candidates(self, state, level):
+        """
+        Candidates for a vacancy at `level`: everyone one level below, or only those of the first
+        identity under its quota at `level`.
+        """
+        code = None
         if self.quotas is not None:
             for identity in self.identities:
                 if state.get_count(level, identity) < self.quotas[level]:
-                    must_promote_identity = identity
+                    code = state.identity_index.get(identity, -1)
                     break
-        promotable_employees = [
-            e for e in state.employees
-            if e.position_level is not None
-            and e.position_level == level - 1
-            and (must_promote_identity is None or e.identity == must_promote_identity)
-        ]
-        if not promotable_employees:
-            return None
+        return state.candidates(level, code)
 
-        # Generate promotion probabilities
-        promotion_probabilities = self.promotion_probability_func(state, promotable_employees, level, self.identities)
-        employee = RNG.choice(promotable_employees, p=promotion_probabilities)
-        state.promote_employee(employee)
+    def promotion_selection(self, state, candidates, level):
+        """
+        Calls the promotion function with the candidates, or with Employee snapshots of them when it is not
+        vectorized. Returns its result: a probability vector over the candidates or the index of the chosen one.
+        """
+        if is_vectorized(self.promotion_probability_func):
+            return self.promotion_probability_func(state, candidates, level, self.identities)
+        employees = [state.employee_at(slot, with_history=False) for slot in candidates.slots]
+        return self.promotion_probability_func(state, employees, level, self.identities)
 
-        event_details.append((employee, level))
+    def select_promotion(self, state, level):
+        """
+        Row of the employee chosen to fill a vacancy at `level`, or None when there are no candidates.
+        """
+        candidates = self.promotion_candidates(state, level)
+        if len(candidates) == 0:
+            return None
+        selection = self.promotion_selection(state, candidates, level)
+        return int(candidates.slots[choose(selection, self.stream("promotion"))])
 
-        return event_details + self.hire(state) if level == 1 else self.promote(state, level - 1, event_details) # This might not work as intended
-    
     def remove_employee(self, state, employee):
+        stats = self.stats
+        if stats is not None:
+            stats.lap("selection")
         level = employee.position_level
         state.remove_employee(employee, state.time)
-        return self.hire(state) if level == 0 else self.promote(state, level)
+        cascade = self.hire(state) if level == 0 else self.promote(state, level)
+        if stats is not None:
+            stats.cascade(cascade)
+            stats.lap("cascade")
+        return [(employee.id, employee.identity, level, -1)] + (cascade or [])
 
-    def fire(self, state):
-        _, fire_probs = self.fire_func(state)
-        for prob in fire_probs:
+    def select_employee(self, state, weights):
+        """
+        Samples a row either from a SumTree or from a vector of probabilities over rows.
+        """
+        rng = self.stream("departures")
+        if isinstance(weights, SumTree):
+            return weights.sample(rng)
+        for prob in weights:
             if prob < 0 or prob > 1:
                 raise ValueError(f"Probabilities must be between 0 and 1 ({prob}).")
-        employee_id = RNG.choice(state.employee_ids, p=fire_probs)
-        employee = state.get_employee(employee_id)
+        return rng.choice(len(state), p=weights)
+
+    def fire(self, state):
+        _, fire_weights = self.fire_func(state)
+        employee = state.employee_at(self.select_employee(state, fire_weights))
         return self.remove_employee(state, employee)
     
     def quit(self, state):
-        _, quit_probs = self.quit_func(state)
-        employee_id = RNG.choice(state.employee_ids, p=quit_probs)
-        employee = state.get_employee(employee_id)
+        _, quit_weights = self.quit_func(state)
+        employee = state.employee_at(self.select_employee(state, quit_weights))
         return self.remove_employee(state, employee)
     
     def leave(self, state):
-        employee = RNG.choice(state.employees)
+        employee = state.employee_at(self.stream("departures").integers(len(state)))
         return self.remove_employee(state, employee)
     
-    def maternity_leave(self, state):
-        female_employees = [employee for employee in state.employees if employee.identity == "F"]
-        employee = RNG.choice(female_employees)
-        employee.update_bias(MATERNITY_BIAS, 1)
-        return self.remove_employee(state, employee) if RNG.random() > MATERNITY_RETURN else [] 
+    def identity_event(self, state, channel):
+        """
+        An employee drawn uniformly from the channel's members has its event, which adds the channel's bias.
+        They then leave, unless they return.
+        """
+        rng = self.stream("departures")
+        slot = channel.sample(state, rng)
+        employee_id = int(state.ids[slot])
+        if channel.bias:
+            state.update_bias(employee_id, channel.bias, 1)
+        if rng.random() > channel.return_probability:
+            return self.remove_employee(state, state.employee_at(slot))
+        return self.slot_moves(state, [slot], leaving=False)
     
+    ### TAU LEAPING ###
+    def channel_weights(self, state):
+        """
+        Per-row rates of each departure channel, in row order. Each array sums to the channel's rate.
+        """
+        def rate_weights(rate, weights):
+            if isinstance(weights, SumTree):
+                weights = weights.weights
+                total = weights.sum()
+                return weights * (rate / total) if total > 0 else np.full(len(weights), rate / max(len(weights), 1))
+            return np.asarray(weights, dtype=np.float64) * rate
+
+        fire_rate, fire_weights = self.fire_func(state)
+        quit_rate, quit_weights = self.quit_func(state)
+        weights = {
+            "fire": rate_weights(fire_rate, fire_weights),
+            "quit": rate_weights(quit_rate, quit_weights),
+            "leave": np.full(len(state), float(self.leave_rate)),
+        }
+        for channel in self.identity_channels:
+            weights[channel.name] = channel.rate * channel.member_mask(state)
+        return weights
+
+    def drift_rates(self, state):
+        """
+        (values, rates) of the columns that drift between events, per row: position experience,
+        performance and, for vectorized bias functions, bias.
+        """
+        performance = state.performance
+        performance_rates = state.position_experience * PERFORMANCE_INCREASE_RATE - state.bias * PERFORMANCE_DECREASE_RATE
+        # Performance clipped at 0 or 1 stays there
+        clipped = ((performance >= 1) & (performance_rates > 0)) | ((performance <= 0) & (performance_rates < 0))
+        drifts = [
+            (state.position_experience, np.ones(len(state))),
+            (performance, np.where(clipped, 0, performance_rates)),
+        ]
+        if is_vectorized(self.bias_func):
+            biases = self.bias_func(state.identity_codes, state.levels, state.identities)
+            drifts.append((state.bias, biases * BIAS_RATE_COEFFICIENT))
+        return drifts
+
+    def leap_size(self, state, rate):
+        """
+        Picks a leap so that, in every level, the expected departures stay below `tau_leap_epsilon` of
+        its headcount and each drifting column (see `drift_rates`) changes by at most `tau_leap_epsilon`
+        of its total, capped at TAU_LEAP_MAX_STEP. Returns None when the leap would hold fewer than
+        TAU_LEAP_MIN_EVENTS events, where exact steps are cheaper and exact.
+        """
+        if self.tau_leap_epsilon is None or len(state) == 0:
+            return None
+        num_levels = state.counts.shape[0]
+        departure_rates = sum(self.channel_weights(state).values())
+        bounds = [(state.counts.sum(axis=1), np.bincount(state.levels, weights=departure_rates, minlength=num_levels))]
+        for values, rates in self.drift_rates(state):
+            bounds.append((
+                np.bincount(state.levels, weights=np.abs(values), minlength=num_levels),
+                np.bincount(state.levels, weights=np.abs(rates), minlength=num_levels),
+            ))
+        tau = TAU_LEAP_MAX_STEP
+        for totals, rates in bounds:
+            changing = rates > 0
+            if changing.any():
+                tau = min(tau, self.tau_leap_epsilon * np.min(totals[changing] / rates[changing]))
+        return tau if rate * tau >= TAU_LEAP_MIN_EVENTS else None
+
+    def sample_leap(self, state, tau):
+        """
+        Advances the state by a leap of length `tau`. The number of events of each channel is Poisson
+        with the channel's rate, and they happen to distinct employees drawn by the channel's weights.
+        The resulting vacancies are then filled in bulk, from the top level down, by promotions and hires.
+        """
+        stats = self.stats
+        state.update(tau, self.bias_func)
+        if self.time != state.time:
+            raise ValueError("Model time does not match state time.")
+        if stats is not None:
+            stats.lap("update")
+
+        weights = self.channel_weights(state)
+        rate_details = self.rate_details([float(channel.sum()) for channel in weights.values()])
+        if stats is not None:
+            stats.lap("rates")
+        available = np.ones(len(state), dtype=bool)
+        event_counts = {}
+        departing = []
+        returning = []
+        returning_types = []
+        for index, (event_type, channel) in enumerate(weights.items()):
+            channel = np.where(available, channel, 0)
+            num_events = min(self.stream("events").poisson(channel.sum() * tau), np.count_nonzero(channel))
+            slots = sample_without_replacement(channel, num_events, self.stream("departures"))
+            available[slots] = False
+            event_counts[event_type] = len(slots)
+            if index >= len(DEPARTURE_EVENTS):
+                identity_channel = self.identity_channels[index - len(DEPARTURE_EVENTS)]
+                if identity_channel.bias:
+                    for slot in slots:
+                        state.update_bias(int(state.ids[slot]), identity_channel.bias, 1)
+                leaves = self.stream("departures").random(len(slots)) > identity_channel.return_probability
+                returning.extend(self.slot_moves(state, slots[~leaves], leaving=False))
+                returning_types.extend([event_type] * int(np.count_nonzero(~leaves)))
+                slots = slots[leaves]
+            departing.extend((slot, event_type) for slot in slots.tolist())
+
+        # Remove by id, as removals move rows
+        departing_slots = [slot for slot, _ in departing]
+        vacancies = np.bincount(state.levels[departing_slots], minlength=state.counts.shape[0])
+        departures = self.slot_moves(state, departing_slots)
+        move_types = [event_type for _, event_type in departing] + returning_types
+        for employee_id, _, _, _ in departures:
+            state.remove_employee(state.get_employee(employee_id), state.time)
+        if stats is not None:
+            stats.lap("selection")
+
+        cascade = []
+        for level in range(len(vacancies) - 1, 0, -1):
+            promoted = self.promote_many(state, level, vacancies[level])
+            cascade.extend(promoted)
+            vacancies[level - 1] += len(promoted)
+        for _ in range(vacancies[0]):
+            cascade.extend(self.hire(state))
+        if stats is not None:
+            stats.count("leaps")
+            for event_type, num_events in event_counts.items():
+                stats.count_events(event_type, num_events)
+            stats.count("promotions", int(len(cascade) - vacancies[0]))
+            stats.count("hires", int(vacancies[0]))
+            stats.lap("cascade")
+
+        # Departures and returns are logged under their channel, the promotions and hires they cause under "tau_leap"
+        move_types += ["tau_leap"] * len(cascade)
+        self.log.append_event("tau_leap", state.time, departures + returning + cascade, rate_details, move_types)
+        if stats is not None:
+            stats.lap("log")
+        return state
+
+    def promote_many(self, state, level, num_vacancies):
+        """
+        Fills up to `num_vacancies` vacancies at `level` from the level below, without filling the vacancies this leaves.
+        Returns the promotions as (employee_id, identity, from_level, to_level) moves.
+        """
+        promoted = []
+        # Promote one at a time while a quota is unmet, as each promotion may meet it.
+        # Promotions only add to `level`, so once every quota is met the rest can be drawn together.
+        while self.quotas is not None and len(promoted) < num_vacancies and any(
+                state.get_count(level, identity) < self.quotas[level] for identity in self.identities):
+            slot = self.select_promotion(state, level)
+            if slot is None:
+                return promoted
+            promoted.append(self.promote_slot(state, slot))
+
+        candidates = self.promotion_candidates(state, level)
+        if len(promoted) == num_vacancies or len(candidates) == 0:
+            return promoted
+        selection = self.promotion_selection(state, candidates, level)
+        if np.ndim(selection) > 0:
+            # Candidates the policy gives no chance are never promoted, even if that leaves vacancies open
+            num_promotions = min(num_vacancies - len(promoted), np.count_nonzero(selection))
+            for index in sample_without_replacement(selection, num_promotions, self.stream("promotion")):
+                promoted.append(self.promote_slot(state, candidates.slots[index]))
+            return promoted
+
+        # A policy that picks a single candidate is asked again for each vacancy
+        while True:
+            promoted.append(self.promote_slot(state, candidates.slots[choose(selection, self.stream("promotion"))]))
+            candidates = self.promotion_candidates(state, level)
+            if len(promoted) == num_vacancies or len(candidates) == 0:
+                return promoted
+            selection = self.promotion_selection(state, candidates, level)
+
+    def slot_moves(self, state, slots, leaving=True):
+        """
+        Moves of the employees in `slots` out of the company, or of them staying at their level.
+        """
+        return [
+            (int(state.ids[slot]), state.identities[state.identity_codes[slot]], int(state.levels[slot]), -1 if leaving else int(state.levels[slot]))
+            for slot in slots
+        ]
+
     def log_event(self, event_type, time, event_details, rate_details):
-        self.log.append((event_type, time, event_details, rate_details))
+        """
+        Logs an event given its (employee_id, identity, from_level, to_level) moves.
+        """
+        self.log.append_event(event_type, time, event_details, rate_details)
         
 
 
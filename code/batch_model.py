@@ -0,0 +1,505 @@
+"""
+Lockstep batched engine: R independent replicates of one BaseModel configuration advance together,
+one event per replicate per step, with every workforce held in replicates x employees arrays and every
+random draw made for all replicates at once.
+
+    model = BatchModel(level_populations=[50, 25, 10, 5], rng=np.random.default_rng(0))
+    state = BatchState.generate_initial_state(1000, [50, 25, 10, 5], IDENTITIES, [0.6, 0.4], rng=model.rng)
+    tensors = model.run(state, 100, record_interval=1)
+    values = tensor_metrics(tensors, IDENTITIES, IDENTITY_POPULATION_PERCENTAGES)  # Every metric, shape (R, T, ...)
+
+A departure is followed by a promotion cascade ending in a hire, so every replicate keeps a fixed
+number of rows, grouped into one block of columns per level: a promoted employee moves into the row
+left empty at the level above, and the hire takes the row the cascade leaves empty at level 0. Rows
+left empty by a cascade that finds no one to promote have level -1 and take no part in the run.
+
+The dynamics are those of BaseModel with its base fire, quit, hiring and promotion functions, a
+vectorized bias function, identity channels (see channels.py) and optional quotas. Replicates follow
+the same distribution as BaseModel runs, but not the same random draws.
+
+The rates come from per-replicate totals of performance, bias and bias accrual that are kept up to
+date, and each level of a promotion cascade only looks at the replicates with a vacancy there and at
+the columns of the level below. The update, the draw of the departing employees and the recording
+still pass over the whole replicates x employees arrays every step. At the defaults (90 employees,
+T=100, record_interval=1) 1,000 replicates take about 1.5-1.8s, as long as 15-20 single BaseModel
+runs with record=None or 8-11 with record="grid": cheaper per replicate, but not the handful of
+runs this engine aims for.
+"""
+import numpy as np
+from base_functions import base_bias_func
+from channels import maternity_channel
+from model import DEPARTURE_EVENTS
+from recording import grid_times
+from state import State
+from utils import is_vectorized
+from constants import *
+
+# Columns of a batch state, each of shape (replicates, employees)
+BATCH_COLUMNS = {
+    "ids": np.int64,
+    "identity_codes": np.int16,
+    "levels": np.int16,
+    "performance": np.float64,
+    "position_experience": np.float64,
+    "company_experience": np.float64,
+    "bias": np.float64,
+    "start_time": np.float64,
+}
+
+class BatchState:
+    """
+    Workforces of many replicates: one array of shape (replicates, employees) per column of
+    BATCH_COLUMNS, where row r holds replicate r, and one time per replicate. The columns of level l
+    are those from level_bounds[l] to level_bounds[l + 1] in every replicate; without `level_bounds`,
+    each replicate's rows are sorted by level, which needs the same headcount per level in every replicate.
+
+    Headcounts of shape (replicates, levels, identities) and the per-replicate totals of performance,
+    bias and bias accrual rate over the present rows are kept up to date alongside the columns by BatchModel.
+    """
+    def __init__(self, columns, identities, num_levels, time=None, level_bounds=None):
+        columns = {name: np.array(columns[name], dtype=dtype) for name, dtype in BATCH_COLUMNS.items()}
+        if level_bounds is None:
+            order = np.argsort(columns["levels"], axis=1, kind="stable")
+            columns = {name: np.take_along_axis(column, order, axis=1) for name, column in columns.items()}
+            headcounts = (columns["levels"][:, :, None] == np.arange(num_levels)).sum(axis=1)
+            if np.any(columns["levels"] < 0) or np.any(headcounts != headcounts[:1]):
+                raise ValueError("Without level_bounds, every replicate needs the same headcount at each level and no empty rows.")
+            level_bounds = np.concatenate([[0], np.cumsum(headcounts[0])]) if len(headcounts) else np.zeros(num_levels + 1)
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self.level_bounds = np.asarray(level_bounds, dtype=np.int64)
+        self.identities = list(identities)
+        self.identity_index = {identity: code for code, identity in enumerate(self.identities)}
+        self.num_levels = num_levels
+        self.time = np.zeros(len(self.ids)) if time is None else np.array(time, dtype=np.float64)
+        self.next_id = self.ids.max(axis=1) + 1 if self.ids.size else np.zeros(len(self.ids), dtype=np.int64)
+        self.num_vacant = int(np.count_nonzero(self.levels < 0))
+        self._counts = self._cell_sums().astype(np.int64)
+        self.performance_totals = np.sum(self.performance, axis=1, where=self.present)
+        self.bias_totals = np.sum(self.bias, axis=1, where=self.present)
+        # Bias accrual rate of every row (0 for empty rows) and their totals, filled in by BatchModel
+        self.bias_rates = None
+        self.bias_rate_totals = None
+
+    def copy(self):
+        state = BatchState({name: getattr(self, name) for name in BATCH_COLUMNS}, self.identities, self.num_levels, self.time, self.level_bounds)
+        state.next_id = self.next_id.copy()
+        return state
+
+    def level_columns(self, level):
+        """
+        Slice of the columns holding level `level` in every replicate.
+        """
+        return slice(int(self.level_bounds[level]), int(self.level_bounds[level + 1]))
+
+    @property
+    def num_replicates(self):
+        return self.ids.shape[0]
+
+    def __len__(self):
+        """
+        Number of rows per replicate.
+        """
+        return self.ids.shape[1]
+
+    @property
+    def present(self):
+        return self.levels >= 0
+
+    def _cells(self, rows=None):
+        """
+        Index of every row's cell among the cells of all the replicates in `rows`, one past the last for empty rows.
+        """
+        levels = self.levels if rows is None else self.levels[rows]
+        num_cells = self.num_levels * len(self.identities)
+        cells = levels.astype(np.int64)
+        cells *= len(self.identities)
+        cells += self.identity_codes if rows is None else self.identity_codes[rows]
+        cells += num_cells * np.arange(len(levels))[:, None]
+        if self.num_vacant:
+            cells[levels < 0] = len(levels) * num_cells
+        return cells
+
+    def _cell_sums(self, weights=None, rows=None, cells=None):
+        cells = self._cells(rows) if cells is None else cells
+        if weights is not None:
+            weights = (weights if rows is None else weights[rows]).ravel()
+        num_cells = len(cells) * self.num_levels * len(self.identities)
+        sums = np.bincount(cells.ravel(), weights=weights, minlength=num_cells + 1)
+        return sums[:num_cells].reshape(len(cells), self.num_levels, len(self.identities))
+
+    @property
+    def counts(self):
+        """
+        Headcounts of shape (replicates, levels, identities).
+        """
+        return self._counts.copy()
+
+    def cell_totals(self, column, rows=None):
+        """
+        Sum of a column (e.g. "performance") over the employees of each cell, indexed like `counts`,
+        for every replicate or only those in `rows`.
+        """
+        return self._cell_sums(getattr(self, column), rows)
+
+    def replicate(self, index):
+        """
+        The workforce of one replicate as a State.
+        """
+        present = self.present[index]
+        columns = {name: getattr(self, name)[index][present] for name in BATCH_COLUMNS}
+        return State.from_columns(columns, self.identities, time=float(self.time[index]))
+
+    @staticmethod
+    def from_state(state, num_replicates):
+        """
+        `num_replicates` copies of one State.
+        """
+        columns = {name: np.tile(getattr(state, name), (num_replicates, 1)) for name in BATCH_COLUMNS}
+        return BatchState(columns, state.identities, state.counts.shape[0], np.full(num_replicates, state.time))
+
+    @staticmethod
+    def generate_initial_state(num_replicates, level_populations, identities, identity_probabilities, performance_mean=0.5, performance_std=0.1, rng=None):
+        """
+        Independent initial states drawn like State.generate_initial_state, one per replicate.
+        """
+        rng = RNG if rng is None else rng
+        levels = np.repeat(np.arange(len(level_populations)), level_populations)
+        shape = (num_replicates, len(levels))
+        columns = {
+            "ids": np.tile(np.arange(len(levels)), (num_replicates, 1)),
+            "identity_codes": rng.choice(len(identities), size=shape, p=identity_probabilities),
+            "levels": np.tile(levels, (num_replicates, 1)),
+            "performance": np.clip(rng.normal(performance_mean, performance_std, size=shape), 0, 1),
+            "position_experience": np.zeros(shape),
+            "company_experience": np.zeros(shape),
+            "bias": np.zeros(shape),
+            "start_time": np.zeros(shape),
+        }
+        return BatchState(columns, identities, len(level_populations))
+
+def _choose(weights, u, fallback):
+    """
+    One column per row of `weights`, drawn proportionally to the row from the uniform draws `u`.
+    Rows without weight are drawn from the columns where `fallback` is True, uniformly.
+    """
+    cumulative = np.cumsum(weights, axis=1)
+    empty = cumulative[:, -1] <= 0
+    if empty.any():
+        cumulative[empty] = np.cumsum(fallback[empty], axis=1)
+    targets = u * cumulative[:, -1]
+    return np.minimum((cumulative <= targets[:, None]).sum(axis=1), weights.shape[1] - 1)
+
+def _safe_divide(numerator, denominator):
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=np.float64), denominator)
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+class BatchModel:
+    def __init__(
+            self,
+            leave_rate=LEAVE_RATE,
+            maternity_leave_rate=MATERNITY_LEAVE,
+            identities=IDENTITIES,
+            bias_func=base_bias_func,
+            level_populations=LEVEL_POPULATIONS,
+            population_percentages=IDENTITY_POPULATION_PERCENTAGES,
+            quotas=None,
+            identity_channels=None,
+            rng=None
+            ):
+        if not is_vectorized(bias_func):
+            raise ValueError("BatchModel needs a vectorized bias function.")
+        self.leave_rate = leave_rate
+        self.maternity_leave_rate = maternity_leave_rate
+        self.identity_channels = [maternity_channel(maternity_leave_rate)] if identity_channels is None else list(identity_channels)
+        self.event_types = DEPARTURE_EVENTS + [channel.name for channel in self.identity_channels]
+        if len(set(self.event_types)) < len(self.event_types):
+            raise ValueError(f"Event types must be unique ({self.event_types}).")
+        # Bias added and probability of staying, per event type
+        self.event_bias = np.array([0.0] * len(DEPARTURE_EVENTS) + [channel.bias for channel in self.identity_channels])
+        self.return_probability = np.array([0.0] * len(DEPARTURE_EVENTS) + [channel.return_probability for channel in self.identity_channels])
+        self.identities = identities
+        self.bias_func = bias_func
+        self.level_populations = level_populations
+        self.population_percentages = population_percentages
+        self.quotas = quotas
+        self.rng = RNG if rng is None else rng
+
+    def channel_members(self, state):
+        """
+        Whether each identity code of `state` belongs to each identity channel, shape (channels, identities).
+        """
+        members = np.zeros((len(self.identity_channels), len(state.identities)), dtype=bool)
+        for index, channel in enumerate(self.identity_channels):
+            members[index, channel.codes(state)] = True
+        return members
+
+    def get_rates(self, state):
+        """
+        Rates of every replicate in `event_types` order, shape (replicates, event types): fire, quit
+        and leave, then each identity channel's rate times its members' headcount. Built from the
+        totals and headcounts the state keeps, without a pass over its rows.
+        """
+        headcounts = np.einsum("rli->ri", state._counts)
+        channel_rates = np.array([channel.rate for channel in self.identity_channels])
+        return np.column_stack([
+            state.performance_totals * FIRE_RATE_COEFFICIENT,
+            # Kept by additions and subtractions, so rounding can leave it just below 0
+            np.maximum(state.bias_totals, 0),
+            self.leave_rate * headcounts.sum(axis=1),
+            headcounts @ self.channel_members(state).T * channel_rates,
+        ])
+
+    def _refresh_bias_rates(self, state, rows, slots):
+        bias_rates = self.bias_func(state.identity_codes[rows, slots], state.levels[rows, slots], state.identities)
+        state.bias_rate_totals[rows] += bias_rates - state.bias_rates[rows, slots]
+        state.bias_rates[rows, slots] = bias_rates
+
+    def update(self, state, delta_t):
+        """
+        State.update of every replicate by its own `delta_t`.
+        """
+        if state.bias_rates is None:
+            state.bias_rates = self.bias_func(state.identity_codes, state.levels, state.identities) * state.present
+            state.bias_rate_totals = state.bias_rates.sum(axis=1)
+        state.time += delta_t
+        state.bias_totals += state.bias_rate_totals * (delta_t * BIAS_RATE_COEFFICIENT)
+        delta_t = delta_t[:, None]
+        state.position_experience += delta_t
+        state.company_experience += delta_t
+        state.performance += delta_t * (state.position_experience * PERFORMANCE_INCREASE_RATE - state.bias * PERFORMANCE_DECREASE_RATE)
+        np.clip(state.performance, 0, 1, out=state.performance)
+        # Clipping makes the performance total nonlinear in delta_t, so it is summed here rather than updated
+        state.performance_totals = np.sum(state.performance, axis=1, where=state.present) if state.num_vacant else state.performance.sum(axis=1)
+        state.bias += state.bias_rates * (delta_t * BIAS_RATE_COEFFICIENT)
+
+    def step(self, state, live):
+        """
+        Simulates the next event of every `live` replicate. Returns each replicate's event type
+        (an index into `event_types`) and the number of promotions and hires it caused.
+        """
+        rng = self.rng
+        rows = np.arange(state.num_replicates)
+        present = state.present
+
+        # Event type, from the rates after the update like BaseModel.sample_next
+        rates = self.get_rates(state)
+        cumulative = np.cumsum(rates, axis=1)
+        event_types = np.minimum((cumulative <= (rng.random(len(rows)) * cumulative[:, -1])[:, None]).sum(axis=1), len(self.event_types) - 1)
+
+        # Departing employee, weighted by performance, bias, uniformly or uniformly among a channel's members
+        weights = np.empty(state.levels.shape)
+        members = self.channel_members(state)
+        for event_type in np.unique(event_types):
+            selected = np.flatnonzero(event_types == event_type)
+            if event_type == 0:
+                weights[selected] = state.performance[selected]
+            elif event_type == 1:
+                weights[selected] = state.bias[selected]
+            elif event_type == 2:
+                weights[selected] = 1
+            else:
+                weights[selected] = members[event_type - len(DEPARTURE_EVENTS)][state.identity_codes[selected]]
+        if state.num_vacant:
+            weights *= present
+        slots = _choose(weights, rng.random(len(rows)), present)
+
+        # A channel event adds the channel's bias, and the employee leaves unless they return
+        on_leave = np.flatnonzero(live & (event_types >= len(DEPARTURE_EVENTS)) & (state.levels[rows, slots] >= 0))
+        added_bias = self.event_bias[event_types[on_leave]] * BIAS_RATE_COEFFICIENT
+        state.bias[on_leave, slots[on_leave]] += added_bias
+        state.bias_totals[on_leave] += added_bias
+        returns = (event_types >= len(DEPARTURE_EVENTS)) & (rng.random(len(rows)) <= self.return_probability[event_types])
+        departing = np.flatnonzero(live & ~returns & (state.levels[rows, slots] >= 0))
+
+        # The departing employee's row is left empty, with no performance, bias or bias accrual
+        holes = np.full(len(rows), -1)
+        holes[departing] = slots[departing]
+        vacancies = np.full(len(rows), -1)
+        vacancies[departing] = state.levels[departing, holes[departing]]
+        state._counts[departing, vacancies[departing], state.identity_codes[departing, holes[departing]]] -= 1
+        state.levels[departing, holes[departing]] = -1
+        self._clear(state, departing, holes[departing])
+        promotions, hiring = self.cascade(state, vacancies, holes)
+        hires = self.hire(state, hiring, holes[hiring])
+
+        # Rows whose cascade found no one to promote stay empty
+        state.num_vacant += int(np.count_nonzero(vacancies[departing] < 0))
+        return event_types, promotions, hires
+
+    def _clear(self, state, rows, slots):
+        """
+        Takes the rows at `slots` out of the totals of their replicates, and zeroes their bias and bias accrual.
+        """
+        state.performance_totals[rows] -= state.performance[rows, slots]
+        state.bias_totals[rows] -= state.bias[rows, slots]
+        state.bias_rate_totals[rows] -= state.bias_rates[rows, slots]
+        state.bias[rows, slots] = 0
+        state.bias_rates[rows, slots] = 0
+
+    def cascade(self, state, vacancies, holes):
+        """
+        Fills the vacancy of every replicate at level `vacancies` (-1 for none), in the empty row `holes`,
+        by promotions from the level below, down to level 0. Each level is filled for all the replicates
+        with a vacancy there at once, from the columns of the level below only. Returns the number of
+        promotions per replicate and the replicates whose cascade reached level 0, whose empty row at
+        level 0 is left in `holes`.
+        """
+        promotions = np.zeros(state.num_replicates, dtype=np.int64)
+        masked = state.num_vacant > 0 or self.quotas is not None
+        for level in range(state.num_levels - 1, 0, -1):
+            rows = np.flatnonzero(vacancies == level)
+            columns = state.level_columns(level - 1)
+            if len(rows) == 0 or columns.start == columns.stop:
+                vacancies[rows] = -1
+                continue
+            counts = state._counts[rows, level]  # (rows, identities) at the vacant level
+            codes = state.identity_codes[rows, columns]
+            candidates = state.levels[rows, columns] >= 0 if state.num_vacant else np.broadcast_to(True, codes.shape)
+            if self.quotas is not None:
+                under_quota = counts < self.quotas[level]
+                restricted = under_quota.any(axis=1)
+                must_promote = np.argmax(under_quota, axis=1)
+                candidates = candidates & (~restricted[:, None] | (codes == must_promote[:, None]))
+
+            # base_promotion_func over the candidates of each replicate, with the per-row normalizations folded
+            # into per-row scales and per-identity weights
+            experience = state.position_experience[rows, columns]
+            if masked:
+                experience *= candidates
+            maximum = experience.max(axis=1)
+            experience_scale = np.divide(POSITION_EXPERIENCE_WEIGHT, maximum, out=np.zeros(len(rows)), where=maximum > 0)
+            maximum = counts.max(axis=1, keepdims=True)
+            identity_weights = np.divide(IDENTITY_SIMILARITY_WEIGHT * counts, maximum, out=np.zeros(counts.shape), where=maximum > 0)
+            weights = PERFORMACE_LEVEL_WEIGHT * state.performance[rows, columns]
+            weights += experience * experience_scale[:, None]
+            weights += np.take_along_axis(identity_weights, codes.astype(np.intp), axis=1)
+            if masked:
+                weights *= candidates
+            promoted = _choose(weights, self.rng.random(len(rows)), candidates) + columns.start
+
+            # Cascades without a candidate end here, without a hire
+            if masked:
+                found = candidates.any(axis=1)
+                vacancies[rows[~found]] = -1
+                rows, promoted = rows[found], promoted[found]
+            promoted_codes = state.identity_codes[rows, promoted]
+            state._counts[rows, level - 1, promoted_codes] -= 1
+            state._counts[rows, level, promoted_codes] += 1
+
+            # The promoted employee moves into the empty row at this level and leaves theirs empty
+            targets = holes[rows]
+            for name in BATCH_COLUMNS:
+                column = getattr(state, name)
+                column[rows, targets] = column[rows, promoted]
+            state.bias_rates[rows, targets] = state.bias_rates[rows, promoted]
+            state.levels[rows, targets] = level
+            state.position_experience[rows, targets] = 0
+            state.levels[rows, promoted] = -1
+            state.bias[rows, promoted] = 0
+            state.bias_rates[rows, promoted] = 0
+            self._refresh_bias_rates(state, rows, targets)
+            holes[rows] = promoted
+            promotions[rows] += 1
+            vacancies[rows] -= 1
+        return promotions, np.flatnonzero(vacancies == 0)
+
+    def hire(self, state, rows, slots):
+        """
+        Hires one employee into each (row, slot), with the identity probabilities of base_hire_func.
+        Returns the number of hires per replicate.
+        """
+        hires = np.zeros(state.num_replicates, dtype=np.int64)
+        if len(rows) == 0:
+            return hires
+        company_counts = np.einsum("rli->ri", state._counts[rows])
+        totals = company_counts.sum(axis=1, keepdims=True)
+        company_shares = np.where(totals > 0, _safe_divide(company_counts, totals), 1 / len(state.identities))
+        population_shares = np.array([self.population_percentages.get(identity, 0) for identity in state.identities])
+        probabilities = (1 - HIRING_HOMOPHILY_WEIGHT) * population_shares + HIRING_HOMOPHILY_WEIGHT * company_shares
+        identity_codes = _choose(probabilities, self.rng.random(len(rows)), np.ones(probabilities.shape, dtype=bool))
+
+        state.ids[rows, slots] = state.next_id[rows]
+        state.next_id[rows] += 1
+        state.identity_codes[rows, slots] = identity_codes
+        state.levels[rows, slots] = 0
+        state.performance[rows, slots] = np.clip(self.rng.normal(0.5, 0.1, size=len(rows)), 0, 1)
+        state.performance_totals[rows] += state.performance[rows, slots]
+        state.position_experience[rows, slots] = 0
+        state.company_experience[rows, slots] = 0
+        state.bias[rows, slots] = 0
+        state.start_time[rows, slots] = state.time[rows]
+        state._counts[rows, 0, identity_codes] += 1
+        self._refresh_bias_rates(state, rows, slots)
+        hires[rows] = 1
+        return hires
+
+    def run(self, state_init, n_steps=256, record_interval=1):
+        """
+        Simulate every replicate of `state_init` until time `n_steps`, recording the count tensors of
+        every replicate on a regular grid of spacing `record_interval`, like record="grid".
+
+        Returns:
+            dict: "timestamps" (T,), "identities", and "counts", "performance_sums" and "experience_sums"
+                  of shape (replicates, T, levels, identities), in the format of metrics.path_tensors
+                  with a leading replicate axis. Also "state", the final BatchState, "event_types", and
+                  "event_counts", "promotions" and "hires", the number of events of each type
+                  (replicates, event types), promotions and hires of every replicate.
+        """
+        state = state_init.copy()
+        rows = np.arange(state.num_replicates)
+        times = grid_times(n_steps, record_interval)
+        shape = (state.num_replicates, len(times), state.num_levels, len(state.identities))
+        tensors = {
+            "timestamps": times,
+            "identities": list(state.identities),
+            "counts": np.zeros(shape, dtype=np.int64),
+            "performance_sums": np.zeros(shape),
+            "experience_sums": np.zeros(shape),
+        }
+        recorded = np.zeros(state.num_replicates, dtype=np.int64)
+        event_counts = np.zeros((state.num_replicates, len(self.event_types)), dtype=np.int64)
+        promotions = np.zeros(state.num_replicates, dtype=np.int64)
+        hires = np.zeros(state.num_replicates, dtype=np.int64)
+
+        live = state.time <= n_steps
+        while live.any():
+            rates = self.get_rates(state).sum(axis=1)
+            delta_t = np.where(live, self.rng.exponential(size=len(rows)) / np.where(rates > 0, rates, 1), 0)
+            self._record(state, tensors, recorded, state.time + delta_t)
+            self.update(state, delta_t)
+            event_types, promoted, hired = self.step(state, live)
+            event_counts[rows[live], event_types[live]] += 1
+            promotions += promoted
+            hires += hired
+            live &= state.time <= n_steps
+        self._record(state, tensors, recorded, np.full(len(rows), np.inf))
+
+        tensors.update({"state": state, "event_types": list(self.event_types), "event_counts": event_counts, "promotions": promotions, "hires": hires})
+        return tensors
+
+    def _record(self, state, tensors, recorded, until):
+        """
+        Records the current state of every replicate at the grid times before `until`, its next event.
+        """
+        times = tensors["timestamps"]
+        due = recorded < len(times)
+        due[due] = times[recorded[due]] < until[due]
+        if not due.any():
+            return
+        due_rows = None if due.all() else np.flatnonzero(due)
+        cells = state._cells(due_rows)
+        values = {
+            "counts": state._counts if due_rows is None else state._counts[due_rows],
+            "performance_sums": state._cell_sums(state.performance, due_rows, cells),
+            "experience_sums": state._cell_sums(state.company_experience, due_rows, cells),
+        }
+        due_rows = np.arange(state.num_replicates) if due_rows is None else due_rows
+        while due.any():
+            rows = np.flatnonzero(due)
+            index = np.searchsorted(due_rows, rows)
+            for name, value in values.items():
+                tensors[name][rows, recorded[rows]] = value[index]
+            recorded[rows] += 1
+            due[rows] = recorded[rows] < len(times)
+            due[due] = times[recorded[due]] < until[due]
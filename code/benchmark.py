@@ -0,0 +1,297 @@
+"""
+Benchmarks of the simulation and metrics hot paths at several company sizes and run lengths.
+
+    results = run_benchmarks(sizes=[100, 1000], event_counts=[1000, 10000])
+    save_baseline(results, "before")
+    ...
+    print_comparison(compare(run_benchmarks(sizes=[100, 1000], event_counts=[1000, 10000]), load_baseline("before")))
+
+or from the command line:
+
+    python benchmark.py --sizes 100 1000 --save before
+    python benchmark.py --sizes 100 1000 --compare before
+
+Every case starts from the same seed, so a case simulates the same events on every commit as long
+as the model's random draws do not change. Cases:
+    state_update: State.update over the whole company.
+    promotion:    BaseModel.select_promotion into level 1, i.e. building candidates and base_promotion_func.
+    simulation:   Model.run (BaseModel.sample_next per event) for each event count, reporting events/sec,
+                  wall time per simulated time unit and peak memory.
+    metrics:      calculate_metrics_over_path over the recorded event path of the shortest run.
+A run of N events simulates N divided by the initial event rate of the company, so every size simulates
+about N events however fast its events come.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+from base_model import BaseModel
+from base_functions import base_bias_func
+from event_log import EventLog
+from metrics import calculate_metrics_over_path
+from state import State
+from constants import *
+
+BENCHMARK_SIZES = [100, 1000, 10000, 100000]
+# Expected events of each simulation run, at every size
+BENCHMARK_EVENT_COUNTS = [1000, 10000]
+BENCHMARK_SEED = 0
+BASELINE_DIR = "benchmarks"
+UPDATE_REPEATS = 20
+PROMOTION_REPEATS = 5
+# Micro-benchmarks report the best of this many timings
+TIMING_REPEATS = 3
+
+def level_populations_for(size):
+    """
+    LEVEL_POPULATIONS scaled to a company of `size` employees.
+    """
+    shares = np.array(LEVEL_POPULATIONS, dtype=np.float64) / sum(LEVEL_POPULATIONS)
+    populations = np.floor(shares * size).astype(int)
+    populations[0] += size - populations.sum()
+    return populations.tolist()
+
+def _setup(size, seed):
+    """
+    A model and initial state of the given size, both drawing from one generator seeded with `seed`.
+    """
+    rng = np.random.default_rng(seed)
+    level_populations = level_populations_for(size)
+    identity_probabilities = [IDENTITY_POPULATION_PERCENTAGES[identity] for identity in IDENTITIES]
+    state = State.generate_initial_state(level_populations, IDENTITIES, identity_probabilities, rng=rng)
+    model = BaseModel(level_populations=level_populations, rng=rng)
+    return model, state
+
+def _timed(func, measure_memory, repeat=1):
+    """
+    Runs `func` and returns its result, best wall time over `repeat` runs and, when measured, peak
+    traced memory in bytes. Memory is traced in another run, so tracing does not slow the timed ones.
+    """
+    wall_time = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        wall_time = min(wall_time, time.perf_counter() - start)
+    peak_memory = None
+    if measure_memory:
+        tracemalloc.start()
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, wall_time, peak_memory
+
+def _result(case, size, wall_time, run_length=None, event_count=None, events=None, calls=None, peak_memory=None):
+    return {
+        "case": case,
+        "size": size,
+        "event_count": event_count,
+        "run_length": run_length,
+        "wall_time": wall_time,
+        "events": events,
+        "events_per_second": events / wall_time if events is not None and wall_time > 0 else None,
+        "time_per_unit": wall_time / run_length if run_length else None,
+        "time_per_call": wall_time / calls if calls else None,
+        "peak_memory": peak_memory,
+    }
+
+def benchmark_state_update(size, seed=BENCHMARK_SEED, repeats=UPDATE_REPEATS):
+    _, state = _setup(size, seed)
+    state = state.copy()
+
+    def update():
+        for _ in range(repeats):
+            state.update(0.01, base_bias_func)
+
+    _, wall_time, _ = _timed(update, False, TIMING_REPEATS)
+    return _result("state_update", size, wall_time, calls=repeats)
+
+def benchmark_promotion(size, seed=BENCHMARK_SEED, repeats=PROMOTION_REPEATS):
+    model, state = _setup(size, seed)
+    # Give the candidates some position experience, which base_promotion_func normalizes by
+    state.update(1, base_bias_func)
+
+    def promote():
+        for _ in range(repeats):
+            model.select_promotion(state, 1)
+
+    _, wall_time, _ = _timed(promote, False, TIMING_REPEATS)
+    return _result("promotion", size, wall_time, calls=repeats)
+
+def run_length_for(model, state, event_count):
+    """
+    Simulated time in which `model` is expected to hold `event_count` events from `state`.
+    """
+    return event_count / model.transition_rate(state.copy())
+
+def benchmark_simulation(size, event_count, seed=BENCHMARK_SEED, method="exact", measure_memory=True):
+    """
+    Times one run of about `event_count` events without recording.
+    """
+    model, state = _setup(size, seed)
+    run_length = run_length_for(model, state, event_count)
+
+    def simulate():
+        # Restart the model, so the memory run repeats the timed one
+        model.log = EventLog(model.identities)
+        model.next_id = size
+        model.rng = np.random.default_rng(seed)
+        model.run(state, run_length, log_interval=np.inf, record=None, method=method)
+
+    _, wall_time, peak_memory = _timed(simulate, measure_memory)
+    case = "simulation" if method == "exact" else f"simulation_{method}"
+    return _result(case, size, wall_time, run_length, event_count, events=sum(model.log.event_counts().values()), peak_memory=peak_memory)
+
+def benchmark_metrics(size, event_count, seed=BENCHMARK_SEED, measure_memory=True):
+    """
+    Times the metrics of a recorded event path of about `event_count` events.
+    """
+    model, state = _setup(size, seed)
+    run_length = run_length_for(model, state, event_count)
+    path = model.run(state, run_length, log_interval=np.inf, record="events")
+
+    def compute():
+        return calculate_metrics_over_path(path, IDENTITIES, IDENTITY_POPULATION_PERCENTAGES)
+
+    _, wall_time, peak_memory = _timed(compute, measure_memory)
+    return _result("metrics", size, wall_time, run_length, event_count, events=len(path) - 1, peak_memory=peak_memory)
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, event_counts=BENCHMARK_EVENT_COUNTS, seed=BENCHMARK_SEED, methods=("exact",), measure_memory=True, verbose=True):
+    """
+    Run every benchmark case for every size.
+
+    Parameters:
+        sizes (list, optional): Company sizes (number of employees).
+        event_counts (list, optional): Expected events of the simulation cases, see `run_length_for`.
+        seed (int, optional): Seed of every case.
+        methods (tuple, optional): Model.run methods to benchmark, "exact" and/or "tau_leaping".
+        measure_memory (bool, optional): Also measure peak memory of the simulation and metrics cases.
+        verbose (bool, optional): Print each result as it completes.
+
+    Returns:
+        list: One result dict per case with its "case", "size", "event_count", "run_length", "wall_time", "events",
+              "events_per_second", "time_per_unit", "time_per_call" and "peak_memory" (None where not applicable).
+    """
+    results = []
+
+    def add(result):
+        results.append(result)
+        if verbose:
+            print(_format_result(result))
+
+    for size in sizes:
+        add(benchmark_state_update(size, seed))
+        add(benchmark_promotion(size, seed))
+        for method in methods:
+            for event_count in event_counts:
+                add(benchmark_simulation(size, event_count, seed, method, measure_memory))
+        add(benchmark_metrics(size, min(event_counts), seed, measure_memory))
+    return results
+
+def _format_result(result):
+    parts = [f"{result['case']:<24}", f"size={result['size']:<7}"]
+    if result["event_count"] is not None:
+        parts.append(f"events={result['event_count']:<6} length={result['run_length']:<7.4g}")
+    parts.append(f"wall={result['wall_time']:.4f}s")
+    for key, label, unit in [("events_per_second", "events/s", ""), ("time_per_unit", "per unit", "s"), ("time_per_call", "per call", "s")]:
+        if result[key] is not None:
+            parts.append(f"{label}={result[key]:.4g}{unit}")
+    if result["peak_memory"] is not None:
+        parts.append(f"peak={result['peak_memory'] / 2 ** 20:.2f}MiB")
+    return " ".join(parts)
+
+### BASELINES ###
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _baseline_path(name, directory):
+    return os.path.join(directory, f"{name}.json")
+
+def save_baseline(results, name, directory=BASELINE_DIR):
+    """
+    Store benchmark results as a named JSON baseline, with the commit and environment they were measured on.
+    """
+    os.makedirs(directory, exist_ok=True)
+    baseline = {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(_baseline_path(name, directory), "w") as file:
+        json.dump(baseline, file, indent=2)
+    return baseline
+
+def load_baseline(name, directory=BASELINE_DIR):
+    with open(_baseline_path(name, directory)) as file:
+        return json.load(file)
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare results with a baseline, case by case.
+
+    Returns:
+        list: One dict per case present in both, with the baseline and current wall time and peak memory,
+              their ratios (current / baseline) and whether the case "regressed", i.e. got slower by more
+              than `tolerance`.
+    """
+    def key(result):
+        return result["case"], result["size"], result.get("event_count")
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    comparison = []
+    for result in results:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        time_ratio = result["wall_time"] / previous["wall_time"] if previous["wall_time"] > 0 else None
+        memory_ratio = None
+        if result["peak_memory"] is not None and previous.get("peak_memory"):
+            memory_ratio = result["peak_memory"] / previous["peak_memory"]
+        comparison.append({
+            "case": result["case"],
+            "size": result["size"],
+            "event_count": result["event_count"],
+            "baseline_wall_time": previous["wall_time"],
+            "wall_time": result["wall_time"],
+            "time_ratio": time_ratio,
+            "memory_ratio": memory_ratio,
+            "regressed": time_ratio is not None and time_ratio > 1 + tolerance,
+        })
+    return comparison
+
+def print_comparison(comparison):
+    for row in comparison:
+        length = "" if row["event_count"] is None else f" events={row['event_count']}"
+        memory = "" if row["memory_ratio"] is None else f" memory x{row['memory_ratio']:.2f}"
+        flag = " REGRESSION" if row["regressed"] else ""
+        print(
+            f"{row['case']:<24} size={row['size']:<7}{length} "
+            f"{row['baseline_wall_time']:.4f}s -> {row['wall_time']:.4f}s (x{row['time_ratio']:.2f}){memory}{flag}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and metrics hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BENCHMARK_SIZES)
+    parser.add_argument("--event-counts", type=int, nargs="+", default=BENCHMARK_EVENT_COUNTS)
+    parser.add_argument("--seed", type=int, default=BENCHMARK_SEED)
+    parser.add_argument("--methods", nargs="+", default=["exact"], choices=["exact", "tau_leaping"])
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory runs.")
+    parser.add_argument("--save", metavar="NAME", help="Store the results as a baseline.")
+    parser.add_argument("--compare", metavar="NAME", help="Compare the results with a stored baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown above which a case counts as a regression.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.event_counts, args.seed, tuple(args.methods), not args.no_memory)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        print_comparison(compare(results, load_baseline(args.compare), args.tolerance))
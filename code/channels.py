@@ -0,0 +1,81 @@
+"""
+Identity-specific event channels: departures such as maternity leave that only happen to employees
+of some identities.
+
+Identities can be intersectional. A compound identity joins one attribute per axis with
+IDENTITY_SEPARATOR, and a channel is declared for any set of identities, e.g. every woman or a
+single intersectional group:
+
+    identities = compound_identities(["M", "F"], ["White", "Black", "Asian"])
+    channels = [
+        maternity_channel(identities=identities_with(identities, "F")),
+        IdentityChannel("disengagement", ["F/Black"], 0.002, bias=1),
+    ]
+    model = BaseModel(identities=identities, identity_channels=channels, ...)
+
+Models look up a channel's members through the state's per-identity indexes, so the cost of an event
+depends on the number of identities in its channel, not on the headcount or the number of identities.
+"""
+from itertools import product
+from constants import *
+
+class IdentityChannel:
+    """
+    Event that happens to each employee whose identity is in `identities` at `rate`. The event adds
+    `bias` to the employee's bias score, after which they stay with probability `return_probability`
+    and otherwise leave the company.
+    """
+    def __init__(self, name, identities, rate, bias=0, return_probability=0):
+        self.name = name
+        self.identities = list(identities)
+        self.rate = rate
+        self.bias = bias
+        self.return_probability = return_probability
+
+    def codes(self, state):
+        """
+        Identity codes of the channel's identities in `state`, skipping those it has never seen.
+        """
+        return [state.identity_index[identity] for identity in self.identities if identity in state.identity_index]
+
+    def count(self, state):
+        return sum(state.identity_count(code) for code in self.codes(state))
+
+    def total_rate(self, state):
+        return self.rate * self.count(state)
+
+    def member_mask(self, state):
+        """
+        Whether each row of `state` belongs to the channel.
+        """
+        members = np.zeros(len(state.identities), dtype=bool)
+        members[self.codes(state)] = True
+        return members[state.identity_codes]
+
+    def sample(self, state, rng):
+        """
+        Row of a member drawn uniformly, or None when the channel has no members.
+        """
+        return state.sample_identity_member(self.codes(state), rng)
+
+def maternity_channel(rate=None, identities=("F",)):
+    """
+    Maternity leave with the MATERNITY_* constants, by default for "F".
+    """
+    return IdentityChannel("maternity_leave", identities, MATERNITY_LEAVE if rate is None else rate, MATERNITY_BIAS, MATERNITY_RETURN)
+
+### COMPOUND IDENTITIES ###
+def compound_identities(*axes):
+    """
+    Every combination of one attribute per axis, e.g. (["M", "F"], ["White", "Black"]) gives "M/White", "M/Black", ...
+    """
+    return [IDENTITY_SEPARATOR.join(attributes) for attributes in product(*axes)]
+
+def identity_attributes(identity):
+    return identity.split(IDENTITY_SEPARATOR)
+
+def identities_with(identities, *attributes):
+    """
+    The identities that have all of `attributes`.
+    """
+    return [identity for identity in identities if set(attributes) <= set(identity_attributes(identity))]
@@ -0,0 +1,88 @@
+"""
+Checkpoints of a running simulation, so long runs can be resumed after the process dies or extended
+past their original end time.
+
+    model.run(state, 500, checkpoint="run.ckpt", checkpoint_interval=50)
+    ...
+    model.run(None, 1000, resume="run.ckpt", checkpoint="run.ckpt", checkpoint_interval=50)
+
+A checkpoint holds the working state, the model's mutable attributes (its time, event log and
+counters such as BaseModel.next_id, see Model.checkpoint_attributes) and the bit state of its random
+generator, all taken between two events. Resuming restores them in place, so the resumed run draws
+the same random numbers and simulates the same events as a run that was never interrupted.
+Observers and recorders are not part of a checkpoint: after resuming they start from the resumed state.
+"""
+import os
+import pickle
+from copy import deepcopy
+from recording import Observer
+
+class Checkpoint:
+    """
+    Snapshot of a run between two events. `log_cursor` is the number of events in the model's log at
+    the snapshot, the position a resumed run continues logging from.
+    """
+    def __init__(self, time, state, attributes, rng_state):
+        self.time = time
+        self.state = state
+        self.attributes = attributes
+        self.rng_state = rng_state
+
+    @property
+    def log_cursor(self):
+        log = self.attributes.get("log")
+        return None if log is None else log.num_events
+
+    def save(self, file):
+        """
+        Writes the checkpoint with pickle. The file is replaced atomically, so a run that dies while
+        saving leaves the previous checkpoint intact.
+        """
+        temporary_file = f"{file}.tmp"
+        with open(temporary_file, "wb") as handle:
+            pickle.dump(self, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, file)
+
+    @staticmethod
+    def load(file):
+        with open(file, "rb") as handle:
+            return pickle.load(handle)
+
+def take_checkpoint(model, state):
+    """
+    Checkpoint of `model` and its working `state`, independent of both as they keep changing.
+    """
+    attributes = {name: deepcopy(getattr(model, name)) for name in model.checkpoint_attributes}
+    return Checkpoint(model.time, state.copy(), attributes, deepcopy(model.rng.bit_generator.state))
+
+def restore_checkpoint(model, checkpoint):
+    """
+    Restores `model` to a checkpoint, in place, and returns a copy of its working state.
+    """
+    if isinstance(checkpoint, (str, os.PathLike)):
+        checkpoint = Checkpoint.load(checkpoint)
+    for name, value in checkpoint.attributes.items():
+        setattr(model, name, deepcopy(value))
+    model.rng.bit_generator.state = checkpoint.rng_state
+    return checkpoint.state.copy()
+
+class CheckpointWriter(Observer):
+    """
+    Saves a checkpoint of the model to `file` every `interval` of simulated time, and at the end of the run.
+    """
+    def __init__(self, model, file, interval=None):
+        self.model = model
+        self.file = file
+        self.interval = interval
+
+    def start(self, time, state):
+        self.next_time = None if self.interval is None else time + self.interval
+
+    def step(self, time, state):
+        if self.next_time is not None and time >= self.next_time:
+            take_checkpoint(self.model, state).save(self.file)
+            while self.next_time <= time:
+                self.next_time += self.interval
+
+    def finish(self, time, state):
+        take_checkpoint(self.model, state).save(self.file)
@@ -16,8 +16,9 @@ IDENTITY_SIMILARITY_WEIGHT = .5
 HIRING_HOMOPHILY_WEIGHT = IDENTITY_SIMILARITY_WEIGHT
 
 # Bias Constants
-MAN_BIAS = 0.5
-WOMAN_BIAS = 2
+# Bias of each identity, the only place identity biases are set. Compound identities without an entry
+# multiply those of their attributes.
+IDENTITY_BIASES = {"M": 0.5, "F": 2}
 LEVEL_BIAS_COEFFICIENT = 0.25
 BIAS_DECAY_RATE = 0.9
 
@@ -29,8 +30,19 @@ MATERNITY_BIAS = 0.5
 # Simulation Constants
 LEAVE_RATE = 0.01
 IDENTITIES = ["M", "F"]
+IDENTITY_SEPARATOR = "/" # Joins the attributes of a compound identity, e.g. "F/Black"
 IDENTITY_POPULATION_PERCENTAGES = {"M": 0.6, "F": 0.4}
 LEVEL_POPULATIONS = [50, 25, 10, 5]
 NUM_LEVELS = 4
 FIRE_RATE_COEFFICIENT = 0.01
-BIAS_RATE_COEFFICIENT = 0.001
\ No newline at end of file
+BIAS_RATE_COEFFICIENT = 0.001
+
+# Tau-Leaping Constants
+TAU_LEAP_EPSILON = 0.03 # Largest expected fraction of a level that departs, or of a drifting column that changes, in one leap
+TAU_LEAP_MAX_STEP = 1 # Longest leap, which bounds the error of the state update
+TAU_LEAP_MIN_EVENTS = 10 # Leaps expected to hold fewer events are simulated exactly
+
+# Equilibrium Constants
+EQUILIBRIUM_BATCH_LENGTH = 10 # Simulated time averaged into each batch mean
+EQUILIBRIUM_WINDOW = 10 # Number of latest batch means tested for drift
+EQUILIBRIUM_STANDARD_ERRORS = 2 # Drift allowed beyond the tolerance, in standard errors of the batch means
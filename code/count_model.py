@@ -0,0 +1,481 @@
+"""
+Count-state engine: the workforce is a level x identity matrix of headcounts, and every event costs
+O(levels x identities) whatever the size of the company.
+
+The headcounts follow their exact distribution for dynamics that only depend on headcounts:
+departures at per-employee rates set per cell (see `cell_rates`), leaving, identity channels, hiring
+policies, quotas and promotion policies that only look at the candidates' identities and headcounts,
+such as random_promotion_func. Anything that picks employees by performance, experience or bias cannot
+be represented on counts, so it is rejected rather than approximated:
+- BaseModel's fire and quit functions, which weight employees by performance and bias, are refused
+  when the model is built. Without a `cell_rates` fire or quit function there is no firing or quitting.
+- Promotion policies that read the candidates' performance or experience (base_promotion_func,
+  performance_promotion_func, seniority_promotion_func) raise when they do.
+CountModel is therefore not a drop-in replacement for BaseModel or its default configuration: it
+simulates the count-only variants of it, and only those.
+
+Every cell also keeps the sums of its employees' performance, experience and bias, updated like
+BaseModel's columns, which do not feed back into the dynamics. They are mean-field estimates: an
+employee who leaves or is promoted takes the cell's means with them, and performance is clipped on the
+cell sums rather than per employee. Count metrics are exact, performance and experience metrics are not.
+"""
+import numpy as np
+from model import DEPARTURE_EVENTS, Model
+from event_log import EventLog
+from channels import maternity_channel
+from base_functions import base_bias_func, base_hire_func
+from employee import Employee
+from interventions import random_promotion_func
+from utils import is_vectorized, selection_probabilities
+from constants import *
+
+# Per-cell sums kept alongside the headcounts
+AGGREGATE_COLUMNS = ["performance", "position_experience", "company_experience", "bias"]
+
+def cell_rates(func):
+    """
+    Marks a departure rate function that CountModel can simulate exactly: func(state) returns the rate
+    per employee in every cell, shape (levels, identities), and may only depend on the headcounts.
+    """
+    func.cell_rates = True
+    return func
+
+def uniform_rates(rate):
+    """
+    Departures at `rate` per employee in every cell.
+    """
+    @cell_rates
+    def rates(state):
+        return np.full(state.counts.shape, rate, dtype=np.float64)
+    return rates
+
+class CountState:
+    """
+    Workforce state reduced to headcounts and per-cell sums, both arrays of shape (levels, identities).
+
+    Exposes the count interface of State (`counts`, `cell_totals`, `get_count`, `identity_count`, `get_identity_counts`,
+    `identity_index`), so count-based metrics and hiring functions work on either.
+    """
+    def __init__(self, counts, identities, sums=None, time=0):
+        self.time = time
+        self.identities = list(identities)
+        self.identity_index = {identity: code for code, identity in enumerate(self.identities)}
+        self._counts = np.array(counts, dtype=np.int64).reshape(-1, len(self.identities))
+        self._sums = {
+            column: np.zeros(self._counts.shape, dtype=np.float64) if sums is None or column not in sums
+            else np.array(sums[column], dtype=np.float64).reshape(self._counts.shape)
+            for column in AGGREGATE_COLUMNS
+        }
+        self.journal = None
+
+    def copy(self):
+        """
+        Returns an independent copy of the state, without its journal.
+        """
+        return CountState(self._counts, self.identities, self._sums, self.time)
+
+    @property
+    def counts(self):
+        return self._counts.copy()
+
+    def __len__(self):
+        return int(self._counts.sum())
+
+    def identity_code(self, identity):
+        return self.identity_index[identity]
+
+    def cell_totals(self, column):
+        """
+        Sum of a column (e.g. "performance") over the employees of each cell, indexed like `counts`.
+        """
+        return self._sums[column].copy()
+
+    def cell_means(self, column):
+        """
+        Mean of a column over the employees of each cell, 0 for empty cells.
+        """
+        return np.divide(self._sums[column], self._counts, out=np.zeros(self._counts.shape), where=self._counts > 0)
+
+    def _grow_levels(self, num_levels):
+        if num_levels > self._counts.shape[0]:
+            extra = ((0, num_levels - self._counts.shape[0]), (0, 0))
+            self._counts = np.pad(self._counts, extra)
+            self._sums = {column: np.pad(sums, extra) for column, sums in self._sums.items()}
+
+    ### CHANGES ###
+    def update(self, delta_t, bias_func):
+        if self.journal is not None:
+            self.journal.append(("update", delta_t))
+        self.time += delta_t
+        sums = self._sums
+        sums["position_experience"] += self._counts * delta_t
+        sums["company_experience"] += self._counts * delta_t
+
+        performance = sums["performance"]
+        performance += delta_t * (sums["position_experience"] * PERFORMANCE_INCREASE_RATE - sums["bias"] * PERFORMANCE_DECREASE_RATE)
+        np.clip(performance, 0, self._counts, out=performance)
+
+        if is_vectorized(bias_func):
+            levels, identity_codes = np.indices(self._counts.shape)
+            biases = self._counts * bias_func(identity_codes.ravel(), levels.ravel(), self.identities).reshape(self._counts.shape)
+        else:
+            biases = self._scalar_biases(bias_func)
+        sums["bias"] += biases * delta_t * BIAS_RATE_COEFFICIENT
+
+    def _scalar_biases(self, bias_func):
+        """
+        Applies a per-employee bias function to a representative employee holding the means of each cell.
+        Changes the function makes to the employee's bias score are written back to the cell.
+        """
+        biases = np.zeros(self._counts.shape)
+        for level, code in zip(*np.nonzero(self._counts)):
+            count = self._counts[level, code]
+            employee = Employee(None, self.identities[code], 0, int(level), 0)
+            employee.performance_level = self._sums["performance"][level, code] / count
+            employee.position_experience = self._sums["position_experience"][level, code] / count
+            employee.company_experience = self._sums["company_experience"][level, code] / count
+            employee.bias_score = self._sums["bias"][level, code] / count
+            biases[level, code] = count * bias_func(employee)
+            self._sums["bias"][level, code] = count * employee.bias_score
+        return biases
+
+    def update_bias(self, level, code, bias, delta_t):
+        if self.journal is not None:
+            self.journal.append(("bias", level, code, bias, delta_t))
+        self._sums["bias"][level, code] += bias * delta_t * BIAS_RATE_COEFFICIENT
+
+    def add_employee(self, level, code, performance):
+        if self.journal is not None:
+            self.journal.append(("add", level, code, performance))
+        self._grow_levels(level + 1)
+        self._counts[level, code] += 1
+        self._sums["performance"][level, code] += performance
+
+    def remove_employee(self, level, code):
+        """
+        Removes one employee with the cell's mean attributes and returns those attributes.
+        """
+        if self.journal is not None:
+            self.journal.append(("remove", level, code))
+        return self._take(level, code)
+
+    def promote_employee(self, level, code):
+        """
+        Moves one employee of the given identity from `level - 1` to `level`, where their position experience restarts.
+        """
+        if self.journal is not None:
+            self.journal.append(("promote", level, code))
+        removed = self._take(level - 1, code)
+        self._grow_levels(level + 1)
+        self._counts[level, code] += 1
+        for column in ["performance", "company_experience", "bias"]:
+            self._sums[column][level, code] += removed[column]
+
+    def _take(self, level, code):
+        count = self._counts[level, code]
+        if count == 0:
+            raise ValueError(f"No employee of identity {self.identities[code]} at level {level}.")
+        removed = {}
+        for column, sums in self._sums.items():
+            removed[column] = sums[level, code] / count
+            sums[level, code] = sums[level, code] - removed[column] if count > 1 else 0
+        self._counts[level, code] -= 1
+        return removed
+
+    def replay(self, changes, bias_func):
+        """
+        Re-applies journal entries recorded by another state, in order.
+        """
+        for change in changes:
+            kind = change[0]
+            if kind == "update":
+                self.update(change[1], bias_func)
+            elif kind == "add":
+                self.add_employee(*change[1:])
+            elif kind == "remove":
+                self.remove_employee(*change[1:])
+            elif kind == "promote":
+                self.promote_employee(*change[1:])
+            elif kind == "bias":
+                self.update_bias(*change[1:])
+            else:
+                raise ValueError(f"Unknown journal entry {kind}.")
+
+    ### COUNTS ###
+    def get_count(self, position, identity):
+        code = self.identity_index.get(identity)
+        if code is None or not 0 <= position < self._counts.shape[0]:
+            return 0
+        return int(self._counts[position, code])
+
+    def identity_count(self, code):
+        return int(self._counts[:, code].sum())
+
+    def get_identity_counts(self, level=None):
+        if level is None:
+            counts = self._counts.sum(axis=0)
+        elif 0 <= level < self._counts.shape[0]:
+            counts = self._counts[level]
+        else:
+            counts = np.zeros(len(self.identities), dtype=np.int64)
+        return {identity: int(counts[code]) for code, identity in enumerate(self.identities)}
+
+    def get_summary(self):
+        summary = {}
+        for position, code in zip(*np.nonzero(self._counts)):
+            summary.setdefault(int(position), {})[self.identities[code]] = int(self._counts[position, code])
+        return summary
+
+    def __str__(self):
+        summary = self.get_summary()
+        summary_str = "\n".join(
+            f"Position Level {level}: " + ", ".join(f"{identity}: {count}" for identity, count in identities.items())
+            for level, identities in summary.items()
+        )
+        return f"Time: {self.time}\nWorkforce Summary:\n{summary_str}"
+
+    @staticmethod
+    def from_state(state):
+        """
+        Aggregates a State (or any state exposing `counts` and `cell_totals`) into a CountState.
+        """
+        sums = {column: state.cell_totals(column) for column in AGGREGATE_COLUMNS}
+        return CountState(state.counts, state.identities, sums, state.time)
+
+    @staticmethod
+    def generate_initial_state(level_populations, identities, identity_probabilities, performance_mean=0.5, performance_std=0.1, rng=None):
+        """
+        Draws the identity counts of each level, and each cell's performance sum as the sum of its
+        employees' normally distributed performance levels.
+        """
+        rng = RNG if rng is None else rng
+        counts = np.array([rng.multinomial(population, identity_probabilities) for population in level_populations], dtype=np.int64)
+        performance = rng.normal(counts * performance_mean, np.sqrt(counts) * performance_std)
+        return CountState(counts, identities, {"performance": np.clip(performance, 0, counts)})
+
+class CellCandidates:
+    """
+    Cells that can fill a vacancy at `level`: one candidate per identity code in `codes`, standing for the
+    employees of that identity at `level - 1`, with their headcount in `counts`. Employees are not tracked
+    individually, so there are no `ids` or `slots`, and reading their performance, experience or bias raises.
+    """
+    def __init__(self, state, level, codes):
+        self.state = state
+        self.level = level
+        self.codes = np.asarray(codes)
+        self.counts = state.counts[level - 1, self.codes]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def identity_codes(self):
+        return self.codes
+
+    def _untracked(self, column):
+        raise ValueError(f"CountModel does not track the {column} of individual employees, so its promotion functions cannot use it.")
+
+    @property
+    def performance(self):
+        self._untracked("performance")
+
+    @property
+    def position_experience(self):
+        self._untracked("position experience")
+
+    @property
+    def bias(self):
+        self._untracked("bias")
+
+    @property
+    def max_position_experience(self):
+        self._untracked("position experience")
+
+class CountModel(Model):
+    """
+    Gillespie simulation of a CountState: firing and quitting at the per-employee rates of `fire_func`
+    and `quit_func` (functions marked @cell_rates, or None for no such event), leaving uniformly and
+    identity channels (by default maternity leave for "F"), whose members are drawn by cell. Exact for
+    the headcounts, see the module docstring for what it rejects.
+
+    Promotion policies take the same arguments as in BaseModel, func(state, candidates, level, identities),
+    with one CellCandidates entry per cell, and must be @vectorized. A probability vector is per employee,
+    so each cell is drawn in proportion to it times the cell's headcount. An index picks a cell.
+    """
+    def __init__(
+            self,
+            fire_func=None,
+            quit_func=None,
+            leave_rate=LEAVE_RATE,
+            maternity_leave_rate=MATERNITY_LEAVE,
+            identities=IDENTITIES,
+            bias_func=base_bias_func,
+            identity_probabilities_func=base_hire_func,
+            promotion_probability_func=random_promotion_func,
+            num_levels=NUM_LEVELS,
+            level_populations=LEVEL_POPULATIONS,
+            population_percentages=IDENTITY_POPULATION_PERCENTAGES,
+            quotas=None,
+            identity_channels=None,
+            rng=None
+            ):
+        self.leave_rate = leave_rate
+        self.maternity_leave_rate = maternity_leave_rate
+        self.identity_channels = [maternity_channel(maternity_leave_rate)] if identity_channels is None else list(identity_channels)
+        self.event_types = DEPARTURE_EVENTS + [channel.name for channel in self.identity_channels]
+        if len(set(self.event_types)) < len(self.event_types):
+            raise ValueError(f"Event types must be unique ({self.event_types}).")
+
+        for func in (fire_func, quit_func):
+            if func is not None and not getattr(func, "cell_rates", False):
+                raise ValueError(
+                    f"CountModel only simulates departures whose rates depend on headcounts, given by @cell_rates functions, not {func.__name__}.")
+        self.fire_func = fire_func
+        self.quit_func = quit_func
+        self.bias_func = bias_func
+        self.identity_probabilities_func = identity_probabilities_func
+        if not is_vectorized(promotion_probability_func):
+            raise ValueError(
+                "CountModel promotion functions must be @vectorized and called as func(state, candidates, level, identities).")
+        self.promotion_probability_func = promotion_probability_func
+
+        self.identities = identities
+        self.num_levels = num_levels
+        self.level_populations = level_populations
+        self.population_percentages = population_percentages
+        self.quotas = quotas
+        self.rng = RNG if rng is None else rng
+
+        self.time = 0
+        self.log = EventLog(identities)
+        self.stats = None
+
+    def transition_rate(self, state):
+        return sum(self.get_rates(state))
+
+    def get_rates(self, state):
+        fire_rate = self.departure_rates(state, self.fire_func).sum()
+        quit_rate = self.departure_rates(state, self.quit_func).sum()
+        leave_rate = self.leave_rate * len(state)
+        return (fire_rate, quit_rate, leave_rate, *(channel.total_rate(state) for channel in self.identity_channels))
+
+    def departure_rates(self, state, rate_func):
+        """
+        Rate of a departure event in each cell: the per-employee rate of `rate_func` times the headcount, 0 without one.
+        """
+        if rate_func is None:
+            return np.zeros(state.counts.shape)
+        return rate_func(state) * state.counts
+
+    def sample_next(self, state, time_delta):
+        stats = self.stats
+        # Update the state
+        state.update(time_delta, self.bias_func)
+        if self.time != state.time:
+            raise ValueError("Model time does not match state time.")
+        if stats is not None:
+            stats.lap("update")
+
+        rates = self.get_rates(state)
+        rate_details = (*rates[:len(DEPARTURE_EVENTS)], sum(rates[len(DEPARTURE_EVENTS):]))
+        if stats is not None:
+            stats.lap("rates")
+
+        # Determine the event type
+        event_index = self.select_event(rates)
+        event_type = self.event_types[event_index]
+        if event_type == "fire":
+            event_details = self.remove_employee(state, *self.select_cell(self.departure_rates(state, self.fire_func)))
+        elif event_type == "quit":
+            event_details = self.remove_employee(state, *self.select_cell(self.departure_rates(state, self.quit_func)))
+        elif event_type == "leave":
+            event_details = self.remove_employee(state, *self.select_cell(state.counts))
+        else:
+            event_details = self.identity_event(state, self.identity_channels[event_index - len(DEPARTURE_EVENTS)])
+        if stats is not None:
+            stats.count_events(event_type)
+            stats.lap("selection")
+
+        self.log_event(event_type, state.time, event_details, rate_details)
+        if stats is not None:
+            stats.lap("log")
+        return state
+
+    def select_cell(self, weights):
+        """
+        Samples a (level, identity code) cell with probability proportional to `weights`.
+        """
+        cumulative = np.cumsum(weights, dtype=np.float64)
+        cell = np.searchsorted(cumulative, self.rng.random() * cumulative[-1], side="right")
+        cell = min(int(cell), len(cumulative) - 1)
+        return np.unravel_index(cell, np.shape(weights))
+
+    def identity_event(self, state, channel):
+        codes = channel.codes(state)
+        level, index = self.select_cell(state.counts[:, codes])
+        code = codes[index]
+        if self.rng.random() > channel.return_probability:
+            # The employee leaves with the bias of their event, so remove them before it reaches the cell
+            return self.remove_employee(state, level, code)
+        if channel.bias:
+            state.update_bias(level, code, channel.bias, 1)
+        return [(-1, self.identities[code], int(level), int(level))]
+
+    def hire(self, state):
+        identity_probabilities = selection_probabilities(
+            self.identity_probabilities_func(state, self.identities, self.population_percentages), len(self.identities))
+        performance = min(1, max(0, self.rng.normal(0.5, 0.1)))
+        identity = self.rng.choice(self.identities, p=identity_probabilities)
+        state.add_employee(0, state.identity_code(identity), performance)
+        return [(-1, identity, -1, 0)]
+
+    def promote(self, state, level):
+        """
+        Fills a vacancy at `level` from the level below, then each vacancy this leaves below it, down to a hire.
+        When no one can be promoted into a level, the chain stops there and returns the moves made so far.
+        """
+        if level < 1:
+            raise ValueError("Cannot promote to lowest level.")
+
+        event_details = []
+        for level in range(level, 0, -1):
+            codes = np.flatnonzero(state.counts[level - 1])
+            if self.quotas is not None:
+                for identity in self.identities:
+                    if state.get_count(level, identity) < self.quotas[level]:
+                        codes = codes[codes == state.identity_code(identity)]
+                        break
+            if len(codes) == 0:
+                return event_details
+
+            code = int(codes[self.select_candidate(state, CellCandidates(state, level, codes), level)])
+            state.promote_employee(level, code)
+            event_details.append((-1, self.identities[code], level - 1, level))
+        return event_details + self.hire(state)
+
+    def select_candidate(self, state, candidates, level):
+        """
+        Index of the cell among `candidates` whose employee is promoted to `level`.
+        """
+        selection = self.promotion_probability_func(state, candidates, level, self.identities)
+        if np.ndim(selection) == 0:
+            return int(selection)
+        weights = np.asarray(selection, dtype=np.float64) * candidates.counts
+        return self.rng.choice(len(candidates), p=weights / weights.sum())
+
+    def remove_employee(self, state, level, code):
+        stats = self.stats
+        if stats is not None:
+            stats.lap("selection")
+        state.remove_employee(level, code)
+        cascade = self.hire(state) if level == 0 else self.promote(state, level)
+        if stats is not None:
+            stats.cascade(cascade)
+            stats.lap("cascade")
+        return [(-1, self.identities[code], int(level), -1)] + (cascade or [])
+
+    def log_event(self, event_type, time, event_details, rate_details):
+        """
+        Logs an event given its moves. Employees are not tracked individually, so every move has employee id -1.
+        """
+        self.log.append_event(event_type, time, event_details, rate_details)
@@ -49,7 +49,8 @@ class Employee:
         )
 
     @staticmethod
-    def generate_employee(id, identities, identity_probabilities, position_level, time, performance_mean=0.5, performance_std=0.1):
-        performance_level = RNG.normal(performance_mean, performance_std)
-        identity = RNG.choice(identities, p=identity_probabilities)
+    def generate_employee(id, identities, identity_probabilities, position_level, time, performance_mean=0.5, performance_std=0.1, rng=None):
+        rng = RNG if rng is None else rng
+        performance_level = rng.normal(performance_mean, performance_std)
+        identity = rng.choice(identities, p=identity_probabilities)
         return Employee(id, identity, performance_level, position_level, time)
\ No newline at end of file
@@ -0,0 +1,170 @@
+import numpy as np
+
+# Event types every log starts with. Models with other identity channels add theirs as they are logged.
+EVENT_TYPES = ["fire", "quit", "leave", "maternity_leave", "tau_leap"]
+# One row per employee move. Levels are -1 outside the company, so a departure has to_level -1, a hire
+# from_level -1, a promotion to_level = from_level + 1, and an employee who stays (returning from
+# maternity leave) from_level = to_level. Rows of the same event share its sequence number and rates,
+# which are the fire, quit and leave rates and the total rate of the identity channels.
+EVENT_DTYPE = np.dtype([
+    ("event", np.int64),
+    ("type", np.uint8),
+    ("time", np.float64),
+    ("employee_id", np.int64),
+    ("identity", np.int16),
+    ("from_level", np.int16),
+    ("to_level", np.int16),
+    ("rates", np.float64, (4,)),
+])
+CHUNK_SIZE = 4096
+
+class EventLog:
+    """
+    Append-only log of simulation events stored as a structured array of EVENT_DTYPE rows.
+
+    Rows are written into fixed-size chunks, so appending never copies earlier rows. `rows` joins the
+    chunks into one array (cached until the next append), which the query helpers work on.
+    Identities are stored as codes into `identities`, and event types as codes into `event_types`,
+    both of which grow as new ones are logged.
+    Models that do not track individual employees log an employee id of -1.
+    """
+    def __init__(self, identities=(), chunk_size=CHUNK_SIZE):
+        self.identities = list(identities)
+        self.identity_index = {identity: code for code, identity in enumerate(self.identities)}
+        self.event_types = list(EVENT_TYPES)
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._size = 0
+        self._rows = None
+        self.num_events = 0
+
+    def _identity_code(self, identity):
+        code = self.identity_index.get(identity)
+        if code is None:
+            code = self.identity_index[identity] = len(self.identities)
+            self.identities.append(identity)
+        return code
+
+    def _event_type_code(self, event_type):
+        if event_type not in self.event_types:
+            self.event_types.append(event_type)
+        return self.event_types.index(event_type)
+
+    def append_event(self, event_type, time, moves, rates, move_types=None):
+        """
+        Logs one event as one row per move.
+
+        Parameters:
+            event_type (str): One of EVENT_TYPES or the name of an identity channel.
+            time (float): Time of the event.
+            moves (list): (employee_id, identity, from_level, to_level) tuples.
+            rates (tuple): The fire, quit, leave and identity channel rates at the time of the event.
+            move_types (list, optional): Event type of each move, when they differ from `event_type` (e.g. in a tau leap).
+        """
+        type_code = self._event_type_code(event_type)
+        for index, (employee_id, identity, from_level, to_level) in enumerate(moves):
+            if self._size == len(self._chunks) * self.chunk_size:
+                self._chunks.append(np.zeros(self.chunk_size, dtype=EVENT_DTYPE))
+            self._chunks[-1][self._size % self.chunk_size] = (
+                self.num_events,
+                type_code if move_types is None else self._event_type_code(move_types[index]),
+                time,
+                employee_id,
+                self._identity_code(identity),
+                from_level,
+                to_level,
+                rates,
+            )
+            self._size += 1
+        self._rows = None
+        self.num_events += 1
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.concatenate(self._chunks)[:self._size] if self._chunks else np.zeros(0, dtype=EVENT_DTYPE)
+        return self._rows
+
+    ### QUERIES ###
+    def of_type(self, event_type):
+        if event_type not in self.event_types:
+            return self.rows[:0]
+        return self.rows[self.rows["type"] == self.event_types.index(event_type)]
+
+    def between(self, start, end):
+        """
+        Rows of the events with start <= time <= end. Rows are in time order.
+        """
+        times = self.rows["time"]
+        return self.rows[np.searchsorted(times, start, side="left"):np.searchsorted(times, end, side="right")]
+
+    def departures(self, rows=None):
+        rows = self.rows if rows is None else rows
+        return rows[(rows["from_level"] >= 0) & (rows["to_level"] < 0)]
+
+    def promotions(self, rows=None):
+        rows = self.rows if rows is None else rows
+        return rows[(rows["from_level"] >= 0) & (rows["to_level"] > rows["from_level"])]
+
+    def hires(self, rows=None):
+        rows = self.rows if rows is None else rows
+        return rows[rows["from_level"] < 0]
+
+    def event_counts(self):
+        """
+        Number of logged events of each type. Moves of a tau leap count as events of their own type.
+        """
+        departures = self.departures()
+        stays = self.rows[self.rows["from_level"] == self.rows["to_level"]]
+        types = np.concatenate([departures["type"], stays["type"]])
+        counts = np.bincount(types, minlength=len(self.event_types))
+        return {event_type: int(count) for event_type, count in zip(self.event_types, counts) if event_type != "tau_leap"}
+
+    def per_identity(self, rows, level_field=None, level=None):
+        """
+        Count rows by identity, optionally only those whose `level_field` ("from_level" or "to_level") equals `level`.
+        """
+        if level is not None:
+            rows = rows[rows[level_field] == level]
+        counts = np.bincount(rows["identity"], minlength=len(self.identities))
+        return {identity: int(counts[code]) for code, identity in enumerate(self.identities)}
+
+    def promotions_per_identity(self, level=None):
+        """
+        Number of promotions of each identity, in total or into the given level.
+        """
+        return self.per_identity(self.promotions(), "to_level", level)
+
+    def hires_per_identity(self):
+        return self.per_identity(self.hires())
+
+    def departures_per_identity(self, level=None):
+        return self.per_identity(self.departures(), "from_level", level)
+
+    ### SERIALIZATION ###
+    def save(self, file):
+        """
+        Writes the log to an .npz file.
+        """
+        np.savez(
+            file, rows=self.rows, identities=np.array(self.identities, dtype=str),
+            event_types=np.array(self.event_types, dtype=str), num_events=self.num_events,
+        )
+
+    @staticmethod
+    def load(file):
+        data = np.load(file)
+        log = EventLog(data["identities"].tolist())
+        if "event_types" in data.files:
+            log.event_types = data["event_types"].tolist()
+        rows = data["rows"]
+        # Keep the loaded rows as one chunk, and append to it until it is full
+        log.chunk_size = max(CHUNK_SIZE, len(rows))
+        log._chunks = [np.zeros(log.chunk_size, dtype=EVENT_DTYPE)]
+        log._chunks[0][:len(rows)] = rows
+        log._size = len(rows)
+        log.num_events = int(data["num_events"])
+        return log
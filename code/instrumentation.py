@@ -0,0 +1,127 @@
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Phases timed by Model.run, in the order they happen within a step
+PHASES = ["setup", "rates", "update", "selection", "cascade", "log", "recording"]
+
+class RunStats:
+    """
+    Per-phase timers and counters of a Model.run, filled in when passed as its `stats` argument.
+
+    Time is split into consecutive laps: each call to `lap(phase)` charges the time since the previous
+    lap to `phase`, so the phases add up to the wall time of the run. Models only touch the stats object
+    when one is given, so runs without it pay a single `is None` check per phase.
+
+    Counters hold the number of "steps", of "events" in total and of each type, "hires", "promotions" and
+    "leaps". Under tau leaping a step is a leap, which holds many events.
+    `cascade_depths` maps the number of promotions triggered by a departure to how often it happened.
+    With `trace_memory` the peak traced Python memory of the run is recorded, which slows the run down.
+    The process' maximum resident set size is always recorded where the platform provides it.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.timers = {phase: 0.0 for phase in PHASES}
+        self.counters = {}
+        self.cascade_depths = {}
+        self.wall_time = 0.0
+        self.simulated_time = 0.0
+        self.peak_memory = None
+        self.max_rss = None
+        self._mark = None
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self._started = self._mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.timers[phase] = self.timers.get(phase, 0.0) + now - self._mark
+        self._mark = now
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_events(self, event_type, amount=1):
+        """
+        Counts `amount` events of `event_type`, towards both its own counter and "events".
+        """
+        self.count(event_type, amount)
+        self.count("events", amount)
+
+    def cascade(self, event_details):
+        """
+        Counts the promotions and hires of one departure's cascade, given as (employee_id, identity, from_level, to_level) moves.
+        """
+        moves = event_details or []
+        hires = sum(1 for _, _, from_level, _ in moves if from_level < 0)
+        promotions = len(moves) - hires
+        self.count("promotions", promotions)
+        self.count("hires", hires)
+        self.cascade_depths[promotions] = self.cascade_depths.get(promotions, 0) + 1
+
+    def finish(self, simulated_time):
+        self.wall_time += time.perf_counter() - self._started
+        self.simulated_time = simulated_time
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.peak_memory = peak if self.peak_memory is None else max(self.peak_memory, peak)
+        if resource is not None:
+            self.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Reported in KiB on Linux
+
+    @property
+    def events(self):
+        return self.counters.get("events", 0)
+
+    @property
+    def events_per_second(self):
+        return self.events / self.wall_time if self.wall_time > 0 else 0
+
+    @property
+    def max_cascade_depth(self):
+        return max(self.cascade_depths, default=0)
+
+    def summary(self):
+        """
+        Plain dict of every measurement, e.g. for logging or JSON.
+        """
+        return {
+            "wall_time": self.wall_time,
+            "simulated_time": self.simulated_time,
+            "events": self.events,
+            "events_per_second": self.events_per_second,
+            "timers": dict(self.timers),
+            "counters": dict(self.counters),
+            "cascade_depths": dict(sorted(self.cascade_depths.items())),
+            "max_cascade_depth": self.max_cascade_depth,
+            "peak_memory": self.peak_memory,
+            "max_rss": self.max_rss,
+        }
+
+    def __str__(self):
+        lines = [
+            f"Wall time: {self.wall_time:.3f}s for {self.simulated_time:.2f} simulated time units",
+            f"Events: {self.events} ({self.events_per_second:.1f}/s)",
+        ]
+        total = sum(self.timers.values())
+        for phase, seconds in self.timers.items():
+            share = seconds / total if total > 0 else 0
+            lines.append(f"  {phase:<10} {seconds:9.4f}s {share:6.1%}")
+        lines.extend(f"  {name:<16} {value}" for name, value in self.counters.items())
+        lines.append(f"Max cascade depth: {self.max_cascade_depth}")
+        if self.peak_memory is not None:
+            lines.append(f"Peak traced memory: {self.peak_memory / 2 ** 20:.2f} MiB")
+        if self.max_rss is not None:
+            lines.append(f"Max resident memory: {self.max_rss / 2 ** 20:.2f} MiB")
+        return "\n".join(lines)
+
+def print_progress(time, stats):
+    """
+    Model.run progress callback that prints the simulation time, like runs used to by default.
+    """
+    print(f"Simulation time: {time:.2f}")
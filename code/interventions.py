@@ -20,41 +20,40 @@ Promotion Specific Interventions:
 Hire Specific Interventions:
 1. Completely random hiring (hire a person completely at random)
 2. Population-based hiring (hire people based on the population percentages)
+
+Policies are interchangeable with the base functions in BaseModel, with exact steps or tau leaping.
+Promotion policies are marked @vectorized and called as func(state, candidates, level, identities), where
+`candidates` gives the column arrays of the employees who can fill the vacancy (see state.Candidates). CountModel
+runs the hiring policies and random_promotion_func, but not the policies that read the candidates' performance or
+experience, which it does not track (see count_model.CellCandidates). Hiring policies are called as func(state,
+identities, population_percentages). Both return either a probability vector (over the candidates, or over
+`identities`) or the index of their choice.
 """
+import numpy as np
 from constants import *
-from base_functions import base_bias_func
+from base_functions import scalar_bias_func
+from utils import vectorized
 
 ### PROMOTION INTERVENTIONS ###
-def random_promotion_func(state, employees, level, identities):
-    num_employees = len(employees)
-    probability = 1 / num_employees
-    promotion_probabilities = [probability] * num_employees
-    return promotion_probabilities
+@vectorized
+def random_promotion_func(state, candidates, level, identities):
+    return np.full(len(candidates), 1 / len(candidates))
 
-def performance_promotion_func(state, employees, level, identities):
-    num_employees = len(employees)
-    promotion_probabilities = [0] * num_employees
-    highest_index = max(enumerate(employees), key=lambda e: e[1].performance_level)[0]
-    promotion_probabilities[highest_index] = 1
-    return promotion_probabilities
+@vectorized
+def performance_promotion_func(state, candidates, level, identities):
+    return int(np.argmax(candidates.performance))
 
-def seniority_promotion_func(state, employees, level, identities):
-    num_employees = len(employees)
-    promotion_probabilities = [0] * num_employees
-    highest_index = max(enumerate(employees), key=lambda e: e[1].position_experience)[0]
-    promotion_probabilities[highest_index] = 1
-    return promotion_probabilities
+@vectorized
+def seniority_promotion_func(state, candidates, level, identities):
+    return int(np.argmax(candidates.position_experience))
 
 ### HIRING INTERVENTIONS ###
-def uniform_hire_func(state, identities):
-    identity_probabilities = [1 / len(identities)] * len(identities)
-    return identity_probabilities
+def uniform_hire_func(state, identities, population_percentages):
+    return np.full(len(identities), 1 / len(identities))
 
 def population_hire_func(state, identities, population_percentages):
-    identity_probabilities = []
-    for identity in identities:
-        identity_probabilities.append(population_percentages.get(identity, 0))
-    if sum(identity_probabilities) != 1.0:
+    identity_probabilities = np.array([population_percentages.get(identity, 0) for identity in identities], dtype=np.float64)
+    if not np.isclose(identity_probabilities.sum(), 1.0):
         raise ValueError("Population percentages do not sum to 1.")
     return identity_probabilities
 
@@ -63,4 +62,4 @@ def decay_bias_func(employee):
     current_bias = employee.bias_score
     decayed_bias = current_bias * BIAS_DECAY_RATE
     employee.bias_score = decayed_bias
-    return base_bias_func(employee)
+    return scalar_bias_func(employee)
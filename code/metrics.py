@@ -1,23 +1,26 @@
 import numpy as np
+from recording import Observer
+from constants import *
 
 ### METRICS ###
+def _identity_counts(state, identities, level=None):
+    """
+    Count the employees of each identity, and in total, for the entire company or a specific level.
+    """
+    counts = state.get_identity_counts(level)
+    return {identity: counts.get(identity, 0) for identity in identities}, sum(counts.values())
+
 def naive_bias_metric(state, identities, level=None):
     """
     Calculate the naive bias for the entire company or a specific level.
 
     Naive bias is the squared difference between the actual and uniform share of each identity group.
     """
-    employees = state.employees if level is None else [e for e in state.employees if e.position_level == level]
-    total_employees = len(employees)
+    identity_counts, total_employees = _identity_counts(state, identities, level)
     if total_employees == 0:
         return 0  # No employees at this level or in the company
 
     expected_share = 1 / len(identities)
-    identity_counts = {identity: 0 for identity in identities}
-    
-    for employee in employees:
-        identity_counts[employee.identity] += 1
-    
     bias = sum(
         ((identity_counts[identity] / total_employees) - expected_share) ** 2
         for identity in identities
@@ -30,16 +33,10 @@ def population_bias_metric(state, identities, general_population_percentages, le
 
     Population bias is the squared difference between the actual and general population share of each identity group.
     """
-    employees = state.employees if level is None else [e for e in state.employees if e.position_level == level]
-    total_employees = len(employees)
+    identity_counts, total_employees = _identity_counts(state, identities, level)
     if total_employees == 0:
         return 0  # No employees at this level or in the company
 
-    identity_counts = {identity: 0 for identity in identities}
-    
-    for employee in employees:
-        identity_counts[employee.identity] += 1
-    
     bias = sum(
         ((identity_counts[identity] / total_employees) - general_population_percentages.get(identity, 0)) ** 2
         for identity in identities
@@ -52,98 +49,204 @@ def performance_metric(state, level_weights=None, level=None):
 
     Performance is weighted by the position level of each employee.
     """
-    employees = state.employees if level is None else [e for e in state.employees if e.position_level == level]
-    if level_weights is None:
-        level_weights = {level: level + 1 for level in range(max(e.position_level for e in state.employees) + 1)}
-
-    weighted_performance_sum = 0
-    total_weight = 0
-    
-    for employee in employees:
-        if employee.position_level is not None:
-            weight = level_weights.get(employee.position_level, employee.position_level + 1)
-            weighted_performance_sum += weight * employee.performance_level
-            total_weight += weight
-    
-    return weighted_performance_sum / total_weight if total_weight > 0 else 0
+    level_counts = state.counts.sum(axis=1)
+    level_performance = state.cell_totals("performance").sum(axis=1)
+    weights = np.array([(level_weights or {}).get(l, l + 1) for l in range(len(level_counts))], dtype=np.float64)
+    if level is not None:
+        if not 0 <= level < len(level_counts):
+            return 0
+        level_counts, level_performance, weights = level_counts[level:level + 1], level_performance[level:level + 1], weights[level:level + 1]
+    if level_counts.sum() == 0:
+        return 0
+
+    total_weight = weights @ level_counts
+    return float(weights @ level_performance / total_weight) if total_weight > 0 else 0
 
 def average_company_experience(state, level=None):
     """
     Calculate the average company experience for the entire company or a specific level.
     """
-    employees = state.employees if level is None else [e for e in state.employees if e.position_level == level]
-    total_employees = len(employees)
-    
-    if total_employees == 0:
+    counts = state.counts.sum(axis=1)
+    experience = state.cell_totals("company_experience").sum(axis=1)
+    if level is not None:
+        counts, experience = counts[level:level + 1], experience[level:level + 1]
+    if counts.sum() == 0:
         return 0  # No employees at this level or in the company
 
-    total_experience = sum(employee.company_experience for employee in employees)
-    return total_experience / total_employees
+    return float(experience.sum() / counts.sum())
 
 
-def calculate_average_company_experience_over_path(path):
-    """
-    Calculate the average company experience over the entire path.
+### PATH TENSORS ###
+TENSORS = {"counts": None, "performance_sums": "performance", "experience_sums": "company_experience"}
+AVERAGED_METRICS = ["naive_biases", "population_biases", "performances", "experiences"]
+
+def path_tensors(path):
     """
-    timestamps = [timestamp for timestamp, _ in path]
-    experiences = {"company": []}
+    Reduce a path to dense per-cell tensors in one pass over its states.
 
-    # Initialize metrics for each level
-    levels = {employee.position_level for _, state in path for employee in state.employees if employee.position_level is not None}
-    for level in levels:
-        experiences[level] = []
+    Parameters:
+        path (list, EventPath or StoredPath): List of (timestamp, state) tuples, or a recorded or stored path.
+                                              Stored paths already hold the tensors and are not replayed.
 
+    Returns:
+        dict: "timestamps" of shape (T,), the "identities" indexing the last axis, and the "counts",
+              "performance_sums" and "experience_sums" of every state, of shape (T, levels, identities).
+    """
+    if hasattr(path, "tensor"):
+        tensors = {name: np.asarray(path.tensor(name)) for name in TENSORS}
+        return {"timestamps": np.asarray(path.timestamps, dtype=np.float64), "identities": list(path.identities), **tensors}
+
+    timestamps = []
+    identity_index = {}
+    cells = []
     for timestamp, state in path:
-        # Company-wide metric
-        experiences["company"].append(average_company_experience(state))
+        timestamps.append(timestamp)
+        for identity in state.identities:
+            identity_index.setdefault(identity, len(identity_index))
+        columns = [identity_index[identity] for identity in state.identities]
+        # Copy the counts, as states yielded by an EventPath keep changing
+        cells.append((columns, [state.counts.copy() if column is None else state.cell_totals(column) for column in TENSORS.values()]))
+
+    num_levels = max((values[0].shape[0] for _, values in cells), default=0)
+    tensors = {
+        name: np.zeros((len(cells), num_levels, len(identity_index)), dtype=np.float64 if column else np.int64)
+        for name, column in TENSORS.items()
+    }
+    for index, (columns, values) in enumerate(cells):
+        for name, value in zip(TENSORS, values):
+            tensors[name][index][:value.shape[0], columns] = value
+    return {"timestamps": np.asarray(timestamps, dtype=np.float64), "identities": list(identity_index), **tensors}
+
+### TENSOR METRICS ###
+def _safe_divide(numerator, denominator):
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=np.float64), denominator)
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+def metrics_from_totals(counts, performance_sums, experience_sums, columns, identities, general_population_percentages, level_weights=None):
+    """
+    Compute every metric from headcounts and performance / experience sums per level and identity.
+
+    Parameters:
+        counts, performance_sums, experience_sums (np.ndarray): Arrays of shape (..., levels, state identities).
+                                                                Leading axes, such as time, are kept.
+        columns (list): Identity axis column of each entry of `identities`, or None if it is absent.
+        identities (list): List of identity groups (e.g., ["F", "M"]).
+        general_population_percentages (dict): General population percentages for each identity.
+        level_weights (dict, optional): Weights for each level. Defaults to level + 1.
 
-        # Per-level metrics
-        for level in levels:
-            experiences[level].append(average_company_experience(state, level=level))
+    Returns:
+        dict: For every metric, a "company" array of shape (...) and a "levels" array of shape (..., levels).
+              "identity_percentages" has an extra trailing axis over `identities`.
+    """
+    num_levels = counts.shape[-2]
+    level_counts = counts.sum(axis=-1)
+    company_counts = level_counts.sum(axis=-1)
+    selected = np.stack(
+        [counts[..., column] if column is not None else np.zeros(counts.shape[:-1]) for column in columns],
+        axis=-1,
+    )
+    level_shares = _safe_divide(selected, level_counts[..., None])
+    company_shares = _safe_divide(selected.sum(axis=-2), company_counts[..., None])
+
+    def squared_gap(shares, targets, totals):
+        return np.where(totals > 0, ((shares - targets) ** 2).sum(axis=-1), 0)
+
+    uniform_shares = np.full(len(identities), 1 / len(identities))
+    population_shares = np.array([general_population_percentages.get(identity, 0) for identity in identities])
+    weights = np.array([(level_weights or {}).get(level, level + 1) for level in range(num_levels)], dtype=np.float64)
+    level_performance = performance_sums.sum(axis=-1)
+    level_experience = experience_sums.sum(axis=-1)
 
     return {
-        "timestamps": timestamps,
-        "experiences": experiences,
+        "naive_biases": {
+            "company": squared_gap(company_shares, uniform_shares, company_counts),
+            "levels": squared_gap(level_shares, uniform_shares, level_counts),
+        },
+        "population_biases": {
+            "company": squared_gap(company_shares, population_shares, company_counts),
+            "levels": squared_gap(level_shares, population_shares, level_counts),
+        },
+        "performances": {
+            "company": _safe_divide((weights * level_performance).sum(axis=-1), (weights * level_counts).sum(axis=-1)),
+            "levels": _safe_divide(weights * level_performance, weights * level_counts),
+        },
+        "experiences": {
+            "company": _safe_divide(level_experience.sum(axis=-1), company_counts),
+            "levels": _safe_divide(level_experience, level_counts),
+        },
+        "identity_percentages": {
+            "company": company_shares,
+            "levels": level_shares,
+        },
     }
 
-def calculate_metrics_over_path(path, identities, general_population_percentages, level_weights=None, tolerance=0.01):
-    timestamps = [timestamp for timestamp, _ in path]
-    naive_biases = {"company": []}
-    population_biases = {"company": []}
-    performances = {"company": []}
-    experiences = {"company": []}
-
-    # Initialize metrics for each level
-    levels = {employee.position_level for _, state in path for employee in state.employees if employee.position_level is not None}
+def tensor_metrics(tensors, identities, general_population_percentages, level_weights=None):
+    """
+    Apply `metrics_from_totals` to the output of `path_tensors`, giving every metric at every time step.
+    """
+    identity_index = {identity: column for column, identity in enumerate(tensors["identities"])}
+    return metrics_from_totals(
+        tensors["counts"],
+        tensors["performance_sums"],
+        tensors["experience_sums"],
+        [identity_index.get(identity) for identity in identities],
+        identities,
+        general_population_percentages,
+        level_weights,
+    )
+
+def _occupied_levels(tensors):
+    """
+    Every position level occupied at some point along the path.
+    """
+    return np.flatnonzero(tensors["counts"].sum(axis=(0, 2))).tolist()
+
+def _level_series(metric, levels):
+    """
+    Convert a metric of `metrics_from_totals` to the {"company": [...], level: [...]} series of the path functions.
+    """
+    series = {"company": metric["company"].tolist()}
     for level in levels:
-        naive_biases[level] = []
-        population_biases[level] = []
-        performances[level] = []
-        experiences[level] = []
+        series[level] = metric["levels"][:, level].tolist()
+    return series
 
-    for timestamp, state in path:
-        # Company-wide metrics
-        naive_biases["company"].append(naive_bias_metric(state, identities))
-        population_biases["company"].append(population_bias_metric(state, identities, general_population_percentages))
-        performances["company"].append(performance_metric(state, level_weights))
-        experiences["company"].append(average_company_experience(state))
-
-        # Per-level metrics
-        for level in levels:
-            naive_biases[level].append(naive_bias_metric(state, identities, level=level))
-            population_biases[level].append(population_bias_metric(state, identities, general_population_percentages, level=level))
-            performances[level].append(performance_metric(state, level_weights, level=level))
-            experiences[level].append(average_company_experience(state, level=level))
+def _identity_series(shares, levels, identities):
+    percentages = {"company": {identity: shares["company"][:, k].tolist() for k, identity in enumerate(identities)}}
+    for level in levels:
+        percentages[level] = {identity: shares["levels"][:, level, k].tolist() for k, identity in enumerate(identities)}
+    return percentages
 
+def calculate_average_company_experience_over_path(path):
+    """
+    Calculate the average company experience over the entire path.
+    """
+    tensors = path_tensors(path)
+    values = tensor_metrics(tensors, tensors["identities"], {})
     return {
-        "timestamps": timestamps,
-        "naive_biases": naive_biases,
-        "population_biases": population_biases,
-        "performances": performances,
-        "experiences": experiences,
+        "timestamps": tensors["timestamps"].tolist(),
+        "experiences": _level_series(values["experiences"], _occupied_levels(tensors)),
     }
 
+def calculate_metrics_over_path(path, identities, general_population_percentages, level_weights=None, tolerance=0.01):
+    tensors = path_tensors(path)
+    values = tensor_metrics(tensors, identities, general_population_percentages, level_weights)
+    levels = _occupied_levels(tensors)
+    metrics = {"timestamps": tensors["timestamps"].tolist()}
+    for name in AVERAGED_METRICS:
+        metrics[name] = _level_series(values[name], levels)
+    metrics["time_to_equilibrium"] = time_to_equilibrium(tensors, identities, general_population_percentages, tolerance)
+    return metrics
+
 ### AVERAGES ###
+def _time_average(values, delta_ts):
+    """
+    Average of `values` over their leading time axis, each entry weighted by the time since the previous one.
+    """
+    total_time = np.sum(delta_ts)
+    if total_time <= 0:
+        return np.zeros(np.shape(values)[1:])
+    return np.tensordot(delta_ts, values, axes=1) / total_time
+
 def compute_weighted_averages(metrics, timestamps, identity_percentages):
     """
     Compute the weighted average of each metric over the entire run.
@@ -158,52 +261,39 @@ def compute_weighted_averages(metrics, timestamps, identity_percentages):
         dict: A dictionary containing the weighted average of each metric for the company and each level,
               and the average population percentage of each identity.
     """
-    averages = {
-        "naive_biases": {},
-        "population_biases": {},
-        "performances": {},
-        "experiences": {},
-        "identity_percentages": {"company": {}, "levels": {}}
-    }
-
-    # Calculate delta_ts
     delta_ts = np.diff(timestamps, prepend=timestamps[0])
 
-    # Compute weighted averages for each metric
-    for metric_name in ["naive_biases", "population_biases", "performances", "experiences"]:
-        metric_data = metrics[metric_name]
-
-        for level, values in metric_data.items():
-            if len(values) == len(delta_ts):
-                weighted_sum = np.sum(np.array(values) * delta_ts)
-                total_time = np.sum(delta_ts)
-                averages[metric_name][level] = weighted_sum / total_time if total_time > 0 else 0
-            else:
-                averages[metric_name][level] = 0  # Handle mismatched lengths
-
-    # Compute average identity percentages for the company
-    identity_totals = {identity: 0 for identity in identity_percentages["company"].keys()}
-    total_time = np.sum(delta_ts)
-
-    for identity in identity_totals:
-        weighted_sum = np.sum(
-            np.array(identity_percentages["company"][identity]) * delta_ts
-        )
-        identity_totals[identity] = weighted_sum / total_time if total_time > 0 else 0
-
-    averages["identity_percentages"]["company"] = identity_totals
+    def average(values):
+        values = np.asarray(values, dtype=np.float64)
+        return float(_time_average(values, delta_ts)) if len(values) == len(delta_ts) else 0  # Handle mismatched lengths
 
-    # Compute average identity percentages for each level
-    levels = identity_percentages.keys() - {"company"}
-    for level in levels:
-        level_totals = {identity: 0 for identity in identity_percentages[level].keys()}
-        for identity in level_totals:
-            weighted_sum = np.sum(
-                np.array(identity_percentages[level][identity]) * delta_ts
-            )
-            level_totals[identity] = weighted_sum / total_time if total_time > 0 else 0
-        averages["identity_percentages"]["levels"][level] = level_totals
+    averages = {
+        metric_name: {level: average(values) for level, values in metrics[metric_name].items()}
+        for metric_name in AVERAGED_METRICS
+    }
+    averages["identity_percentages"] = {
+        "company": {identity: average(values) for identity, values in identity_percentages["company"].items()},
+        "levels": {
+            level: {identity: average(values) for identity, values in percentages.items()}
+            for level, percentages in identity_percentages.items() if level != "company"
+        },
+    }
+    return averages
 
+def _tensor_weighted_averages(values, delta_ts, levels, identities):
+    """
+    Time-weighted averages of every metric of `tensor_metrics`, in the format of `compute_weighted_averages`.
+    """
+    averages = {}
+    for name in AVERAGED_METRICS:
+        company, per_level = _time_average(values[name]["company"], delta_ts), _time_average(values[name]["levels"], delta_ts)
+        averages[name] = {"company": float(company), **{level: float(per_level[level]) for level in levels}}
+
+    company, per_level = (_time_average(values["identity_percentages"][key], delta_ts) for key in ("company", "levels"))
+    averages["identity_percentages"] = {
+        "company": dict(zip(identities, company.tolist())),
+        "levels": {level: dict(zip(identities, per_level[level].tolist())) for level in levels},
+    }
     return averages
 
 # Example usage
@@ -213,31 +303,29 @@ def calculate_metrics_with_weighted_averages(
     """
     Calculate all metrics over the path and their weighted averages.
 
+    The path is reduced to count tensors once, and every metric and average is computed from them with array operations.
+
     Parameters:
-        path (list): List of (timestamp, state) tuples.
+        path (list, EventPath or StoredPath): List of (timestamp, state) tuples, or a recorded or stored path.
         identities (list): List of identity groups (e.g., ["F", "M"]).
         general_population_percentages (dict): General population percentages for each identity.
         level_weights (dict, optional): Weights for each level. Defaults to None.
-        tolerance (float, optional): Convergence tolerance. Defaults to 0.01.
+        tolerance (float, optional): Drift of the equilibrium quantities always allowed at equilibrium, see `find_equilibrium`. Defaults to 0.01.
 
     Returns:
-        dict: A dictionary containing all metrics over the path and their weighted averages.
+        dict: A dictionary containing all metrics over the path, their weighted averages and the time to equilibrium.
     """
-    # Extract timestamps
-    timestamps = [timestamp for timestamp, _ in path]
-
-    # Calculate metrics over the path
-    metrics = calculate_metrics_over_path(
-        path, identities, general_population_percentages, level_weights, tolerance
-    )
-
-    # Calculate identity percentages over the path
-    identity_percentages = calculate_identity_percentages_over_path(path, identities)
-
-    # Compute weighted averages
-    weighted_averages = compute_weighted_averages(metrics, timestamps, identity_percentages["percentages"])
-
-    metrics["weighted_averages"] = weighted_averages
+    tensors = path_tensors(path)
+    values = tensor_metrics(tensors, identities, general_population_percentages, level_weights)
+    levels = _occupied_levels(tensors)
+    timestamps = tensors["timestamps"]
+
+    metrics = {"timestamps": timestamps.tolist()}
+    for name in AVERAGED_METRICS:
+        metrics[name] = _level_series(values[name], levels)
+    delta_ts = np.diff(timestamps, prepend=timestamps[0]) if len(timestamps) else timestamps
+    metrics["weighted_averages"] = _tensor_weighted_averages(values, delta_ts, levels, identities)
+    metrics["time_to_equilibrium"] = time_to_equilibrium(tensors, identities, general_population_percentages, tolerance)
     return metrics
 
 ### IDENTITY PERCENTAGES ###
@@ -253,16 +341,12 @@ def identity_percentages(state, identities, level=None):
     Returns:
         dict: A dictionary with identity percentages.
     """
-    employees = state.employees if level is None else [e for e in state.employees if e.position_level == level]
-    total_employees = len(employees)
+    identity_counts, total_employees = _identity_counts(state, identities, level)
     
     if total_employees == 0:
         return {identity: 0 for identity in identities}
 
-    identity_counts = {identity: 0 for identity in identities}
-    for employee in employees:
-        identity_counts[employee.identity] += 1
-    
+
     percentages = {identity: identity_counts[identity] / total_employees for identity in identities}
     return percentages
 
@@ -271,34 +355,273 @@ def calculate_identity_percentages_over_path(path, identities):
     Calculate identity percentages over the entire simulation path.
 
     Parameters:
-        path (list): List of (timestamp, state) tuples.
+        path (list, EventPath or StoredPath): List of (timestamp, state) tuples, or a recorded or stored path.
         identities (list): List of identity groups (e.g., ["F", "M"]).
 
     Returns:
         dict: Identity percentages for each level and the entire company over time.
     """
-    timestamps = [timestamp for timestamp, _ in path]
-    percentages = {"company": {identity: [] for identity in identities}}
+    tensors = path_tensors(path)
+    values = tensor_metrics(tensors, identities, {})
+    return {
+        "timestamps": tensors["timestamps"].tolist(),
+        "percentages": _identity_series(values["identity_percentages"], _occupied_levels(tensors), identities),
+    }
 
-    # Determine all levels
-    levels = {employee.position_level for _, state in path for employee in state.employees if employee.position_level is not None}
-    for level in levels:
-        percentages[level] = {identity: [] for identity in identities}
+### ONLINE METRICS ###
+def state_metrics(state, identities, general_population_percentages, level_weights=None):
+    """
+    Compute every metric of a single state with `metrics_from_totals`.
+    """
+    columns = [state.identity_index.get(identity) for identity in identities]
+    return metrics_from_totals(
+        state.counts,
+        state.cell_totals("performance"),
+        state.cell_totals("company_experience"),
+        columns,
+        identities,
+        general_population_percentages,
+        level_weights,
+    )
 
-    for _, state in path:
-        # Company-wide percentages
-        company_percentages = identity_percentages(state, identities)
-        for identity in identities:
-            percentages["company"][identity].append(company_percentages[identity])
+def _pad_levels(values, num_levels):
+    if values.shape[0] >= num_levels:
+        return values
+    return np.concatenate([values, np.zeros((num_levels - values.shape[0],) + values.shape[1:])])
 
-        # Per-level percentages
-        for level in levels:
-            level_percentages = identity_percentages(state, identities, level=level)
-            for identity in identities:
-                percentages[level][identity].append(level_percentages[identity])
+class MetricsObserver(Observer):
+    """
+    Model.run observer that accumulates the metrics of `calculate_metrics_with_weighted_averages` during the run.
 
-    return {
-        "timestamps": timestamps,
-        "percentages": percentages,
-    }
+    Only the time-weighted sums are kept, so memory is O(levels x identities) regardless of run length,
+    unless `keep_series` is set to also keep every metric's time series.
+    """
+    def __init__(self, identities, general_population_percentages, level_weights=None, keep_series=False):
+        self.identities = identities
+        self.general_population_percentages = general_population_percentages
+        self.level_weights = level_weights
+        self.keep_series = keep_series
+
+    def start(self, time, state):
+        self.start_time = self.last_time = time
+        self.weighted_sums = None
+        self.occupied = np.zeros(0, dtype=bool)
+        self.timestamps = []
+        self.series = []
+        self.step(time, state)
+
+    def step(self, time, state):
+        values = state_metrics(state, self.identities, self.general_population_percentages, self.level_weights)
+        delta_t = time - self.last_time
+        self.last_time = time
+
+        num_levels = max(len(self.occupied), state.counts.shape[0])
+        self.occupied = _pad_levels(self.occupied, num_levels).astype(bool) | _pad_levels(state.counts.sum(axis=1) > 0, num_levels)
+        if self.weighted_sums is None:
+            self.weighted_sums = {name: {"company": 0.0, "levels": np.zeros((0,) + metric["levels"].shape[1:])} for name, metric in values.items()}
+        for name, metric in values.items():
+            sums = self.weighted_sums[name]
+            sums["company"] = sums["company"] + metric["company"] * delta_t
+            sums["levels"] = _pad_levels(sums["levels"], num_levels) + _pad_levels(metric["levels"], num_levels) * delta_t
+
+        if self.keep_series:
+            self.timestamps.append(time)
+            self.series.append(values)
+
+    def weighted_averages(self):
+        """
+        Time-weighted averages in the format of `compute_weighted_averages`.
+        """
+        total_time = self.last_time - self.start_time
+        levels = np.flatnonzero(self.occupied).tolist()
+
+        def average(value):
+            return value / total_time if total_time > 0 else 0 * value
+
+        averages = {}
+        for name in AVERAGED_METRICS:
+            sums = self.weighted_sums[name]
+            averages[name] = {"company": average(sums["company"])}
+            averages[name].update({level: average(sums["levels"][level]) for level in levels})
+
+        sums = self.weighted_sums["identity_percentages"]
+        averages["identity_percentages"] = {
+            "company": dict(zip(self.identities, average(sums["company"]))),
+            "levels": {level: dict(zip(self.identities, average(sums["levels"][level]))) for level in levels},
+        }
+        return averages
+
+    def results(self):
+        """
+        The weighted averages, plus the metric time series in the format of `calculate_metrics_over_path`
+        when `keep_series` is set.
+        """
+        results = {"weighted_averages": self.weighted_averages()}
+        if self.keep_series:
+            levels = np.flatnonzero(self.occupied).tolist()
+            results["timestamps"] = list(self.timestamps)
+            for name in AVERAGED_METRICS:
+                results[name] = {"company": [values[name]["company"] for values in self.series]}
+                for level in levels:
+                    results[name][level] = [
+                        values[name]["levels"][level] if level < len(values[name]["levels"]) else 0
+                        for values in self.series
+                    ]
+        return results
+
+### EQUILIBRIUM ###
+EQUILIBRIUM_METRICS = ["identity_percentages", "naive_biases", "population_biases"]
+
+def equilibrium_quantities(counts, columns, identities, general_population_percentages):
+    """
+    The quantities whose stationarity defines equilibrium: the identity shares and both bias metrics,
+    of the company and of every level, flattened into the last axis.
+
+    Parameters:
+        counts (np.ndarray): Headcounts of shape (..., levels, state identities), as in `metrics_from_totals`.
+        columns (list): Identity axis column of each entry of `identities`, or None if it is absent.
+
+    Returns:
+        np.ndarray: Array of shape (..., quantities).
+    """
+    zeros = np.zeros(counts.shape)
+    values = metrics_from_totals(counts, zeros, zeros, columns, identities, general_population_percentages)
+    leading = counts.shape[:-2]
+    return np.concatenate(
+        [values[name][key].reshape(leading + (-1,)) for name in EQUILIBRIUM_METRICS for key in ("company", "levels")],
+        axis=-1,
+    )
+
+def batch_means(timestamps, values, batch_length=EQUILIBRIUM_BATCH_LENGTH):
+    """
+    Time averages of `values` over consecutive batches of `batch_length` from the first timestamp. Each
+    value holds from its timestamp until the next one. Only batches that end by the last timestamp are returned.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(timestamps) == 0:
+        return np.zeros((0,) + values.shape[1:])
+    num_batches = int((timestamps[-1] - timestamps[0]) // batch_length)
+    integrals = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values[:-1] * np.diff(timestamps)[:, None], axis=0)])
+    bounds = timestamps[0] + batch_length * np.arange(num_batches + 1)
+    index = np.searchsorted(timestamps, bounds, side="right") - 1
+    at_bounds = integrals[index] + values[index] * (bounds - timestamps[index])[:, None]
+    return np.diff(at_bounds, axis=0) / batch_length
+
+def window_drift(means):
+    """
+    Difference, per quantity, between the average of the first and of the second half of the batch means, and
+    its standard error from the spread of the batch means within each half.
+    """
+    half = len(means) // 2
+    first, second = means[:half], means[-half:]
+    drift = np.abs(first.mean(axis=0) - second.mean(axis=0))
+    standard_error = np.sqrt((first.var(axis=0, ddof=1) + second.var(axis=0, ddof=1)) / half)
+    return drift, standard_error
+
+def is_stationary(means, tolerance=0.01, standard_errors=EQUILIBRIUM_STANDARD_ERRORS):
+    """
+    Whether no quantity drifts over the batch means by more than `tolerance` plus `standard_errors` of its standard
+    error, so that drift hidden by the noise of the run does not count against equilibrium.
+    """
+    drift, standard_error = window_drift(means)
+    return bool(np.all(drift <= tolerance + standard_errors * standard_error))
+
+def _check_window(window):
+    if window < 4:
+        raise ValueError(f"The drift test needs a window of at least 4 batch means, not {window}.")
 
+def find_equilibrium(means, tolerance=0.01, window=EQUILIBRIUM_WINDOW, standard_errors=EQUILIBRIUM_STANDARD_ERRORS):
+    """
+    Index of the first batch of the first `window` consecutive batch means that are stationary (see `is_stationary`), or None.
+    """
+    _check_window(window)
+    for end in range(window, len(means) + 1):
+        if is_stationary(means[end - window:end], tolerance, standard_errors):
+            return end - window
+    return None
+
+def time_to_equilibrium(tensors, identities, general_population_percentages, tolerance=0.01, batch_length=EQUILIBRIUM_BATCH_LENGTH, window=EQUILIBRIUM_WINDOW, standard_errors=EQUILIBRIUM_STANDARD_ERRORS):
+    """
+    Time from the start of the path to the start of its first stationary window (see `find_equilibrium`)
+    of the equilibrium quantities, or None if the path never settles.
+    """
+    timestamps = tensors["timestamps"]
+    identity_index = {identity: column for column, identity in enumerate(tensors["identities"])}
+    columns = [identity_index.get(identity) for identity in identities]
+    quantities = equilibrium_quantities(tensors["counts"], columns, identities, general_population_percentages)
+    start = find_equilibrium(batch_means(timestamps, quantities, batch_length), tolerance, window, standard_errors)
+    return None if start is None else float(start * batch_length)
+
+class EquilibriumMonitor(Observer):
+    """
+    Model.run observer that detects when the run reaches equilibrium, with the same batch means and drift
+    test as `time_to_equilibrium`, and with `stop_early` ends the run once it has.
+
+    The equilibrium quantities are time-averaged over batches of `batch_length`, and the run is at
+    equilibrium once the latest `window` batch means are stationary, drifting by at most `tolerance` plus
+    `standard_errors` standard errors (see `is_stationary`). `equilibrium_time` is the start of that window
+    and `detection_time` the end of its last batch. `drift` is the largest drift of the latest window.
+    Levels added after the start are ignored.
+    """
+    def __init__(self, identities, general_population_percentages, tolerance=0.01, batch_length=EQUILIBRIUM_BATCH_LENGTH, window=EQUILIBRIUM_WINDOW, standard_errors=EQUILIBRIUM_STANDARD_ERRORS, stop_early=False):
+        _check_window(window)
+        self.identities = identities
+        self.general_population_percentages = general_population_percentages
+        self.tolerance = tolerance
+        self.batch_length = batch_length
+        self.window = window
+        self.standard_errors = standard_errors
+        self.stop_early = stop_early
+
+    def start(self, time, state):
+        self.start_time = self.last_time = time
+        self.num_levels = state.counts.shape[0]
+        self.batch_integral = 0
+        self.means = []
+        self.drift = None
+        self.equilibrium_time = None
+        self.detection_time = None
+        self.step(time, state)
+
+    def advance(self, time, state):
+        # The current value has held since the last event and is about to change at `time`
+        while time >= self.start_time + self.batch_length * (len(self.means) + 1):
+            end = self.start_time + self.batch_length * (len(self.means) + 1)
+            self.batch_integral = self.batch_integral + self.value * (end - self.last_time)
+            self.last_time = end
+            self._close_batch()
+        self.batch_integral = self.batch_integral + self.value * (time - self.last_time)
+        self.last_time = time
+
+    def step(self, time, state):
+        counts = _pad_levels(state.counts[:self.num_levels], self.num_levels)
+        columns = [state.identity_index.get(identity) for identity in self.identities]
+        self.value = equilibrium_quantities(counts, columns, self.identities, self.general_population_percentages)
+
+    def _close_batch(self):
+        self.means.append(self.batch_integral / self.batch_length)
+        self.batch_integral = 0
+        if len(self.means) < self.window:
+            return
+        means = np.array(self.means[-self.window:])
+        self.drift = float(window_drift(means)[0].max())
+        if self.equilibrium_time is None and is_stationary(means, self.tolerance, self.standard_errors):
+            self.equilibrium_time = self.start_time + self.batch_length * (len(self.means) - self.window)
+            self.detection_time = self.last_time
+
+    def should_stop(self):
+        return self.stop_early and self.equilibrium_time is not None
+
+    @property
+    def time_to_equilibrium(self):
+        return None if self.equilibrium_time is None else self.equilibrium_time - self.start_time
+
+    def results(self):
+        return {
+            "time_to_equilibrium": self.time_to_equilibrium,
+            "equilibrium_time": self.equilibrium_time,
+            "detection_time": self.detection_time,
+            "drift": self.drift,
+            "batch_means": np.array(self.means),
+        }
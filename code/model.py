@@ -1,9 +1,17 @@
 from abc import ABC, abstractmethod
-from constants import RNG
-from copy import deepcopy
+from recording import make_recorder
+from checkpoint import CheckpointWriter, restore_checkpoint, take_checkpoint
 import matplotlib.pyplot as plt
 
+# Events that can happen to any employee, before a model's identity channels (see channels.py)
+DEPARTURE_EVENTS = ["fire", "quit", "leave"]
+
 class Model(ABC):
+    # Mutable attributes saved in checkpoints, besides the working state and the generator's bit state
+    checkpoint_attributes = ("time", "log")
+    # utils.RandomStreams to draw each kind of random number from, instead of `rng`
+    streams = None
+
     @abstractmethod
     def transition_rate(self, state):
         raise NotImplementedError
@@ -20,27 +28,126 @@ class Model(ABC):
     def promote(self, state, level):
         raise NotImplementedError
     
-    def run(self, state_init, n_steps=256, log_interval=10):
-        self.time = 0.0
-        path = [(self.time, deepcopy(state_init))]
-        last_logged_time = 0  # Tracks the last logged time for intervals
+    def initial_state(self, state_init):
+        """
+        The working state of a run: a copy of `state_init`, so the caller's state is left untouched.
+        """
+        return state_init.copy()
+
+    def leap_size(self, state, rate):
+        """
+        Length of the next tau leap, or None to simulate the next event exactly. Models without
+        tau leaping always step exactly.
+        """
+        return None
+
+    def sample_leap(self, state, tau):
+        raise NotImplementedError
+
+    def stream(self, name):
+        """
+        Generator of one kind of random draw (see utils.RANDOM_STREAMS): `rng`, unless the model has `streams`.
+        """
+        return self.rng if self.streams is None else getattr(self.streams, name)
+
+    def select_event(self, rates):
+        """
+        Index of the next event, drawn in proportion to `rates`. Rounding never selects an event whose rate is 0.
+        """
+        rate = sum(rates)
+        event_prob = self.stream("events").random()
+        cumulative_rate = 0
+        for index, event_rate in enumerate(rates):
+            cumulative_rate += event_rate
+            if event_prob < cumulative_rate / rate:
+                return index
+        return max((index for index, event_rate in enumerate(rates) if event_rate > 0), default=len(rates) - 1)
+
+    def checkpoint(self, state):
+        """
+        Checkpoint of the model and its working `state`, to save or to resume a run from, see `run`.
+        """
+        return take_checkpoint(self, state)
+
+    def run(self, state_init, n_steps=256, log_interval=10, record="states", observers=(), record_interval=None, method="exact", stats=None, progress=None, resume=None, checkpoint=None, checkpoint_interval=None):
+        """
+        Simulate from `state_init` until time `n_steps`.
+
+        With record="states" the result is a list of (time, state) pairs holding a copy of the state
+        after every event. With record="events" it is an EventPath that keeps the initial state and
+        the changes made by each event, and rebuilds states on demand. With record="grid" it is a list
+        of (time, state) pairs on a regular grid of spacing `record_interval` from 0 to `n_steps`, each
+        holding the state in effect at that time. With record=None nothing is recorded and None is
+        returned, e.g. when `observers` compute everything needed during the run. Observers can end the
+        run early, e.g. a `metrics.EquilibriumMonitor` once the run is at equilibrium.
+
+        With method="tau_leaping" the model advances in leaps that apply many events at once, see
+        `leap_size`, falling back to exact steps when a leap would hold few events. Recorders and
+        observers then see one step per leap.
+
+        Passing an `instrumentation.RunStats` as `stats` times each phase of the run and counts events,
+        hires, promotions and cascade depths. `progress`, if given, is called as progress(time, stats)
+        every `log_interval` of simulated time, e.g. with `instrumentation.print_progress`.
+
+        With `checkpoint`, a file name, a checkpoint of the run is saved there at the end of the run and,
+        given a `checkpoint_interval`, every `checkpoint_interval` of simulated time. Passing a checkpoint
+        (or its file) as `resume` continues that run instead of starting from `state_init`, which is then
+        ignored: the resumed run simulates exactly the events the original run would have, up to `n_steps`.
+        What is recorded and observed starts from the resumed state.
+        """
+        if method not in ("exact", "tau_leaping"):
+            raise ValueError(f"Unknown simulation method {method}.")
+        self.stats = stats
+        if stats is not None:
+            stats.start()
+        if resume is None:
+            self.time = 0.0
+            state = self.initial_state(state_init)
+        else:
+            state = restore_checkpoint(self, resume)
+        recorder = make_recorder(record, self.bias_func, n_steps, record_interval)
+        observers = list(observers) if recorder is None else [recorder, *observers]
+        if checkpoint is not None:
+            observers.append(CheckpointWriter(self, checkpoint, checkpoint_interval))
+        for observer in observers:
+            observer.start(self.time, state)
+        if stats is not None:
+            stats.lap("setup")
+        last_logged_time = self.time  # Tracks the last logged time for intervals
         
         while self.time <= n_steps:
-            current_state = path[-1][1]
-            rate = self.transition_rate(current_state)
-            time_delta = RNG.exponential(1 / rate)
+            rate = self.transition_rate(state)
+            tau = self.leap_size(state, rate) if method == "tau_leaping" else None
+            time_delta = self.stream("arrivals").exponential(1 / rate) if tau is None else tau
             self.time += time_delta
 
-            # Log the current time at regular intervals
-            if self.time >= last_logged_time + log_interval:
-                print(f"Simulation time: {self.time:.2f}")
+            # Report progress at regular intervals
+            if progress is not None and self.time >= last_logged_time + log_interval:
+                progress(self.time, stats)
                 last_logged_time = self.time
+            if stats is not None:
+                stats.lap("rates")
 
-            next_state = self.sample_next(current_state, time_delta)
-            path.append((self.time, deepcopy(next_state)))
+            for observer in observers:
+                observer.advance(self.time, state)
+            if stats is not None:
+                stats.lap("recording")
+            state = self.sample_next(state, time_delta) if tau is None else self.sample_leap(state, tau)
+            for observer in observers:
+                observer.step(self.time, state)
+            if stats is not None:
+                stats.count("steps")
+                stats.lap("recording")
+            if any(observer.should_stop() for observer in observers):
+                break
 
-        # Return a list of (time, state) pairs
-        return path
+        for observer in observers:
+            observer.finish(self.time, state)
+        if stats is not None:
+            stats.lap("recording")
+            stats.finish(self.time)
+        self.stats = None
+        return None if recorder is None else recorder.path
 
     
 
@@ -0,0 +1,175 @@
+from bisect import bisect_right
+import numpy as np
+
+# Number of events between full state copies kept by an EventPath
+KEYFRAME_INTERVAL = 1000
+
+class EventPath:
+    """
+    A simulation path stored as its initial state plus the journal of changes made by each event.
+
+    States are rebuilt on demand by replaying the journal from the nearest keyframe, a full
+    state copy kept every `keyframe_interval` events. Iterating over the path yields
+    (time, state) pairs like a recorded list of states, but replays into a single working
+    state: each yielded state is only valid until the next iteration step.
+    """
+    def __init__(self, initial_state, bias_func, keyframe_interval=KEYFRAME_INTERVAL):
+        self.bias_func = bias_func
+        self.keyframe_interval = keyframe_interval
+        self.timestamps = [initial_state.time]
+        self.changes = [()]
+        self.keyframes = [initial_state.copy()]
+        self.levels = set(np.flatnonzero(initial_state.counts.sum(axis=1)).tolist())
+
+    def append(self, time, changes, state=None):
+        """
+        Records the changes made by one event. Passing the resulting state lets the path keep keyframes.
+        """
+        self.timestamps.append(time)
+        self.changes.append(tuple(changes))
+        if state is not None:
+            self.levels.update(np.flatnonzero(state.counts.sum(axis=1)).tolist())
+        if state is not None and (len(self.timestamps) - 1) % self.keyframe_interval == 0:
+            self.keyframes.append(state.copy())
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        return self.timestamps[index], self.state_at_index(index)
+
+    def __iter__(self):
+        state = self.keyframes[0].copy()
+        yield self.timestamps[0], state
+        for time, changes in zip(self.timestamps[1:], self.changes[1:]):
+            state.replay(changes, self.bias_func)
+            yield time, state
+
+    def state_at_index(self, index):
+        """
+        Rebuilds the state right after the event with the given index.
+        """
+        keyframe = min(index // self.keyframe_interval, len(self.keyframes) - 1)
+        state = self.keyframes[keyframe].copy()
+        for changes in self.changes[keyframe * self.keyframe_interval + 1:index + 1]:
+            state.replay(changes, self.bias_func)
+        return state
+
+    def on_grid(self, times):
+        """
+        Replays the path once and returns (time, state) pairs with a copy of the state in effect at each of `times`.
+        """
+        grid = []
+        state = self.keyframes[0].copy()
+        index = 0
+        for time in sorted(times):
+            # Apply every event at or before this grid time
+            while index + 1 < len(self.timestamps) and self.timestamps[index + 1] <= time:
+                index += 1
+                state.replay(self.changes[index], self.bias_func)
+            grid.append((time, state.copy()))
+        return grid
+
+    def state_at(self, time):
+        """
+        Rebuilds the state in effect at the given time, i.e. after the last event at or before it.
+        """
+        index = bisect_right(self.timestamps, time) - 1
+        if index < 0:
+            raise ValueError(f"Time {time} is before the start of the path ({self.timestamps[0]}).")
+        return self.state_at_index(index)
+
+### OBSERVERS ###
+class Observer:
+    """
+    Hook interface for Model.run. `start` sees the initial state, `advance` the state that holds
+    until the next event at `time` (just before that event is applied), `step` the state after
+    every event and `finish` the final state. The state is the model's working state and keeps
+    changing, so observers must copy anything they want to keep. After every event the run ends
+    early if any observer's `should_stop` returns True.
+    """
+    def start(self, time, state):
+        pass
+
+    def advance(self, time, state):
+        pass
+
+    def step(self, time, state):
+        pass
+
+    def finish(self, time, state):
+        pass
+
+    def should_stop(self):
+        return False
+
+### RECORDERS ###
+class StateRecorder(Observer):
+    """
+    Records a copy of the full state after every event.
+    """
+    def start(self, time, state):
+        self.path = [(time, state.copy())]
+
+    def step(self, time, state):
+        self.path.append((time, state.copy()))
+
+class EventRecorder(Observer):
+    """
+    Records the initial state and the journal of each event as an EventPath.
+    """
+    def __init__(self, bias_func, keyframe_interval=KEYFRAME_INTERVAL):
+        self.bias_func = bias_func
+        self.keyframe_interval = keyframe_interval
+
+    def start(self, time, state):
+        self.path = EventPath(state, self.bias_func, self.keyframe_interval)
+        state.journal = []
+
+    def step(self, time, state):
+        self.path.append(time, state.journal, state)
+        state.journal = []
+
+    def finish(self, time, state):
+        state.journal = None
+
+class GridRecorder(Observer):
+    """
+    Records a copy of the state in effect at each time of a fixed grid. The state is piecewise
+    constant between events, so the copy for a grid time is the state after the last event at or
+    before it (its `time` attribute is that event's time).
+    """
+    def __init__(self, times):
+        self.times = np.sort(np.asarray(times, dtype=np.float64))
+
+    def start(self, time, state):
+        # A resumed run starts after the grid times before `time`
+        self.times = self.times[self.times >= time]
+        self.path = []
+
+    def advance(self, time, state):
+        # Every grid time before the next event sees the current state
+        end = np.searchsorted(self.times, time, side="left")
+        if end > len(self.path):
+            snapshot = state.copy()
+            self.path.extend((float(grid_time), snapshot) for grid_time in self.times[len(self.path):end])
+
+def grid_times(n_steps, record_interval):
+    """
+    Regular grid from 0 to n_steps (inclusive when it falls on the grid) with the given spacing.
+    """
+    return record_interval * np.arange(int(np.floor(n_steps / record_interval + 1e-9)) + 1)
+
+def make_recorder(record, bias_func, n_steps=None, record_interval=None):
+    if record is None:
+        return None
+    if record == "states":
+        return StateRecorder()
+    if record == "events":
+        return EventRecorder(bias_func)
+    if record == "grid":
+        if record_interval is None:
+            raise ValueError("Recording on a grid needs a record_interval.")
+        return GridRecorder(grid_times(n_steps, record_interval))
+    raise ValueError(f"Unknown recording mode {record}.")
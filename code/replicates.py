@@ -0,0 +1,186 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from base_model import BaseModel
+from state import State
+from metrics import calculate_metrics_with_weighted_averages
+from utils import RandomStreams
+from constants import *
+
+def summarize_run(path, model):
+    """
+    Default replicate summary: the time-weighted averages of every metric over the run.
+    """
+    metrics = calculate_metrics_with_weighted_averages(path, model.identities, model.population_percentages)
+    return metrics["weighted_averages"]
+
+def default_state_kwargs(model_kwargs):
+    """
+    Initial state arguments matching the model's level populations and identity population percentages.
+    """
+    identities = model_kwargs.get("identities", IDENTITIES)
+    population_percentages = model_kwargs.get("population_percentages", IDENTITY_POPULATION_PERCENTAGES)
+    return {
+        "level_populations": model_kwargs.get("level_populations", LEVEL_POPULATIONS),
+        "identities": identities,
+        "identity_probabilities": [population_percentages[identity] for identity in identities],
+    }
+
+def run_replicate(task):
+    """
+    Runs one replicate from its own random generator. Every random draw of the replicate,
+    including the initial state, comes from `seed`, so the result only depends on the task.
+    """
+    model_kwargs, state_kwargs, n_steps, seed, summary_func = task
+    rng = np.random.default_rng(seed)
+    state = State.generate_initial_state(**state_kwargs, rng=rng)
+    model = BaseModel(**model_kwargs, rng=rng)
+    path = model.run(state, n_steps, log_interval=np.inf, record="events")
+    return summary_func(path, model)
+
+def map_tasks(func, tasks, workers=None):
+    """
+    Applies `func` to every task, on a process pool unless `workers` is 1. Results keep the task order.
+    """
+    if workers == 1 or len(tasks) <= 1:
+        return [func(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, tasks))
+
+def run_replicates(
+        n_replicates,
+        seed=None,
+        n_steps=100,
+        model_kwargs=None,
+        state_kwargs=None,
+        summary_func=summarize_run,
+        workers=None
+        ):
+    """
+    Run independent replicates of a BaseModel, in parallel, and aggregate their summaries.
+
+    Parameters:
+        n_replicates (int): Number of replicates to run.
+        seed (int, optional): Root seed. Each replicate gets a generator spawned from it, so a given
+                              seed gives identical results for any number of workers.
+        n_steps (float, optional): Simulated time of each run. Defaults to 100.
+        model_kwargs (dict, optional): Keyword arguments for BaseModel. Functions must be importable module-level functions.
+        state_kwargs (dict, optional): Keyword arguments for State.generate_initial_state. Defaults to the model's populations.
+        summary_func (callable, optional): Maps (path, model) to a replicate summary. Defaults to `summarize_run`.
+        workers (int, optional): Number of worker processes. 1 runs serially in this process. Defaults to the CPU count.
+
+    Returns:
+        dict: The root seed entropy, the list of replicate summaries in replicate order, and their
+              element-wise "mean" and "std".
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    tasks = replicate_tasks(n_replicates, seed_sequence, n_steps, model_kwargs, state_kwargs, summary_func)
+    return collect_replicates(seed_sequence, map_tasks(run_replicate, tasks, workers))
+
+def replicate_tasks(n_replicates, seed_sequence, n_steps, model_kwargs=None, state_kwargs=None, summary_func=summarize_run):
+    """
+    Builds one `run_replicate` task per replicate, each with a generator seed spawned from `seed_sequence`.
+    """
+    model_kwargs = dict(model_kwargs or {})
+    state_kwargs = state_kwargs or default_state_kwargs(model_kwargs)
+    return [
+        (model_kwargs, state_kwargs, n_steps, child, summary_func)
+        for child in seed_sequence.spawn(n_replicates)
+    ]
+
+def collect_replicates(seed_sequence, summaries):
+    return {
+        "seed": seed_sequence.entropy,
+        "replicates": summaries,
+        "mean": aggregate_summaries(summaries, np.mean),
+        "std": aggregate_summaries(summaries, np.std),
+    }
+
+def aggregate_summaries(summaries, reducer):
+    """
+    Reduce a list of identically nested summary dicts element-wise, e.g. with np.mean.
+    Keys missing from some summaries are aggregated over the summaries that have them.
+    """
+    first = summaries[0]
+    if not isinstance(first, dict):
+        return float(reducer(np.array(summaries, dtype=np.float64)))
+
+    keys = list(dict.fromkeys(key for summary in summaries for key in summary))
+    return {
+        key: aggregate_summaries([summary[key] for summary in summaries if key in summary], reducer)
+        for key in keys
+    }
+
+### PAIRED REPLICATES ###
+def run_paired_replicate(task):
+    """
+    Runs every configuration of one replicate from the same initial state and with the same random streams.
+    """
+    configurations, state_kwargs, n_steps, seed, summary_func = task
+    state_seed, streams_seed = seed.spawn(2)
+    state = State.generate_initial_state(**state_kwargs, rng=np.random.default_rng(state_seed))
+    summaries = {}
+    for name, model_kwargs in configurations.items():
+        model = BaseModel(**model_kwargs, rng=np.random.default_rng(streams_seed), streams=RandomStreams(streams_seed))
+        path = model.run(state, n_steps, log_interval=np.inf, record="events")
+        summaries[name] = summary_func(path, model)
+    return summaries
+
+def subtract_summaries(summary, baseline):
+    """
+    Element-wise difference of two identically nested summary dicts, over the keys they share.
+    """
+    if not isinstance(summary, dict):
+        return float(summary) - float(baseline)
+    return {key: subtract_summaries(summary[key], baseline[key]) for key in summary if key in baseline}
+
+def run_paired_replicates(
+        configurations,
+        n_replicates,
+        seed=None,
+        n_steps=100,
+        state_kwargs=None,
+        summary_func=summarize_run,
+        workers=None
+        ):
+    """
+    Compare BaseModel configurations with common random numbers.
+
+    In every replicate each configuration starts from the same initial state and draws from the same
+    utils.RandomStreams, so they differ only through their configuration. The paired differences
+    from the first configuration then vary far less between replicates than differences of
+    independent runs, and need fewer replicates for the same confidence interval.
+
+    Parameters:
+        configurations (dict): Maps a name to the keyword arguments for BaseModel of that configuration.
+                               The first configuration is the baseline of the differences.
+        n_replicates (int): Number of replicates to run.
+        seed (int, optional): Root seed, as in `run_replicates`.
+        n_steps (float, optional): Simulated time of each run. Defaults to 100.
+        state_kwargs (dict, optional): Keyword arguments for State.generate_initial_state. Defaults to the first configuration's populations.
+        summary_func (callable, optional): Maps (path, model) to a replicate summary. Defaults to `summarize_run`.
+        workers (int, optional): Number of worker processes, as in `run_replicates`.
+
+    Returns:
+        dict: The root seed entropy, the `collect_replicates` results of every configuration under
+              "configurations", and those of the paired differences between every other
+              configuration and the baseline under "differences".
+    """
+    names = list(configurations)
+    seed_sequence = np.random.SeedSequence(seed)
+    state_kwargs = state_kwargs or default_state_kwargs(configurations[names[0]])
+    tasks = [
+        (configurations, state_kwargs, n_steps, child, summary_func)
+        for child in seed_sequence.spawn(n_replicates)
+    ]
+    summaries = map_tasks(run_paired_replicate, tasks, workers)
+    return {
+        "seed": seed_sequence.entropy,
+        "configurations": {
+            name: collect_replicates(seed_sequence, [summary[name] for summary in summaries])
+            for name in names
+        },
+        "differences": {
+            name: collect_replicates(seed_sequence, [subtract_summaries(summary[name], summary[names[0]]) for summary in summaries])
+            for name in names[1:]
+        },
+    }
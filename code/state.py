@@ -1,36 +1,663 @@
-from constants import RNG
+import heapq
+import numpy as np
+from copy import deepcopy
+from constants import *
 from employee import Employee
+from utils import SumTree, is_vectorized
+
+# Columns of the workforce table, stored as parallel typed arrays
+COLUMNS = {
+    "_ids": np.int64,
+    "_identity_codes": np.int16,
+    "_levels": np.int16,
+    "_performance": np.float64,
+    "_position_experience": np.float64,
+    "_company_experience": np.float64,
+    "_bias": np.float64,
+    "_start_time": np.float64,
+    "_position_start": np.float64,
+    "_pool_positions": np.int64,
+    "_identity_positions": np.int64,
+    "_history_length": np.int64,
+    "_history_stride": np.int64,
+    "_history_skip": np.int64,
+}
+# Public column views, in the order used when exporting a state
+STATE_COLUMNS = ["ids", "identity_codes", "levels", "performance", "position_experience", "company_experience", "bias", "start_time"]
+INITIAL_CAPACITY = 64
+INITIAL_HISTORY_CAPACITY = 16
+# Performance history policies: keep nothing, every update, a bounded evenly spaced sample, or the latest values
+HISTORY_POLICIES = ["none", "full", "downsample", "ring"]
+HISTORY_LENGTH = 64
+INITIAL_POOL_CAPACITY = 16
+
+class SlotPool:
+    """
+    Growable array of row indices with O(1) add and remove. Removing moves the last index into the
+    freed position, so callers track each row's position (State keeps it in `_pool_positions`).
+    """
+    def __init__(self, slots=()):
+        slots = np.asarray(slots, dtype=np.int64)
+        self._slots = np.zeros(max(INITIAL_POOL_CAPACITY, len(slots)), dtype=np.int64)
+        self._slots[:len(slots)] = slots
+        self.size = len(slots)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def slots(self):
+        return self._slots[:self.size]
+
+    def add(self, slot):
+        if self.size == len(self._slots):
+            grown = np.zeros(2 * len(self._slots), dtype=np.int64)
+            grown[:self.size] = self._slots
+            self._slots = grown
+        self._slots[self.size] = slot
+        self.size += 1
+        return self.size - 1
+
+    def remove(self, position):
+        """
+        Removes the index at `position` and returns the index moved into it.
+        """
+        self.size -= 1
+        moved = int(self._slots[self.size])
+        self._slots[position] = moved
+        return moved
+
+    def replace(self, position, slot):
+        self._slots[position] = slot
+
+class Candidates:
+    """
+    Rows of a state that can fill a vacancy at `level`: the members of the level below, or only those
+    with identity code `code` when a quota restricts promotions. Columns are gathered from the state
+    when accessed and are only valid until the state changes.
+    """
+    def __init__(self, state, level, code=None):
+        self.state = state
+        self.level = level
+        self.code = code
+        self.slots = state.members(level - 1, code)
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def ids(self):
+        return self.state.ids[self.slots]
+
+    @property
+    def identity_codes(self):
+        return self.state.identity_codes[self.slots]
+
+    @property
+    def performance(self):
+        return self.state.performance[self.slots]
+
+    @property
+    def position_experience(self):
+        return self.state.position_experience[self.slots]
+
+    @property
+    def bias(self):
+        return self.state.bias[self.slots]
+
+    @property
+    def max_position_experience(self):
+        return self.state.max_position_experience(self.level - 1, self.code)
 
 class State:
-    def __init__(self, employees, time=0):
-        self.employees = employees
-        self.employee_ids = [employee.id for employee in employees]
+    """
+    Workforce state stored as a struct of arrays: one typed array per employee attribute,
+    where row i of every column describes the same employee. Only the first `size` rows are live.
+    A level x identity matrix of headcounts is kept up to date alongside the columns, and an
+    id -> row index gives constant time lookup. Removing an employee moves the last row into
+    the freed one, so row order is not stable across removals.
+
+    `weight_tree(column)` returns a SumTree over one column for O(log N) weighted sampling.
+    Trees are kept current through single-row changes and rebuilt lazily after `update`.
+
+    The rows of each (level, identity code) cell are kept in a SlotPool, so `members(level)` does not scan
+    the table. Each cell also has a heap of the times its members entered their position, built on first
+    use, which gives the cell's maximum position experience in O(log N) (see `max_position_experience`).
+    The rows of each identity are kept in a SlotPool too, for O(1) identity counts and uniform draws.
+
+    When `journal` is a list, every change made to the state is appended to it as a tuple
+    so that the change can later be replayed with `replay`.
+
+    Performance histories follow the `history` policy and live in one float matrix with a row per
+    employee. "none" keeps no history, "full" every value, "downsample" at most `history_length` values
+    evenly spaced over the employee's tenure (halving the sampling rate whenever the row fills up),
+    and "ring" the latest `history_length` values.
+    """
+    def __init__(self, employees, time=0, identities=None, history="none", history_length=HISTORY_LENGTH):
         self.time = time
+        if identities is None:
+            identities = list(dict.fromkeys(employee.identity for employee in employees))
+        self.identities = list(identities)
+        self.identity_index = {identity: code for code, identity in enumerate(self.identities)}
+
+        capacity = max(INITIAL_CAPACITY, len(employees))
+        for name, dtype in COLUMNS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self._set_history_policy(history, history_length, capacity)
+        self._position_histories = {}
+        self._counts = np.zeros((0, len(self.identities)), dtype=np.int64)
+        self._slots = {}
+        self._weight_trees = {}
+        self._pools = {}
+        self._experience_heaps = {}
+        self._identity_pools = {}
+        self.size = 0
+        self.journal = None
+
+        for employee in employees:
+            self.add_employee(employee)
+
+    def copy(self):
+        """
+        Returns an independent copy of the state, without its journal.
+        """
+        state = State.__new__(State)
+        state.__dict__.update(deepcopy({name: value for name, value in self.__dict__.items() if name != "journal"}))
+        state.journal = None
+        return state
+
+    ### COLUMN VIEWS ###
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def employee_ids(self):
+        return self.ids
+
+    @property
+    def identity_codes(self):
+        return self._identity_codes[:self.size]
+
+    @property
+    def levels(self):
+        return self._levels[:self.size]
+
+    @property
+    def performance(self):
+        return self._performance[:self.size]
+
+    @property
+    def position_experience(self):
+        return self._position_experience[:self.size]
+
+    @property
+    def company_experience(self):
+        return self._company_experience[:self.size]
+
+    @property
+    def bias(self):
+        return self._bias[:self.size]
+
+    @property
+    def start_time(self):
+        return self._start_time[:self.size]
+
+    @property
+    def counts(self):
+        """
+        Headcount matrix indexed by [level, identity code].
+        """
+        return self._counts
+
+    @property
+    def employees(self):
+        """
+        Snapshots of every employee as `Employee` objects. This builds one object per row,
+        so hot paths should use the column views instead.
+        """
+        return [self.employee_at(slot) for slot in range(self.size)]
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, id):
+        return id in self._slots
+
+    ### ROW ACCESS ###
+    def identity_code(self, identity):
+        return self.identity_index[identity]
+
+    def employee_at(self, slot, with_history=True):
+        """
+        Returns a detached `Employee` snapshot of the given row. Skipping the performance
+        history makes the snapshot much cheaper to build.
+        """
+        employee_id = int(self._ids[slot])
+        level = int(self._levels[slot])
+        employee = Employee(
+            employee_id,
+            self.identities[self._identity_codes[slot]],
+            float(self._performance[slot]),
+            level,
+            float(self._start_time[slot]),
+        )
+        employee.position_experience = float(self._position_experience[slot])
+        employee.company_experience = float(self._company_experience[slot])
+        employee.bias_score = float(self._bias[slot])
+        employee.position_history = dict(self._position_histories.get(employee_id, {}))
+        employee.position_history[level] = employee.position_experience
+        if with_history:
+            employee.performance_history = self.performance_history(slot)
+        return employee
+
+    def weight_tree(self, column):
+        """
+        Returns a SumTree whose leaves are the given column (e.g. "performance" or "bias"), in row order.
+        """
+        tree = self._weight_trees.get(column)
+        if tree is None:
+            tree = SumTree(getattr(self, column))
+            self._weight_trees[column] = tree
+        return tree
+
+    def _refresh_trees(self, slot):
+        for column, tree in self._weight_trees.items():
+            tree.update(slot, getattr(self, "_" + column)[slot])
+
+    def get_slot(self, id):
+        slot = self._slots.get(id)
+        if slot is None:
+            raise ValueError(f"Employee with ID {id} not found in the state.")
+        return slot
+
+    def get_employee(self, id):
+        return self.employee_at(self.get_slot(id))
 
+    ### CANDIDATE POOLS ###
+    def members(self, level, code=None):
+        """
+        Rows at `level`, optionally only those with identity code `code`, as a new array.
+        """
+        codes = range(self._counts.shape[1]) if code is None else [code]
+        pools = [self._pools[level, code].slots for code in codes if (level, code) in self._pools]
+        return np.concatenate(pools) if pools else np.zeros(0, dtype=np.int64)
+
+    def candidates(self, level, code=None):
+        """
+        Candidates for a vacancy at `level`, see `Candidates`.
+        """
+        return Candidates(self, level, code)
+
+    def identity_count(self, code):
+        pool = self._identity_pools.get(code)
+        return 0 if pool is None else len(pool)
+
+    def identity_members(self, code):
+        pool = self._identity_pools.get(code)
+        return np.zeros(0, dtype=np.int64) if pool is None else pool.slots.copy()
+
+    def sample_identity_member(self, codes, rng):
+        """
+        Row drawn uniformly from the employees whose identity code is in `codes`, or None when there are none.
+        """
+        sizes = [self.identity_count(code) for code in codes]
+        if sum(sizes) == 0:
+            return None
+        index = int(rng.integers(sum(sizes)))
+        for code, size in zip(codes, sizes):
+            if index < size:
+                return int(self._identity_pools[code].slots[index])
+            index -= size
+
+    def max_position_experience(self, level, code=None):
+        """
+        Largest position experience at `level`, optionally among identity code `code`. 0 for empty cells.
+        """
+        codes = range(self._counts.shape[1]) if code is None else [code]
+        return max((self._cell_max_experience(level, code) for code in codes), default=0.0)
+
+    def _cell_max_experience(self, level, code):
+        pool = self._pools.get((level, code))
+        if not pool:
+            return 0.0
+        # Entries are (position start, id) and go stale when their employee leaves the cell. Stale
+        # entries are dropped when they reach the top, and the heap is rebuilt when they pile up.
+        heap = self._experience_heaps.get((level, code))
+        if heap is None or len(heap) > 2 * len(pool) + INITIAL_POOL_CAPACITY:
+            slots = pool.slots
+            heap = list(zip(self._position_start[slots].tolist(), self._ids[slots].tolist()))
+            heapq.heapify(heap)
+            self._experience_heaps[level, code] = heap
+        while True:
+            start, id = heap[0]
+            slot = self._slots.get(id)
+            if slot is not None and self._levels[slot] == level and self._identity_codes[slot] == code and self._position_start[slot] == start:
+                return float(self._position_experience[slot])
+            heapq.heappop(heap)
+
+    def _join_pool(self, slot):
+        cell = (int(self._levels[slot]), int(self._identity_codes[slot]))
+        pool = self._pools.get(cell)
+        if pool is None:
+            pool = self._pools[cell] = SlotPool()
+        self._pool_positions[slot] = pool.add(slot)
+        # Position experience grows with time, so the time it was zero stays fixed
+        self._position_start[slot] = self.time - self._position_experience[slot]
+        heap = self._experience_heaps.get(cell)
+        if heap is not None:
+            heapq.heappush(heap, (float(self._position_start[slot]), int(self._ids[slot])))
+
+    def _join_identity_pool(self, slot):
+        code = int(self._identity_codes[slot])
+        pool = self._identity_pools.get(code)
+        if pool is None:
+            pool = self._identity_pools[code] = SlotPool()
+        self._identity_positions[slot] = pool.add(slot)
+
+    def _leave_identity_pool(self, slot):
+        position = self._identity_positions[slot]
+        moved = self._identity_pools[int(self._identity_codes[slot])].remove(position)
+        self._identity_positions[moved] = position
+
+    def _leave_pool(self, slot):
+        position = self._pool_positions[slot]
+        moved = self._pools[int(self._levels[slot]), int(self._identity_codes[slot])].remove(position)
+        self._pool_positions[moved] = position
+
+    def _build_pools(self):
+        n = self.size
+        self._position_start[:n] = self.time - self._position_experience[:n]
+        self._pools = {}
+        self._experience_heaps = {}
+        num_identities = max(len(self.identities), 1)
+        cells = self._levels[:n].astype(np.int64) * num_identities + self._identity_codes[:n]
+        order = np.argsort(cells, kind="stable")
+        for group in np.split(order, np.flatnonzero(np.diff(cells[order])) + 1):
+            if len(group):
+                self._pools[divmod(int(cells[group[0]]), num_identities)] = SlotPool(group)
+                self._pool_positions[group] = np.arange(len(group))
+        self._identity_pools = {}
+        for code in range(len(self.identities)):
+            group = np.flatnonzero(self._identity_codes[:n] == code)
+            if len(group):
+                self._identity_pools[code] = SlotPool(group)
+                self._identity_positions[group] = np.arange(len(group))
+
+    ### CAPACITY ###
+    def _grow(self, capacity):
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+        history = np.zeros((capacity, self._performance_history.shape[1]), dtype=np.float64)
+        history[:self.size] = self._performance_history[:self.size]
+        self._performance_history = history
+
+    def _grow_counts(self, num_levels, num_identities):
+        counts = np.zeros((max(num_levels, self._counts.shape[0]), max(num_identities, self._counts.shape[1])), dtype=np.int64)
+        counts[:self._counts.shape[0], :self._counts.shape[1]] = self._counts
+        self._counts = counts
+
+    ### PERFORMANCE HISTORY ###
+    def _set_history_policy(self, history, history_length, capacity):
+        if history not in HISTORY_POLICIES:
+            raise ValueError(f"Unknown history policy {history}.")
+        if history in ("downsample", "ring") and history_length < 2:
+            raise ValueError("Bounded histories need a history_length of at least 2.")
+        self.history = history
+        self.history_length = history_length
+        width = {"none": 0, "full": INITIAL_HISTORY_CAPACITY}.get(history, history_length)
+        self._performance_history = np.zeros((capacity, width), dtype=np.float64)
+
+    def set_history(self, history, history_length=HISTORY_LENGTH):
+        """
+        Switches to another history policy. Histories restart from the current performance levels.
+        """
+        self._set_history_policy(history, history_length, len(self._ids))
+        n = self.size
+        self._history_stride[:n] = 1
+        self._history_skip[:n] = 0
+        self._history_length[:n] = 0
+        if history != "none":
+            self._performance_history[:n, 0] = self._performance[:n]
+            self._history_length[:n] = 1
+
+    def _grow_history(self, length):
+        history = np.zeros((self._performance_history.shape[0], max(length, 2 * self._performance_history.shape[1])), dtype=np.float64)
+        history[:, :self._performance_history.shape[1]] = self._performance_history
+        self._performance_history = history
+
+    def _compact_history(self, rows):
+        """
+        Keeps every other sample of full downsampled rows and halves their sampling rate.
+        """
+        kept = self._performance_history[rows, ::2]
+        self._performance_history[rows, :kept.shape[1]] = kept
+        self._history_length[rows] = kept.shape[1]
+        # The dropped last sample was one old stride ago, so the next one is due after one more
+        self._history_skip[rows] = self._history_stride[rows]
+        self._history_stride[rows] *= 2
+
+    def _record_performance(self):
+        n = self.size
+        if self.history == "none" or n == 0:
+            return
+        lengths = self._history_length[:n]
+        if self.history == "full":
+            if lengths.max() >= self._performance_history.shape[1]:
+                self._grow_history(lengths.max() + 1)
+            self._performance_history[np.arange(n), lengths] = self._performance[:n]
+            lengths += 1
+        elif self.history == "ring":
+            self._performance_history[np.arange(n), lengths % self.history_length] = self._performance[:n]
+            lengths += 1
+        else:
+            skip = self._history_skip[:n]
+            skip += 1
+            due = np.flatnonzero(skip >= self._history_stride[:n])
+            skip[due] = 0
+            self._performance_history[due, lengths[due]] = self._performance[due]
+            lengths[due] += 1
+            self._compact_history(due[lengths[due] == self.history_length])
+
+    def performance_history(self, slot):
+        """
+        The kept performance history of a row, oldest first. Without a history it is the current performance.
+        """
+        length = int(self._history_length[slot])
+        if self.history == "none":
+            return [float(self._performance[slot])]
+        if self.history == "ring" and length > self.history_length:
+            order = (length + np.arange(self.history_length)) % self.history_length
+            return self._performance_history[slot, order].tolist()
+        return self._performance_history[slot, :length].tolist()
+
+    def _store_history(self, slot, history):
+        """
+        Writes an employee's performance history list into their row according to the policy.
+        """
+        self._history_stride[slot] = 1
+        self._history_skip[slot] = 0
+        if self.history == "none":
+            self._history_length[slot] = 0
+        elif self.history == "full":
+            if len(history) > self._performance_history.shape[1]:
+                self._grow_history(len(history))
+            self._performance_history[slot, :len(history)] = history
+            self._history_length[slot] = len(history)
+        elif self.history == "ring":
+            kept = history[-self.history_length:]
+            self._performance_history[slot, (len(history) - len(kept) + np.arange(len(kept))) % self.history_length] = kept
+            self._history_length[slot] = len(history)
+        else:
+            stride = 1
+            while (len(history) + stride - 1) // stride >= self.history_length:
+                stride *= 2
+            kept = history[::stride]
+            self._performance_history[slot, :len(kept)] = kept
+            self._history_length[slot] = len(kept)
+            self._history_stride[slot] = stride
+            self._history_skip[slot] = (len(history) - 1) % stride
+
+    ### DYNAMICS ###
     def update(self, delta_t, bias_func):
+        if self.journal is not None:
+            self.journal.append(("update", delta_t))
         self.time += delta_t
-        for employee in self.employees:
-            employee.update_experience(delta_t)
-            employee.update_performance(delta_t)
-            employee.update_bias((bias_func(employee)), delta_t)
+        n = self.size
+        self._position_experience[:n] += delta_t
+        self._company_experience[:n] += delta_t
+
+        performance = self._performance[:n]
+        performance += delta_t * (self._position_experience[:n] * PERFORMANCE_INCREASE_RATE - self._bias[:n] * PERFORMANCE_DECREASE_RATE)
+        np.clip(performance, 0, 1, out=performance)
+        self._record_performance()
+
+        self._weight_trees.clear()
+        if is_vectorized(bias_func):
+            biases = bias_func(self._identity_codes[:n], self._levels[:n], self.identities)
+        else:
+            biases = self._scalar_biases(bias_func)
+        self._bias[:n] += biases * delta_t * BIAS_RATE_COEFFICIENT
+
+    def _scalar_biases(self, bias_func):
+        # Slow path: scalar bias functions see an Employee snapshot and bias_score changes are written back
+        biases = np.zeros(self.size, dtype=np.float64)
+        for slot in range(self.size):
+            employee = self.employee_at(slot, with_history=False)
+            biases[slot] = bias_func(employee)
+            self._bias[slot] = employee.bias_score
+        return biases
+
+    def update_bias(self, id, bias, delta_t):
+        if self.journal is not None:
+            self.journal.append(("bias", id, bias, delta_t))
+        slot = self.get_slot(id)
+        self._bias[slot] += bias * delta_t * BIAS_RATE_COEFFICIENT
+        self._refresh_trees(slot)
 
     def add_employee(self, employee):
-        self.employees.append(employee)
-        self.employee_ids.append(employee.id)
+        if self.journal is not None:
+            self.journal.append((
+                "add", employee.id, employee.identity, employee.position_level, employee.performance_level,
+                employee.position_experience, employee.company_experience, employee.bias_score, employee.start_time,
+            ))
+        if employee.id in self._slots:
+            raise ValueError(f"Employee with ID {employee.id} is already in the state.")
+        if employee.identity not in self.identity_index:
+            self.identity_index[employee.identity] = len(self.identities)
+            self.identities.append(employee.identity)
+        if self.size == len(self._ids):
+            self._grow(2 * len(self._ids))
+
+        slot = self.size
+        code = self.identity_index[employee.identity]
+        if employee.position_level >= self._counts.shape[0] or code >= self._counts.shape[1]:
+            self._grow_counts(employee.position_level + 1, len(self.identities))
+        self._counts[employee.position_level, code] += 1
+
+        self._slots[employee.id] = slot
+        self._ids[slot] = employee.id
+        self._identity_codes[slot] = code
+        self._levels[slot] = employee.position_level
+        self._performance[slot] = employee.performance_level
+        self._position_experience[slot] = employee.position_experience
+        self._company_experience[slot] = employee.company_experience
+        self._bias[slot] = employee.bias_score
+        self._start_time[slot] = employee.start_time
+
+        self._store_history(slot, employee.performance_history)
+        self._join_pool(slot)
+        self._join_identity_pool(slot)
+
+        past_positions = {level: experience for level, experience in employee.position_history.items() if level != employee.position_level}
+        if past_positions:
+            self._position_histories[employee.id] = past_positions
+        self.size += 1
+        for column, tree in self._weight_trees.items():
+            tree.append(getattr(self, "_" + column)[slot])
 
     def remove_employee(self, employee, time):
-        if employee not in self.employees:
-            raise ValueError(f"Employee with ID {employee.id} not found in the state.")
-        employee.leave(time)
-        self.employees.remove(employee)
-        self.employee_ids.remove(employee.id)
+        """
+        Removes the employee's row and returns a snapshot of them with their departure recorded.
+        """
+        if self.journal is not None:
+            self.journal.append(("remove", employee.id, time))
+        slot = self.get_slot(employee.id)
+        departed = self.employee_at(slot)
+        departed.leave(time)
+        self._position_histories.pop(departed.id, None)
+        self._counts[self._levels[slot], self._identity_codes[slot]] -= 1
+        self._leave_pool(slot)
+        self._leave_identity_pool(slot)
+
+        # Move the last row into the freed one
+        last = self.size - 1
+        del self._slots[departed.id]
+        if slot != last:
+            for name in COLUMNS:
+                column = getattr(self, name)
+                column[slot] = column[last]
+            self._performance_history[slot] = self._performance_history[last]
+            self._slots[int(self._ids[slot])] = slot
+            self._pools[int(self._levels[slot]), int(self._identity_codes[slot])].replace(self._pool_positions[slot], slot)
+            self._identity_pools[int(self._identity_codes[slot])].replace(self._identity_positions[slot], slot)
+            self._refresh_trees(slot)
+        for tree in self._weight_trees.values():
+            tree.pop()
+        self.size -= 1
+        return departed
 
     def promote_employee(self, employee):
-        if employee not in self.employees:
-            raise ValueError(f"Employee with ID {employee.id} not found in the state.")
-        employee.promote()
-    
-    def hire_employee(self, new_id, identities, identity_probabilities, position_level=0, performance_mean=0.5, performance_std=0.1):        
+        self.promote_slot(self.get_slot(employee.id))
+
+    def promote_slot(self, slot):
+        """
+        Promotes the employee in row `slot` by one level.
+        """
+        employee_id = int(self._ids[slot])
+        level = int(self._levels[slot])
+        self._position_histories.setdefault(employee_id, {})[level] = float(self._position_experience[slot])
+        code = self._identity_codes[slot]
+        if level + 1 >= self._counts.shape[0]:
+            self._grow_counts(level + 2, len(self.identities))
+        self._counts[level, code] -= 1
+        self._counts[level + 1, code] += 1
+        self._leave_pool(slot)
+        self._levels[slot] = level + 1
+        self._position_experience[slot] = 0
+        self._join_pool(slot)
+        self._refresh_trees(slot)
+        if self.journal is not None:
+            self.journal.append(("promote", employee_id, level + 1))
+
+    def replay(self, changes, bias_func):
+        """
+        Re-applies journal entries recorded by another state, in order.
+        """
+        for change in changes:
+            kind = change[0]
+            if kind == "update":
+                self.update(change[1], bias_func)
+            elif kind == "add":
+                _, id, identity, level, performance, position_experience, company_experience, bias, start_time = change
+                employee = Employee(id, identity, performance, level, start_time)
+                employee.position_experience = position_experience
+                employee.company_experience = company_experience
+                employee.bias_score = bias
+                self.add_employee(employee)
+            elif kind == "remove":
+                self.remove_employee(self.get_employee(change[1]), change[2])
+            elif kind == "promote":
+                self.promote_slot(self.get_slot(change[1]))
+            elif kind == "bias":
+                self.update_bias(change[1], change[2], change[3])
+            else:
+                raise ValueError(f"Unknown journal entry {kind}.")
+
+    def hire_employee(self, new_id, identities, identity_probabilities, position_level=0, performance_mean=0.5, performance_std=0.1, rng=None):
         new_employee = Employee.generate_employee(
             id=new_id,
             identities=identities,
@@ -39,31 +666,41 @@ class State:
             time=self.time,
             performance_mean=performance_mean,
             performance_std=performance_std,
+            rng=rng,
         )
-        
+
         self.add_employee(new_employee)
         return new_employee
-    
-    def get_employee(self, id):
-        for employee in self.employees:
-            if employee.id == id:
-                return employee
-        raise ValueError(f"Employee with ID {employee.id} not found in the state.")
 
+    ### COUNTS ###
     def get_count(self, position, identity):
-        count = 0
-        for employee in self.employees:
-            if employee.position_level == position and employee.identity == identity:
-                count += 1
-        return count
+        code = self.identity_index.get(identity)
+        if code is None or not 0 <= position < self._counts.shape[0]:
+            return 0
+        return int(self._counts[position, code])
+
+    def get_identity_counts(self, level=None):
+        if level is None:
+            counts = self._counts.sum(axis=0)
+        elif 0 <= level < self._counts.shape[0]:
+            counts = self._counts[level]
+        else:
+            counts = np.zeros(len(self.identities), dtype=np.int64)
+        return {identity: int(counts[code]) for code, identity in enumerate(self.identities)}
+
+    def cell_totals(self, column):
+        """
+        Sums a column (e.g. "performance") over the employees of each cell, indexed like `counts`.
+        """
+        num_levels, num_identities = self._counts.shape
+        cells = self.levels.astype(np.int64) * num_identities + self.identity_codes
+        totals = np.bincount(cells, weights=getattr(self, column), minlength=num_levels * num_identities)
+        return totals.reshape(num_levels, num_identities)
 
     def get_summary(self):
         summary = {}
-        for employee in self.employees:
-            position = employee.position_level
-            identity = employee.identity
-            summary.setdefault(position, {}).setdefault(identity, 0)
-            summary[position][identity] += 1
+        for position, code in zip(*np.nonzero(self._counts)):
+            summary.setdefault(int(position), {})[self.identities[code]] = int(self._counts[position, code])
         return summary
 
     def __str__(self):
@@ -73,9 +710,30 @@ class State:
             for level, identities in summary.items()
         )
         return f"Time: {self.time}\nWorkforce Summary:\n{summary_str}"
-    
+
     @staticmethod
-    def generate_initial_state(level_populations, identities, identity_probabilities, performance_mean=0.5, performance_std=0.1):
+    def from_columns(columns, identities, time=0, history="none", history_length=HISTORY_LENGTH):
+        """
+        Builds a state directly from an array for each of STATE_COLUMNS, without Employee objects.
+        Performance histories start from the current performance.
+        """
+        state = State([], time=time, identities=identities)
+        size = len(columns["ids"])
+        state._grow(max(INITIAL_CAPACITY, size))
+        for name in STATE_COLUMNS:
+            getattr(state, "_" + name)[:size] = columns[name]
+        state.size = size
+        state.set_history(history, history_length)
+
+        levels, codes = state.levels, state.identity_codes
+        state._counts = np.zeros((int(levels.max()) + 1 if size else 0, len(state.identities)), dtype=np.int64)
+        np.add.at(state._counts, (levels, codes), 1)
+        state._slots = dict(zip(state.ids.tolist(), range(size)))
+        state._build_pools()
+        return state
+
+    @staticmethod
+    def generate_initial_state(level_populations, identities, identity_probabilities, performance_mean=0.5, performance_std=0.1, rng=None, history="none", history_length=HISTORY_LENGTH):
         employees = []
         for level, population in enumerate(level_populations):
             for _ in range(population):
@@ -87,7 +745,6 @@ class State:
                     time=0,
                     performance_mean=performance_mean,
                     performance_std=performance_std,
+                    rng=rng,
                 ))
-        return State(employees)
-
-        
+        return State(employees, identities=identities, history=history, history_length=history_length)
@@ -0,0 +1,346 @@
+"""
+Columnar on-disk format for simulation paths and metric time series.
+
+A stored run is a directory of .npy files, one per column, plus a metadata.json. Columns are opened
+memory-mapped, so reading a path only touches the columns and time range that are used.
+
+Paths of states ("states" layout):
+    timestamps (T,), state_times (T,), offsets (T + 1,) into the employee rows, and one array per
+    entry of state.STATE_COLUMNS holding the employees of every state back to back.
+
+Event paths ("events" layout):
+    timestamps (T,), event_offsets (T + 1,) into the journal rows, and the journal entries of every
+    event flattened into the typed columns of JOURNAL_COLUMNS. The initial state is stored in the
+    "initial" subdirectory with the states layout.
+
+Both layouts also store counts, performance_sums and experience_sums of shape (T, levels, identities),
+the per-cell headcounts and sums of every state, so count-based metrics do not need the employee columns.
+"""
+import importlib
+import json
+import os
+import numpy as np
+from metrics import TENSORS
+from recording import EventPath
+from state import COLUMNS, State, STATE_COLUMNS
+
+# Journal entries are flattened into these columns; the values columns hold each kind's floats in order
+JOURNAL_KINDS = ["update", "add", "remove", "promote", "bias"]
+JOURNAL_COLUMNS = {"kind": np.uint8, "employee_id": np.int64, "identity_code": np.int16, "level": np.int16}
+JOURNAL_VALUES = 5
+
+### WRITING ###
+def _write_metadata(directory, metadata):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "metadata.json"), "w") as file:
+        json.dump(metadata, file, indent=2)
+
+def _open_output(directory, name, shape, dtype):
+    return np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+def _function_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+def _import_function(name):
+    module, _, qualname = name.rpartition(".")
+    return getattr(importlib.import_module(module), qualname)
+
+def _write_tensors(directory, states, num_states, num_levels, identities):
+    """
+    Writes the per-cell headcounts and sums of every state, indexed by `identities`.
+    """
+    outputs = {name: _open_output(directory, name, (num_states, num_levels, len(identities)), np.float64 if column else np.int64) for name, column in TENSORS.items()}
+    for index, state in enumerate(states):
+        # Place each of the state's identity columns at its stored position
+        positions = [identities.index(identity) for identity in state.identities]
+        for name, column in TENSORS.items():
+            values = state.counts if column is None else state.cell_totals(column)
+            outputs[name][index][:values.shape[0], positions] = values
+    for output in outputs.values():
+        output.flush()
+
+def _save_states(path, directory, identities):
+    os.makedirs(directory, exist_ok=True)
+    num_rows = sum(len(state) for _, state in path)
+    num_levels = max((state.counts.shape[0] for _, state in path), default=0)
+    timestamps = _open_output(directory, "timestamps", (len(path),), np.float64)
+    state_times = _open_output(directory, "state_times", (len(path),), np.float64)
+    offsets = _open_output(directory, "offsets", (len(path) + 1,), np.int64)
+    columns = {name: _open_output(directory, name, (num_rows,), COLUMNS["_" + name]) for name in STATE_COLUMNS}
+
+    row = 0
+    offsets[0] = 0
+    for index, (time, state) in enumerate(path):
+        timestamps[index] = time
+        state_times[index] = state.time
+        for name, column in columns.items():
+            values = getattr(state, name)
+            if name == "identity_codes":
+                # Re-encode against the stored identity list
+                values = np.array([identities.index(identity) for identity in state.identities], dtype=np.int16)[values]
+            column[row:row + len(state)] = values
+        row += len(state)
+        offsets[index + 1] = row
+
+    _write_tensors(directory, (state for _, state in path), len(path), num_levels, identities)
+    _write_metadata(directory, {"layout": "states", "identities": identities})
+
+def _journal_row(change, identities):
+    kind = change[0]
+    row = {"kind": JOURNAL_KINDS.index(kind), "employee_id": 0, "identity_code": -1, "level": -1}
+    values = ()
+    if kind == "update":
+        values = change[1:]
+    elif kind == "add":
+        _, row["employee_id"], identity, row["level"], *values = change
+        row["identity_code"] = identities.index(identity)
+    elif kind == "remove":
+        _, row["employee_id"], *values = change
+    elif kind == "promote":
+        _, row["employee_id"], row["level"] = change
+    elif kind == "bias":
+        _, row["employee_id"], *values = change
+    return row, values
+
+def _journal_change(kind, employee_id, identity, level, values):
+    kind = JOURNAL_KINDS[kind]
+    if kind == "update":
+        return (kind, values[0])
+    if kind == "add":
+        return (kind, employee_id, identity, level, *values)
+    if kind == "remove":
+        return (kind, employee_id, values[0])
+    if kind == "promote":
+        return (kind, employee_id, level)
+    return (kind, employee_id, values[0], values[1])
+
+def _save_events(path, directory, identities):
+    os.makedirs(directory, exist_ok=True)
+    _save_states([(path.timestamps[0], path.keyframes[0])], os.path.join(directory, "initial"), identities)
+
+    num_rows = sum(len(changes) for changes in path.changes)
+    timestamps = _open_output(directory, "timestamps", (len(path),), np.float64)
+    offsets = _open_output(directory, "event_offsets", (len(path) + 1,), np.int64)
+    columns = {name: _open_output(directory, name, (num_rows,), dtype) for name, dtype in JOURNAL_COLUMNS.items()}
+    values_column = _open_output(directory, "values", (num_rows, JOURNAL_VALUES), np.float64)
+
+    timestamps[:] = path.timestamps
+    row = 0
+    offsets[0] = 0
+    for index, changes in enumerate(path.changes):
+        for change in changes:
+            fields, values = _journal_row(change, identities)
+            for name, value in fields.items():
+                columns[name][row] = value
+            values_column[row, :len(values)] = values
+            row += 1
+        offsets[index + 1] = row
+
+    num_levels = max(path.levels) + 1 if path.levels else 0
+    _write_tensors(directory, (state for _, state in path), len(path), num_levels, identities)
+    _write_metadata(directory, {"layout": "events", "identities": identities, "bias_func": _function_name(path.bias_func)})
+
+def _path_identities(path):
+    if isinstance(path, EventPath):
+        identities = list(path.keyframes[0].identities)
+        for changes in path.changes:
+            identities.extend(change[2] for change in changes if change[0] == "add" and change[2] not in identities)
+        return identities
+    return list(dict.fromkeys(identity for _, state in path for identity in state.identities))
+
+def save_path(path, directory):
+    """
+    Save a path (a list of (time, state) pairs, or an EventPath) in the columnar format.
+    """
+    identities = [str(identity) for identity in _path_identities(path)]
+    if isinstance(path, EventPath):
+        _save_events(path, directory, identities)
+    else:
+        _save_states(path, directory, identities)
+
+def save_metrics(metrics, directory):
+    """
+    Save the output of `calculate_metrics_over_path` (or `calculate_metrics_with_weighted_averages`)
+    as one column per metric and level. Weighted averages and the time to equilibrium, if present, go to the metadata.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "timestamps.npy"), np.asarray(metrics["timestamps"], dtype=np.float64))
+    series = {}
+    for name, values in metrics.items():
+        if name in ("timestamps", "weighted_averages", "time_to_equilibrium"):
+            continue
+        series[name] = [str(level) for level in values]
+        for level, level_values in values.items():
+            np.save(os.path.join(directory, f"{name}.{level}.npy"), np.asarray(level_values, dtype=np.float64))
+
+    def to_json(value):
+        if isinstance(value, dict):
+            return {str(key): to_json(item) for key, item in value.items()}
+        return float(value)
+
+    metadata = {"layout": "metrics", "series": series}
+    if "weighted_averages" in metrics:
+        metadata["weighted_averages"] = to_json(metrics["weighted_averages"])
+    if "time_to_equilibrium" in metrics:
+        metadata["time_to_equilibrium"] = metrics["time_to_equilibrium"]
+    _write_metadata(directory, metadata)
+
+### READING ###
+def _read_metadata(directory):
+    with open(os.path.join(directory, "metadata.json")) as file:
+        return json.load(file)
+
+def _time_slice(timestamps, time_range):
+    if time_range is None:
+        return slice(0, len(timestamps))
+    start, end = time_range
+    return slice(int(np.searchsorted(timestamps, start, side="left")), int(np.searchsorted(timestamps, end, side="right")))
+
+class StoredPath:
+    """
+    Lazily loaded path in the columnar format. Columns are memory-mapped and states are only built
+    while iterating, one at a time, so paths larger than memory can be processed.
+
+    `time_range` restricts the path to entries with start <= time <= end. For event paths, states
+    are still replayed from the initial state, but only those in the range are yielded.
+    Indexed access to an event path keeps the last state it rebuilt and replays forward from it,
+    so reading entries in increasing order costs one replay overall.
+    """
+    def __init__(self, directory, time_range=None):
+        self.directory = directory
+        self.metadata = _read_metadata(directory)
+        self.layout = self.metadata["layout"]
+        self.identities = self.metadata["identities"]
+        self._columns = {}
+        self._cursor = None
+        all_timestamps = self.column("timestamps")
+        self.range = _time_slice(all_timestamps, time_range)
+        self.timestamps = all_timestamps[self.range]
+
+    def column(self, name):
+        """
+        Memory-mapped column over the whole stored path.
+        """
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def tensor(self, name):
+        """
+        One of "counts", "performance_sums" or "experience_sums" over the selected time range,
+        with shape (time, levels, identities).
+        """
+        return self.column(name)[self.range]
+
+    @property
+    def levels(self):
+        return set(np.flatnonzero(self.tensor("counts").sum(axis=(0, 2))).tolist())
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        return float(self.timestamps[index]), self.state_at_index(self.range.start + index)
+
+    def __iter__(self):
+        if self.layout == "states":
+            for index in range(self.range.start, self.range.stop):
+                yield float(self.column("timestamps")[index]), self.state_at_index(index)
+            return
+        for index, state in self._replay():
+            if index >= self.range.stop:
+                return
+            if index >= self.range.start:
+                yield float(self.column("timestamps")[index]), state
+
+    def state_at_index(self, index):
+        """
+        Builds the state of the given entry of the whole stored path.
+        """
+        if self.layout == "states":
+            rows = slice(self.column("offsets")[index], self.column("offsets")[index + 1])
+            columns = {name: self.column(name)[rows] for name in STATE_COLUMNS}
+            return State.from_columns(columns, self.identities, float(self.column("state_times")[index]))
+        if self._cursor is not None and self._cursor[0] == index:
+            return self._cursor[1].copy()
+        start = self._cursor if self._cursor is not None and self._cursor[0] < index else None
+        for replayed_index, state in self._replay(start):
+            if replayed_index == index:
+                self._cursor = (index, state)
+                return state.copy()
+        raise IndexError(index)
+
+    def _replay(self, start=None):
+        """
+        Replays the event path, yielding (index, state) with one working state. Starts from the initial
+        state, or continues from a replayed (index, state) without yielding it again.
+        """
+        if start is None:
+            index, state = 0, StoredPath(os.path.join(self.directory, "initial")).state_at_index(0)
+            yield index, state
+        else:
+            index, state = start
+        bias_func = _import_function(self.metadata["bias_func"])
+        offsets = self.column("event_offsets")
+        for index in range(index + 1, len(offsets) - 1):
+            state.replay(self.changes(index), bias_func)
+            yield index, state
+
+    def changes(self, index):
+        """
+        Decodes the journal entries of one event of a stored event path.
+        """
+        offsets = self.column("event_offsets")
+        rows = range(offsets[index], offsets[index + 1])
+        kinds, employee_ids = self.column("kind"), self.column("employee_id")
+        identity_codes, levels, values = self.column("identity_code"), self.column("level"), self.column("values")
+        return [
+            _journal_change(
+                int(kinds[row]), int(employee_ids[row]),
+                self.identities[identity_codes[row]] if identity_codes[row] >= 0 else None,
+                int(levels[row]), values[row].tolist(),
+            )
+            for row in rows
+        ]
+
+def load_path(directory, time_range=None):
+    """
+    Open a path saved with `save_path`, memory-mapped and restricted to `time_range` if given.
+    """
+    return StoredPath(directory, time_range)
+
+def load_metrics(directory, metric_names=None, time_range=None):
+    """
+    Load metric time series saved with `save_metrics`, memory-mapped.
+
+    Parameters:
+        directory (str): Directory written by `save_metrics`.
+        metric_names (list, optional): Metrics to load. Defaults to all of them.
+        time_range (tuple, optional): (start, end) times to restrict the series to.
+
+    Returns:
+        dict: Metrics in the format of `calculate_metrics_over_path`, with array values.
+    """
+    metadata = _read_metadata(directory)
+    timestamps = np.load(os.path.join(directory, "timestamps.npy"), mmap_mode="r")
+    selected = _time_slice(timestamps, time_range)
+    metrics = {"timestamps": timestamps[selected]}
+    for name, levels in metadata["series"].items():
+        if metric_names is not None and name not in metric_names:
+            continue
+        metrics[name] = {
+            (level if level == "company" else int(level)): np.load(os.path.join(directory, f"{name}.{level}.npy"), mmap_mode="r")[selected]
+            for level in levels
+        }
+    if "weighted_averages" in metadata:
+        metrics["weighted_averages"] = _restore_levels(metadata["weighted_averages"])
+    if "time_to_equilibrium" in metadata:
+        metrics["time_to_equilibrium"] = metadata["time_to_equilibrium"]
+    return metrics
+
+def _restore_levels(value):
+    # JSON turns level keys into strings
+    if isinstance(value, dict):
+        return {(int(key) if key.isdigit() else key): _restore_levels(item) for key, item in value.items()}
+    return value
@@ -0,0 +1,275 @@
+"""
+Declarative intervention and parameter sweeps with on-disk result caching.
+
+A grid maps BaseModel argument names, or "constants.NAME" for module constants, to lists of values:
+
+    grid = {
+        "promotion_probability_func": [base_promotion_func, random_promotion_func],
+        "quotas": [None, [0, 3, 2, 1]],
+        "constants.BIAS_DECAY_RATE": [0.9, 0.5],
+    }
+    results = run_sweep(grid, n_replicates=100, seed=0, n_steps=100)
+
+Each cell of the grid is summarized with `replicates.run_replicates` semantics and cached under
+a hash of its configuration and seed, so re-running a sweep only computes cells not seen before.
+Functions in the configuration are hashed by name and by their source and that of the package functions
+they call, so editing one or one of its helpers invalidates its cells.
+
+Constants that are only read when the package is imported cannot be swept, and are rejected
+(see IMPORT_TIME_CONSTANTS and DERIVED_CONSTANTS).
+"""
+from contextlib import contextmanager
+import hashlib
+import inspect
+import itertools
+import json
+import marshal
+import os
+import pickle
+import sys
+import sysconfig
+import types
+import numpy as np
+import constants
+from replicates import collect_replicates, default_state_kwargs, map_tasks, replicate_tasks, run_replicate, summarize_run
+
+CONSTANTS_PREFIX = "constants."
+CACHE_DIR = "sweep_cache"
+# Functions under these directories are not followed when hashing function sources
+LIBRARY_PATHS = sorted({sysconfig.get_paths()[name] for name in ["stdlib", "platstdlib", "purelib", "platlib"]})
+
+# Constants that are bound as BaseModel default arguments, and the argument they set
+MODEL_DEFAULT_CONSTANTS = {
+    "LEAVE_RATE": "leave_rate",
+    "MATERNITY_LEAVE": "maternity_leave_rate",
+    "IDENTITIES": "identities",
+    "NUM_LEVELS": "num_levels",
+    "LEVEL_POPULATIONS": "level_populations",
+    "IDENTITY_POPULATION_PERCENTAGES": "population_percentages",
+    "TAU_LEAP_EPSILON": "tau_leap_epsilon",
+}
+
+# Constants bound as default arguments of functions other than BaseModel's, which overrides do not reach
+IMPORT_TIME_CONSTANTS = {
+    "EQUILIBRIUM_BATCH_LENGTH": "metrics.time_to_equilibrium",
+    "EQUILIBRIUM_WINDOW": "metrics.time_to_equilibrium",
+    "EQUILIBRIUM_STANDARD_ERRORS": "metrics.time_to_equilibrium",
+}
+# Constants set from another constant at import, which only change along with it if overridden too
+DERIVED_CONSTANTS = {
+    "HIRING_HOMOPHILY_WEIGHT": "IDENTITY_SIMILARITY_WEIGHT",
+}
+
+def check_overrides(overrides):
+    """
+    Raises a ValueError for constant overrides that would silently have no (or only part of their) effect.
+    """
+    for name in overrides:
+        if not hasattr(constants, name):
+            raise ValueError(f"Unknown constant {name}.")
+        if name in IMPORT_TIME_CONSTANTS:
+            raise ValueError(f"{name} is bound at import as a default argument of {IMPORT_TIME_CONSTANTS[name]}, so it cannot be overridden.")
+    for derived, source in DERIVED_CONSTANTS.items():
+        if source in overrides and derived not in overrides:
+            raise ValueError(f"{derived} is set from {source} at import, so override it along with {source}.")
+
+def expand_grid(grid):
+    """
+    Expand a grid of argument lists into its cells, in product order.
+
+    Returns:
+        list: One dict per cell with "model_kwargs" and "constants" overrides.
+    """
+    names = list(grid)
+    cells = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        cell = {"model_kwargs": {}, "constants": {}}
+        for name, value in zip(names, values):
+            if name.startswith(CONSTANTS_PREFIX):
+                cell["constants"][name[len(CONSTANTS_PREFIX):]] = value
+            else:
+                cell["model_kwargs"][name] = value
+        cells.append(cell)
+    return cells
+
+def _canonical(value):
+    """
+    JSON-serializable form of a configuration value. Functions are identified by their import path.
+    """
+    if callable(value):
+        return {"function": f"{value.__module__}.{value.__qualname__}", "source": _source_hash(value)}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot hash configuration value {value!r}.")
+
+def _source_hash(func):
+    """
+    Hash of the source of `func` and of every function it calls through its module globals or
+    closure, so editing a helper such as `_normalize` also invalidates the cells using `func`.
+    """
+    digest = hashlib.sha256()
+    for source in _function_sources(func, set()):
+        digest.update(source)
+    return digest.hexdigest()
+
+def _function_sources(func, seen):
+    # Decorated helpers, e.g. lru_cache wrappers, are followed into the function they wrap
+    func = inspect.unwrap(func) if callable(func) else func
+    if not isinstance(func, types.FunctionType) or func in seen or _is_library_code(func.__code__):
+        return
+    seen.add(func)
+    try:
+        yield inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        # No source file, e.g. functions defined interactively: fall back on the compiled code
+        yield marshal.dumps(func.__code__)
+    referenced = [func.__globals__.get(name) for name in _code_names(func.__code__)]
+    referenced += [cell.cell_contents for cell in func.__closure__ or () if _cell_is_set(cell)]
+    for value in referenced:
+        yield from _function_sources(value, seen)
+
+def _code_names(code):
+    """
+    Global names used by `code` and by the functions and lambdas nested in it.
+    """
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.extend(_code_names(const))
+    return names
+
+def _cell_is_set(cell):
+    try:
+        cell.cell_contents
+    except ValueError:
+        return False
+    return True
+
+def _is_library_code(code):
+    # Installed packages and the standard library are versioned separately and are not followed
+    path = os.path.abspath(code.co_filename)
+    return any(path.startswith(os.path.abspath(root) + os.sep) for root in LIBRARY_PATHS)
+
+def config_key(config):
+    """
+    Content hash of a cell configuration, used as its cache key.
+    """
+    encoded = json.dumps(config, sort_keys=True, default=_canonical)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+@contextmanager
+def override_constants(overrides):
+    """
+    Temporarily set constants in `constants` and in every module of this package that imported
+    them with `from constants import *`.
+    """
+    package_dir = os.path.dirname(os.path.abspath(constants.__file__))
+    modules = [
+        module for module in list(sys.modules.values())
+        if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "")) == package_dir
+    ]
+    check_overrides(overrides)
+    previous = []
+    try:
+        for name, value in overrides.items():
+            original = getattr(constants, name)
+            for module in modules:
+                if module.__dict__.get(name) is original:
+                    previous.append((module, name, original))
+                    setattr(module, name, value)
+        yield
+    finally:
+        for module, name, value in reversed(previous):
+            setattr(module, name, value)
+
+def run_sweep_replicate(task):
+    overrides, replicate_task = task
+    with override_constants(overrides):
+        return run_replicate(replicate_task)
+
+def cell_config(cell, n_replicates, seed, n_steps, summary_func):
+    """
+    Full configuration of a cell: model arguments (including those set through constants that
+    are BaseModel defaults), constant overrides, initial state arguments, seed and run length.
+    """
+    check_overrides(cell["constants"])
+    model_kwargs = dict(cell["model_kwargs"])
+    for name, value in cell["constants"].items():
+        if name in MODEL_DEFAULT_CONSTANTS:
+            model_kwargs.setdefault(MODEL_DEFAULT_CONSTANTS[name], value)
+    return {
+        "model_kwargs": model_kwargs,
+        "constants": dict(cell["constants"]),
+        "state_kwargs": default_state_kwargs(model_kwargs),
+        "n_replicates": n_replicates,
+        "seed": seed,
+        "n_steps": n_steps,
+        "summary_func": summary_func,
+    }
+
+def run_sweep(grid, n_replicates, seed=0, n_steps=100, summary_func=summarize_run, cache_dir=CACHE_DIR, workers=None):
+    """
+    Run every cell of a grid and cache each cell's aggregated replicate results on disk.
+
+    Every cell uses the same root seed, so a cell's results do not depend on the rest of the grid and
+    cells are compared on the same replicate seeds.
+
+    Parameters:
+        grid (dict): Maps BaseModel argument names, or "constants.NAME", to lists of values.
+        n_replicates (int): Number of replicates per cell.
+        seed (int, optional): Root seed shared by every cell. Defaults to 0.
+        n_steps (float, optional): Simulated time of each run. Defaults to 100.
+        summary_func (callable, optional): Maps (path, model) to a replicate summary. Defaults to `summarize_run`.
+        cache_dir (str, optional): Directory of cached cell results. None disables caching.
+        workers (int, optional): Number of worker processes shared by all uncached cells.
+
+    Returns:
+        list: One dict per cell with its "config", cache "key", "result" (as returned by
+              `run_replicates`) and whether it was "cached".
+    """
+    cells = []
+    for cell in expand_grid(grid):
+        config = cell_config(cell, n_replicates, seed, n_steps, summary_func)
+        key = config_key(config)
+        result = _load_cached(cache_dir, key)
+        cells.append({"config": config, "key": key, "result": result, "cached": result is not None})
+
+    # Run the replicates of every uncached cell together, so cells share the worker pool
+    pending = [cell for cell in cells if not cell["cached"]]
+    tasks = []
+    for cell in pending:
+        config = cell["config"]
+        tasks.extend(
+            (config["constants"], task)
+            for task in replicate_tasks(
+                n_replicates, np.random.SeedSequence(seed), n_steps,
+                config["model_kwargs"], config["state_kwargs"], summary_func,
+            )
+        )
+    summaries = map_tasks(run_sweep_replicate, tasks, workers)
+
+    for index, cell in enumerate(pending):
+        cell_summaries = summaries[index * n_replicates:(index + 1) * n_replicates]
+        cell["result"] = collect_replicates(np.random.SeedSequence(seed), cell_summaries)
+        _store_cached(cache_dir, cell["key"], cell["config"], cell["result"])
+    return cells
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+def _load_cached(cache_dir, key):
+    if cache_dir is None or not os.path.exists(_cache_path(cache_dir, key)):
+        return None
+    with open(_cache_path(cache_dir, key), "rb") as file:
+        return pickle.load(file)["result"]
+
+def _store_cached(cache_dir, key, config, result):
+    if cache_dir is None:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = _cache_path(cache_dir, key) + ".tmp"
+    with open(temporary_path, "wb") as file:
+        pickle.dump({"config": json.loads(json.dumps(config, sort_keys=True, default=_canonical)), "result": result}, file)
+    os.replace(temporary_path, _cache_path(cache_dir, key))
@@ -0,0 +1,43 @@
+import numpy as np
+from batch_model import BatchModel, BatchState
+from channels import IdentityChannel, compound_identities
+from constants import *
+from utils import vectorized
+
+@vectorized
+def no_bias(identity_codes, levels, identities):
+    return np.zeros(np.shape(identity_codes))
+
+def test_counts_follow_the_rows():
+    model = BatchModel(rng=np.random.default_rng(0), quotas=[0, 8, 4, 2])
+    state = BatchState.generate_initial_state(50, LEVEL_POPULATIONS, IDENTITIES, [0.6, 0.4], rng=model.rng)
+    final = model.run(state, 30)["state"]
+
+    assert final.counts.shape == (50, len(LEVEL_POPULATIONS), len(IDENTITIES))
+    assert np.array_equal(final.counts, final._cell_sums())
+    # Cascades that find no one to promote under a quota leave their row empty
+    assert np.array_equal(final.counts.sum(axis=(1, 2)), final.present.sum(axis=1))
+    assert np.array_equal(final.replicate(7).counts, final.counts[7])
+    # Every row stays in the block of its level, and the kept totals match the rows
+    for level in range(len(LEVEL_POPULATIONS)):
+        levels = final.levels[:, final.level_columns(level)]
+        assert np.all((levels == level) | (levels < 0))
+    np.testing.assert_allclose(final.performance_totals, np.sum(final.performance, axis=1, where=final.present))
+    np.testing.assert_allclose(final.bias_totals, np.sum(final.bias, axis=1, where=final.present))
+    bias_rates = model.bias_func(final.identity_codes, final.levels, final.identities) * final.present
+    np.testing.assert_allclose(final.bias_rate_totals, bias_rates.sum(axis=1))
+
+def test_identity_channels_only_reach_their_members():
+    identities = compound_identities(["M", "F"], ["A", "B"])
+    channel = IdentityChannel("review", ["M/A"], 0.5, bias=5, return_probability=1)
+    model = BatchModel(identities=identities, bias_func=no_bias, identity_channels=[channel], rng=np.random.default_rng(0))
+    state = BatchState.generate_initial_state(20, LEVEL_POPULATIONS, identities, [0.25] * 4, rng=model.rng)
+    result = model.run(state, 10)
+
+    assert result["event_types"] == ["fire", "quit", "leave", "review"]
+    assert result["event_counts"][:, 3].sum() > 0
+    # Every review returns, and the only bias comes from reviews, so only M/A rows have any
+    final = result["state"]
+    biased = final.present & (final.bias > 0)
+    assert biased.any()
+    assert np.all(final.identity_codes[biased] == identities.index("M/A"))
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from base_model import BaseModel
+from instrumentation import RunStats
+from state import State
+from constants import *
+
+@pytest.mark.parametrize("method", ["exact", "tau_leaping"])
+def test_events_count_every_event_of_a_leap(method):
+    level_populations = [500, 250, 100, 50]
+    rng = np.random.default_rng(0)
+    state = State.generate_initial_state(level_populations, IDENTITIES, list(IDENTITY_POPULATION_PERCENTAGES.values()), rng=rng)
+    model = BaseModel(level_populations=level_populations, rng=rng)
+    stats = RunStats()
+    model.run(state, 20, record=None, method=method, stats=stats)
+
+    assert stats.events == sum(model.log.event_counts().values())
+    assert stats.events == sum(stats.counters.get(event_type, 0) for event_type in model.event_types)
+    if method == "tau_leaping":
+        assert stats.counters["leaps"] > 0
+        assert stats.events > stats.counters["steps"]
+    else:
+        assert stats.events == stats.counters["steps"]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from base_functions import base_fire_func, base_promotion_func
+from base_model import BaseModel
+from count_model import CountModel, CountState, uniform_rates
+from state import State
+from interventions import (
+    performance_promotion_func, population_hire_func, random_promotion_func, seniority_promotion_func, uniform_hire_func,
+)
+from constants import *
+
+LEVEL_SIZES = [300, 150, 60, 30]
+PROMOTION_POLICIES = [random_promotion_func, performance_promotion_func, seniority_promotion_func]
+HIRING_POLICIES = [uniform_hire_func, population_hire_func]
+
+def initial_state(engine):
+    rng = np.random.default_rng(0)
+    percentages = list(IDENTITY_POPULATION_PERCENTAGES.values())
+    if engine is CountModel:
+        return CountState.generate_initial_state(LEVEL_SIZES, IDENTITIES, percentages, rng=rng)
+    return State.generate_initial_state(LEVEL_SIZES, IDENTITIES, percentages, rng=rng)
+
+@pytest.mark.parametrize("method", ["exact", "tau_leaping"])
+@pytest.mark.parametrize("quotas", [None, [0, 40, 20, 10]])
+@pytest.mark.parametrize("engine", [BaseModel, CountModel])
+@pytest.mark.parametrize("hire_func", HIRING_POLICIES)
+@pytest.mark.parametrize("promotion_func", PROMOTION_POLICIES)
+def test_policies_run_on_every_engine(promotion_func, hire_func, engine, quotas, method):
+    if engine is CountModel and promotion_func is not random_promotion_func:
+        pytest.skip("CountModel only runs promotion policies that depend on headcounts.")
+    # Long leaps, so that this small company leaps at all
+    options = {"tau_leap_epsilon": 1} if engine is BaseModel else {"fire_func": uniform_rates(0.01)}
+    model = engine(
+        rng=np.random.default_rng(1), promotion_probability_func=promotion_func, identity_probabilities_func=hire_func,
+        level_populations=LEVEL_SIZES, quotas=quotas, **options,
+    )
+    state = initial_state(engine)
+    path = model.run(state, 10, record="events", method=method)
+    final = path[-1][1]
+    assert final.counts.sum(axis=1).tolist() == LEVEL_SIZES
+    event_counts = model.log.event_counts()
+    assert sum(event_counts.values()) > 0
+    if engine is BaseModel and method == "tau_leaping":
+        assert len(model.log.of_type("tau_leap")) > 0
+
+def test_count_model_rejects_scalar_promotion_functions():
+    def scalar_promotion_func(state, employees, level, identities):
+        return 0
+    with pytest.raises(ValueError):
+        CountModel(promotion_probability_func=scalar_promotion_func)
+
+@pytest.mark.parametrize("promotion_func", [base_promotion_func, performance_promotion_func, seniority_promotion_func])
+def test_count_model_rejects_what_counts_cannot_represent(promotion_func):
+    with pytest.raises(ValueError):
+        CountModel(fire_func=base_fire_func)
+    model = CountModel(promotion_probability_func=promotion_func, level_populations=LEVEL_SIZES, rng=np.random.default_rng(0))
+    state = initial_state(CountModel)
+    state.remove_employee(1, 0)
+    with pytest.raises(ValueError):
+        model.promote(state, 1)
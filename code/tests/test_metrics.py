@@ -0,0 +1,24 @@
+import numpy as np
+from base_model import BaseModel
+from state import State
+from metrics import EquilibriumMonitor, find_equilibrium
+from constants import *
+
+def test_noise_does_not_hide_equilibrium():
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 0.1, size=(40, 3))
+    assert find_equilibrium(noise) == 0
+
+    # A trend well above the noise is not stationary until it ends
+    trend = np.minimum(np.arange(40), 20)[:, None] * 0.05 + noise
+    start = find_equilibrium(trend)
+    assert start is not None and start >= 10
+
+def test_default_company_reaches_equilibrium():
+    for seed in range(4):
+        rng = np.random.default_rng(seed)
+        state = State.generate_initial_state(LEVEL_POPULATIONS, IDENTITIES, list(IDENTITY_POPULATION_PERCENTAGES.values()), rng=rng)
+        monitor = EquilibriumMonitor(IDENTITIES, IDENTITY_POPULATION_PERCENTAGES, stop_early=True)
+        BaseModel(rng=rng).run(state, 400, record=None, observers=[monitor])
+        assert monitor.time_to_equilibrium is not None
+        assert monitor.detection_time < 400
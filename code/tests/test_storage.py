@@ -0,0 +1,36 @@
+import numpy as np
+from base_model import BaseModel
+from constants import *
+from state import State
+from storage import load_path, save_path
+
+def _assert_same_state(a, b):
+    assert a.time == b.time
+    for column in ["ids", "levels", "performance", "bias", "position_experience"]:
+        np.testing.assert_array_equal(getattr(a, column), getattr(b, column))
+
+def test_indexed_event_path_access_matches_iteration(tmp_path):
+    rng = np.random.default_rng(0)
+    state = State.generate_initial_state(LEVEL_POPULATIONS, IDENTITIES, [0.6, 0.4], rng=rng)
+    path = BaseModel(rng=rng).run(state, 20, record="events", progress=None)
+    save_path(path, str(tmp_path))
+
+    expected = [state.copy() for _, state in load_path(str(tmp_path))]
+    stored = load_path(str(tmp_path))
+    assert len(stored) == len(expected)
+    # Forward, repeated and backward indexed access all give the replayed states
+    for index in list(range(len(stored))) + [len(stored) - 1, 3, 0, 5]:
+        _assert_same_state(stored[index][1], expected[index])
+
+def test_tensors_follow_the_stored_identity_order(tmp_path):
+    rng = np.random.default_rng(0)
+    both = State.generate_initial_state([3, 2], ["M", "F"], [0.5, 0.5], rng=rng)
+    only_f = State.generate_initial_state([4, 1], ["F"], [1.0], rng=rng)
+    save_path([(0.0, both), (1.0, only_f)], str(tmp_path))
+
+    stored = load_path(str(tmp_path))
+    assert stored.identities == ["M", "F"]
+    counts = stored.tensor("counts")
+    np.testing.assert_array_equal(counts[0], both.counts)
+    # The second state only has F, which must land in the F column rather than the first one
+    np.testing.assert_array_equal(counts[1], [[0, 4], [0, 1]])
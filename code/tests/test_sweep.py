@@ -0,0 +1,45 @@
+import pytest
+from sweep import check_overrides, config_key, run_sweep
+
+def test_bias_sweep_changes_results(tmp_path):
+    grid = {"constants.IDENTITY_BIASES": [{"M": 0.5, "F": 2}, {"M": 50.0, "F": 2}]}
+    cells = run_sweep(grid, n_replicates=2, seed=0, n_steps=20, cache_dir=str(tmp_path), workers=1)
+    low, high = (cell["result"]["mean"]["naive_biases"]["company"] for cell in cells)
+    assert low != high
+    assert cells[0]["key"] != cells[1]["key"]
+
+    # The second run is served from the cache, with the same results
+    cached = run_sweep(grid, n_replicates=2, seed=0, n_steps=20, cache_dir=str(tmp_path), workers=1)
+    assert all(cell["cached"] for cell in cached)
+    assert [cell["result"]["mean"]["naive_biases"]["company"] for cell in cached] == [low, high]
+
+@pytest.mark.parametrize("overrides", [
+    {"MAN_BIAS": 50.0},
+    {"EQUILIBRIUM_WINDOW": 5},
+    {"IDENTITY_SIMILARITY_WEIGHT": 0.1},
+])
+def test_ineffective_overrides_are_rejected(overrides, tmp_path):
+    with pytest.raises(ValueError):
+        check_overrides(overrides)
+    grid = {f"constants.{name}": [value] for name, value in overrides.items()}
+    with pytest.raises(ValueError):
+        run_sweep(grid, n_replicates=1, n_steps=1, cache_dir=str(tmp_path), workers=1)
+    assert not list(tmp_path.iterdir())
+
+def test_cache_key_depends_on_function_source():
+    def summary(path, model):
+        return 1
+    key = config_key({"summary_func": summary})
+
+    def summary(path, model):
+        return 2
+    assert config_key({"summary_func": summary}) != key
+
+def test_cache_key_depends_on_helper_source():
+    namespace = {}
+    exec("def helper():\n    return 1\ndef summary(path, model):\n    return helper()", namespace)
+    key = config_key({"summary_func": namespace["summary"]})
+
+    # Only the helper changes, the function in the configuration is the same object
+    exec("def helper():\n    return 2", namespace)
+    assert config_key({"summary_func": namespace["summary"]}) != key
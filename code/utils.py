@@ -1,5 +1,16 @@
 import numpy as np
 
+def vectorized(func):
+    """
+    Marks a policy function as array-native, so it is called once with column arrays
+    instead of once per employee.
+    """
+    func.vectorized = True
+    return func
+
+def is_vectorized(func):
+    return getattr(func, "vectorized", False)
+
 def softmax(x):
     return np.exp(x) / np.sum(np.exp(x))
 
@@ -17,4 +28,132 @@ def probabilities_from_weights(weights):
     
     return probabilities
 
+def choose(selection, rng):
+    """
+    Index picked by a policy, which returns either the index itself or a probability vector to draw it from.
+    """
+    if np.ndim(selection) == 0:
+        return int(selection)
+    return rng.choice(len(selection), p=selection)
+
+def selection_probabilities(selection, size):
+    """
+    Probability vector of a policy's result, where a selected index becomes a certain choice.
+    """
+    if np.ndim(selection) == 0:
+        probabilities = np.zeros(size, dtype=np.float64)
+        probabilities[int(selection)] = 1
+        return probabilities
+    return selection
+
+def sample_without_replacement(weights, k, rng):
+    """
+    Draws k distinct indices, each draw proportional to `weights` among the indices not yet drawn.
+    Uses exponential keys (Efraimidis-Spirakis), so it costs O(N) for any k. All-zero weights are sampled uniformly,
+    otherwise zero-weight indices are never drawn and k may not exceed the number of nonzero weights.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if weights.sum() <= 0:
+        weights = np.ones(len(weights))
+    if k > np.count_nonzero(weights):
+        raise ValueError(f"Cannot draw {k} distinct indices from {np.count_nonzero(weights)} nonzero weights.")
+    if k == len(weights):
+        return np.arange(len(weights))
+    with np.errstate(divide="ignore"):
+        keys = rng.exponential(size=len(weights)) / weights
+    return np.argpartition(keys, k - 1)[:k]
+
+# Kinds of random draws a model can take from separate generators
+RANDOM_STREAMS = ["arrivals", "events", "departures", "hiring", "promotion"]
+
+class RandomStreams:
+    """
+    One independent generator per kind of random draw in RANDOM_STREAMS: event times ("arrivals"),
+    event types and counts ("events"), departing employees and maternity returns ("departures"), hired
+    employees ("hiring") and promoted employees ("promotion").
+
+    Models given streams built from the same seed draw each kind of number from its own sequence, so
+    a change to one kind of draw, such as the promotion policy, leaves the others in step. These are
+    common random numbers for paired comparisons. The same seed always gives the same streams.
+    """
+    def __init__(self, seed=None):
+        if isinstance(seed, np.random.SeedSequence):
+            # Spawn from a fresh copy, as spawning changes a SeedSequence
+            seed = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key)
+        else:
+            seed = np.random.SeedSequence(seed)
+        for name, child in zip(RANDOM_STREAMS, seed.spawn(len(RANDOM_STREAMS))):
+            setattr(self, name, np.random.default_rng(child))
+
+class SumTree:
+    """
+    Binary tree of partial sums over a weight array. The total is available in O(1), and
+    point updates and weighted sampling cost O(log N). `rebuild` refills every leaf at once
+    with vectorized sums, which is cheaper than N point updates when all weights change.
+    """
+    def __init__(self, weights=()):
+        self.rebuild(weights)
+
+    def rebuild(self, weights, capacity=1):
+        weights = np.asarray(weights, dtype=np.float64)
+        self.size = len(weights)
+        while capacity < self.size:
+            capacity *= 2
+        self.capacity = capacity
+        self.tree = np.zeros(2 * capacity, dtype=np.float64)
+        self.tree[capacity:capacity + self.size] = weights
+
+        # Fill each level of internal nodes from the one below it
+        start = capacity
+        while start > 1:
+            self.tree[start // 2:start] = self.tree[start:2 * start:2] + self.tree[start + 1:2 * start:2]
+            start //= 2
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    @property
+    def weights(self):
+        return self.tree[self.capacity:self.capacity + self.size]
+
+    def __len__(self):
+        return self.size
+
+    def update(self, index, weight):
+        node = index + self.capacity
+        change = weight - self.tree[node]
+        while node >= 1:
+            self.tree[node] += change
+            node //= 2
+
+    def append(self, weight):
+        if self.size == self.capacity:
+            self.rebuild(self.weights, 2 * self.capacity)
+        self.size += 1
+        self.update(self.size - 1, weight)
+
+    def pop(self):
+        self.update(self.size - 1, 0)
+        self.size -= 1
+
+    def find(self, value):
+        """
+        Returns the index i such that the cumulative weight before i is <= value < cumulative weight through i.
+        """
+        node = 1
+        tree = self.tree
+        while node < self.capacity:
+            node *= 2
+            if value >= tree[node]:
+                value -= tree[node]
+                node += 1
+        return min(node - self.capacity, self.size - 1)
 
+    def sample(self, rng):
+        if self.total <= 0:
+            # If all weights are zero, sample uniformly
+            return int(rng.integers(self.size))
+        return self.find(rng.random() * self.total)
@@ -18,7 +18,8 @@ def plot_metric(
     Plots a single specified metric with high-quality visuals suitable for research papers.
 
     Parameters:
-        metrics (dict): A dictionary of metrics with keys like "timestamps", "naive_biases", "population_biases", etc.
+        metrics (dict): A dictionary of metrics with keys like "timestamps", "naive_biases", "population_biases", etc.,
+                        computed from an event path or from a path recorded on a time grid.
         metric_name (str): The name of the metric to plot (e.g., "naive_biases").
         levels (list, optional): List of levels to plot. Defaults to None (entire company only).
         title (str, optional): Title for the plot.
@@ -41,7 +42,8 @@ def plot_metric(
     for idx, level in enumerate(levels):
         values = metrics[metric_name][level]
         label = f"{metric_name.capitalize()} ({'Overall' if level == 'company' else f'Level {level}'})"
-        ax.plot(timestamps, values, label=label, linewidth=2, alpha=0.9)
+        # States are piecewise constant between timestamps, so metrics are drawn as steps
+        ax.plot(timestamps, values, label=label, linewidth=2, alpha=0.9, drawstyle="steps-post")
 
     # Set x-axis range and ticks
     ax.set_xlim(0, max_time)
@@ -107,6 +109,7 @@ def plot_identity_percentages(
             timestamps,
             cumulative,
             cumulative + identity_percentages,
+            step="post",
             label=identity,
             alpha=0.7
         )